@@ -0,0 +1,731 @@
+"""
+Benchmarks for the backend hot paths, run against fake data sources.
+
+Usage: python benchmark.py [trending] [screen] [load] [parse] [indicators] [batch] [store] [snapshot] [watchlist]
+                           [replay] [http] [startup] [serialization] [prompt] [--json results.json]
+
+`--json` writes every benchmark's numbers with the commit they ran on, for
+comparing runs between commits. Micro-benchmarks using pytest-benchmark are in
+micro_benchmarks.py.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from typing import Union
+
+import httpx
+from bs4 import BeautifulSoup
+import numpy as np
+import orjson
+import pandas as pd
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+os.environ.setdefault('GROQ_API_KEY', 'benchmark-key')
+os.environ.setdefault('LLM_CACHE_TTL', '0')
+# The stub LLM has no account quota, so measure the pipeline rather than the rate limit
+os.environ.setdefault('GROQ_REQUESTS_PER_MINUTE', '600')
+os.environ.setdefault('GROQ_TOKENS_PER_MINUTE', '10000000')
+
+import history_cache
+import main
+import compression
+import market_data
+import news_parser
+import prompts
+from price_store import PriceStore
+from indicators import IndicatorState, latest_indicators
+from quotes import FastQuoteProvider
+from llm_dispatcher import LLMDispatcher
+from schemas import AnalysisResponse, ErrorResponse, TrendingResponse
+from singleflight import SingleFlight
+from stock_agents import (
+    AsyncFinancialAnalysisAgent, AsyncIndianStockAgent, AsyncWebSearchAgent, IndianStockAgent, TrendingStocksAgent
+)
+from universe import load_universe
+
+
+def synthetic_history(symbol: str, days: int = 70) -> pd.DataFrame:
+    """Deterministic random-walk OHLCV bars for a symbol."""
+    rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+    closes = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, days)))
+    return pd.DataFrame({
+        'Open': closes, 'High': closes * 1.01, 'Low': closes * 0.99,
+        'Close': closes, 'Volume': rng.integers(10 ** 5, 10 ** 7, days)
+    }, index=pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=days))
+
+
+def latency_summary(timings, elapsed: float) -> dict:
+    """Request count, throughput and latency percentiles (ms) for one measured run."""
+    timings = np.asarray(timings) * 1000
+    return {
+        'requests': len(timings),
+        'rps': round(len(timings) / elapsed, 1),
+        'p50_ms': round(float(np.percentile(timings, 50)), 2),
+        'p95_ms': round(float(np.percentile(timings, 95)), 2),
+        'p99_ms': round(float(np.percentile(timings, 99)), 2),
+        'max_ms': round(float(timings.max()), 2)
+    }
+
+
+def print_summary(label: str, summary: dict) -> None:
+    print(f"  {label:<22} {summary['rps']:8.1f} req/s  p50 {summary['p50_ms']:8.2f} ms"
+          f"  p95 {summary['p95_ms']:8.2f} ms  p99 {summary['p99_ms']:8.2f} ms")
+
+
+class LatencyInjectingSource:
+    """History fetcher that sleeps `latency` seconds per call, like a slow upstream."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, symbol: str, period: str, interval: str) -> pd.DataFrame:
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        return synthetic_history(symbol)
+
+
+def bench_trending(latency: float = 0.2) -> None:
+    print(f"/trending computation with {latency * 1000:.0f} ms injected upstream latency")
+    for workers in (1, TrendingStocksAgent().max_workers):
+        source = LatencyInjectingSource(latency)
+        history_cache.history_cache = history_cache.HistoryCache(fetcher=source)
+
+        agent = TrendingStocksAgent(max_workers=workers)
+        start = time.perf_counter()
+        agent.get_trending_stocks()
+        agent.get_sector_performance()
+        elapsed = time.perf_counter() - start
+
+        label = 'sequential' if workers == 1 else f"pool of {workers}"
+        print(f"  {label:<12} {elapsed:6.2f}s  upstream calls: {source.calls}"
+              f"  (~{elapsed / latency:.1f} round-trips)")
+
+
+def bench_screen(sizes=(10, 500), repeat: int = 20) -> None:
+    print("Vectorized screen over a price/volume matrix already in memory")
+    for size in sizes:
+        universe = pd.Series({f"SYM{i:03d}": f"Sector {i % 12}" for i in range(size)})
+        agent = TrendingStocksAgent(universe=universe)
+        agent._histories = {symbol: synthetic_history(symbol, days=5) for symbol in universe.index}
+
+        start = time.perf_counter()
+        agent._load_matrix()
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            agent._screen = None
+            agent.get_trending_stocks()
+            agent.get_sector_performance()
+        elapsed = (time.perf_counter() - start) / repeat
+        print(f"  {size:>4} symbols  {elapsed * 1000:7.2f} ms per screen"
+              f"  (matrix build {build * 1000:.2f} ms, once per dataset)")
+
+
+class SlowStockAgent:
+    """Blocking quote/indicator source, like yfinance."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def get_stock_info(self, symbol: str) -> dict:
+        time.sleep(self.latency)
+        return {'symbol': f"{symbol}.NS", 'current_price': 100.0}
+
+    def analyze_technical_indicators(self, symbol: str) -> dict:
+        time.sleep(self.latency)
+        return {'sma20': 99.0, 'sma50': 98.0, 'rsi': 55.0}
+
+
+class SlowWebAgent:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def search(self, query: str) -> list:
+        await asyncio.sleep(self.latency)
+        return [{'title': 'Headline', 'snippet': 'Snippet'}]
+
+
+class SlowGroqClient:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.chat = self
+        self.completions = self
+
+    async def create(self, **kwargs):
+        await asyncio.sleep(self.latency)
+        message = type('Message', (), {'content': 'Stub analysis'})
+        return type('Completion', (), {'choices': [type('Choice', (), {'message': message})]})
+
+
+async def _load(concurrency: int, quote_latency: float, news_latency: float, llm_latency: float) -> dict:
+    agent = AsyncFinancialAnalysisAgent(SlowWebAgent(news_latency),
+                                        AsyncIndianStockAgent(SlowStockAgent(quote_latency)))
+    agent.groq_client = SlowGroqClient(llm_latency)
+    main.financial_agent = agent
+    history_cache.history_cache = history_cache.HistoryCache(fetcher=LatencyInjectingSource(quote_latency))
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        single = time.perf_counter()
+        await client.get('/analyze/RELIANCE')
+        single = time.perf_counter() - single
+
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(client.get(f"/analyze/SYM{i}") for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        assert all(response.status_code == 200 for response in responses)
+
+        # /health must stay responsive while /trending does blocking upstream work
+        trending = asyncio.create_task(client.get('/trending'))
+        await asyncio.sleep(0.05)
+        probe = time.perf_counter()
+        await client.get('/health')
+        probe = time.perf_counter() - probe
+        await trending
+
+    return {'single': single, 'elapsed': elapsed, 'probe': probe}
+
+
+def bench_load(concurrency: int = 20, quote_latency: float = 0.2, news_latency: float = 0.3,
+               llm_latency: float = 0.5) -> None:
+    print(f"In-process /analyze load test (quote {quote_latency}s, news {news_latency}s, LLM {llm_latency}s)")
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = asyncio.run(_load(concurrency, quote_latency, news_latency, llm_latency))
+    print(f"  one /analyze             {result['single']:6.2f}s")
+    print(f"  {concurrency} concurrent /analyze {result['elapsed']:6.2f}s"
+          f"  ({concurrency / result['elapsed']:.1f} req/s, sequential ~{result['single'] * concurrency:.1f}s)")
+    print(f"  /health during /trending {result['probe'] * 1000:6.1f} ms")
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def legacy_parse(html: str) -> list:
+    """The original WebSearchAgent parse: full html.parser tree, two lookups per field."""
+    soup = BeautifulSoup(html, 'html.parser')
+    results = []
+    for result in soup.find_all('div', class_='result'):
+        title = result.find('h2').text if result.find('h2') else ''
+        snippet = result.find('a', class_='result__snippet').text if result.find('a', class_='result__snippet') else ''
+        results.append({'title': title, 'snippet': snippet})
+    return results[:5]
+
+
+def bench_parse(repeat: int = 50) -> dict:
+    pages = sorted(name for name in os.listdir(FIXTURES_DIR) if name.endswith('.html'))
+    parsers = {'legacy bs4': legacy_parse}
+    parsers.update({name: news_parser.PARSERS[name] for name in sorted(news_parser.PARSERS)})
+    results = {}
+    for page in pages:
+        with open(os.path.join(FIXTURES_DIR, page), encoding='utf-8') as f:
+            html = f.read()
+        print(f"News parsing: {page} ({len(html) / 1024:.0f} KiB)")
+        for name, parse in parsers.items():
+            start = time.perf_counter()
+            for _ in range(repeat):
+                parse(html)
+            elapsed = (time.perf_counter() - start) / repeat
+
+            tracemalloc.start()
+            parse(html)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"  {name:<12} {elapsed * 1000:7.2f} ms  peak alloc {peak / 1024:8.1f} KiB")
+            results[f"{page}:{name}"] = {'ms': round(elapsed * 1000, 3), 'peak_kib': round(peak / 1024, 1)}
+    return results
+
+
+def legacy_indicators(hist: pd.DataFrame) -> dict:
+    """The original analyze_technical_indicators calculation: pandas rolling over the full window."""
+    closes = hist['Close']
+    delta = closes.diff()
+    gain = delta.where(delta > 0, 0).rolling(window=14).mean()
+    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
+    return {
+        'sma20': closes.rolling(window=20, min_periods=1).mean().iloc[-1],
+        'sma50': closes.rolling(window=50, min_periods=1).mean().iloc[-1],
+        'rsi': (100 - (100 / (1 + gain / loss))).iloc[-1]
+    }
+
+
+def bench_indicators(repeat: int = 2000) -> dict:
+    hist = synthetic_history('RELIANCE.NS', days=63)
+    print("Technical indicators for one symbol (63 daily bars)")
+
+    def timed(fn, n=repeat):
+        start = time.perf_counter()
+        for _ in range(n):
+            fn()
+        return (time.perf_counter() - start) / n * 1e6
+
+    state = IndicatorState().seed(hist['Close'].to_numpy())
+    closes = hist['Close'].to_numpy()
+    results = {
+        'pandas_recompute_us': timed(lambda: legacy_indicators(hist)),
+        'state_push_us': timed(lambda: state.push(closes[-1])),
+        'state_amend_us': timed(lambda: state.amend(closes[-1]))
+    }
+    print(f"  pandas rolling recompute  {results['pandas_recompute_us']:9.1f} us")
+    print(f"  state push (new bar)      {results['state_push_us']:9.1f} us")
+    print(f"  state amend (tick)        {results['state_amend_us']:9.1f} us")
+
+    history_cache.history_cache = history_cache.HistoryCache(fetcher=lambda s, p, i: hist)
+    agent = IndianStockAgent()
+    with contextlib.redirect_stdout(io.StringIO()):
+        agent.analyze_technical_indicators('RELIANCE')
+    results['agent_request_us'] = timed(lambda: agent.analyze_technical_indicators('RELIANCE'))
+    print(f"  repeated agent request    {results['agent_request_us']:9.1f} us")
+    return {name: round(value, 2) for name, value in results.items()}
+
+
+def bench_batch(size: int = 500) -> None:
+    symbols = [f"SYM{i:03d}" for i in range(size)]
+    history_cache.history_cache = history_cache.HistoryCache(
+        fetcher=lambda symbol, period, interval: synthetic_history(symbol, days=63))
+    # Warm the history cache so both paths measure only the indicator work
+    with contextlib.redirect_stdout(io.StringIO()):
+        IndianStockAgent().analyze_technical_indicators_batch(symbols)
+    print(f"Indicators for {size} symbols (63 daily bars, histories cached)")
+
+    agent = IndianStockAgent()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for symbol in symbols:
+            agent.analyze_technical_indicators(symbol)
+    print(f"  {size} per-symbol calls      {(time.perf_counter() - start) * 1000:8.1f} ms  (SMA/RSI only)")
+
+    start = time.perf_counter()
+    for symbol in symbols:
+        legacy_indicators(history_cache.get_history(f"{symbol}.NS", period='3mo'))
+    print(f"  {size} pandas recomputes     {(time.perf_counter() - start) * 1000:8.1f} ms  (SMA/RSI only)")
+
+    start = time.perf_counter()
+    IndianStockAgent().analyze_technical_indicators_batch(symbols)
+    print(f"  one batched call         {(time.perf_counter() - start) * 1000:8.1f} ms  (SMA/EMA/RSI/MACD/Bollinger)")
+
+    closes = np.column_stack([synthetic_history(symbol, days=63)['Close'].to_numpy() for symbol in symbols])
+    start = time.perf_counter()
+    latest_indicators(closes)
+    print(f"    of which matrix math   {(time.perf_counter() - start) * 1000:8.1f} ms")
+
+
+def bench_store(size: int = 500, latency: float = 0.05) -> None:
+    universe = pd.Series({f"SYM{i:03d}": 'Synthetic' for i in range(size)})
+    print(f"/trending over {size} symbols, {latency * 1000:.0f} ms injected upstream latency")
+    with tempfile.TemporaryDirectory() as root:
+        source = LatencyInjectingSource(latency)
+        for label in ('empty store', 'after restart'):
+            # A fresh in-process cache each round, as after a backend restart
+            store = PriceStore(root=root, fetcher=source)
+            history_cache.history_cache = history_cache.HistoryCache(fetcher=store.history)
+            calls = source.calls
+            start = time.perf_counter()
+            TrendingStocksAgent(universe=universe).get_trending_stocks()
+            elapsed = time.perf_counter() - start
+            print(f"  {label:<14} {elapsed:6.2f}s  upstream calls: {source.calls - calls}")
+
+
+def bench_snapshot(latency: float = 0.05, requests: int = 200) -> None:
+    print(f"/trending latency with {latency * 1000:.0f} ms injected upstream latency")
+    history_cache.history_cache = history_cache.HistoryCache(fetcher=LatencyInjectingSource(latency))
+    main.refresher = main.MarketRefresher(trending=main.load_trending, gather=main.gather_analysis_inputs)
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            start = time.perf_counter()
+            await client.get('/trending')
+            cold = time.perf_counter() - start
+            timings = []
+            for _ in range(requests):
+                start = time.perf_counter()
+                await client.get('/trending')
+                timings.append(time.perf_counter() - start)
+        return cold, np.array(timings)
+
+    cold, warm = asyncio.run(run())
+    print(f"  computed in request  {cold * 1000:8.1f} ms")
+    print(f"  from snapshot        {np.median(warm) * 1000:8.3f} ms p50  {np.percentile(warm, 99) * 1000:8.3f} ms p99")
+
+
+def bench_watchlist(size: int = 20, quote_latency: float = 0.2, news_latency: float = 0.3,
+                    llm_latency: float = 1.0) -> None:
+    symbols = [f"SYM{i:02d}" for i in range(size)]
+    agent = AsyncFinancialAnalysisAgent(SlowWebAgent(news_latency),
+                                        AsyncIndianStockAgent(SlowStockAgent(quote_latency)))
+    agent.groq_client = SlowGroqClient(llm_latency)
+    history_cache.history_cache = history_cache.HistoryCache(fetcher=LatencyInjectingSource(quote_latency))
+    print(f"Watchlist of {size} symbols ({quote_latency}s quote, {news_latency}s news, {llm_latency}s LLM, "
+          f"Groq limit {agent.llm_dispatcher.max_concurrency} concurrent)")
+
+    async def sequential():
+        for symbol in symbols:
+            await agent.analyze_stock(symbol)
+
+    async def batched(concurrency: int):
+        first = None
+        start = time.perf_counter()
+        async for _ in agent.analyze_batch(symbols, concurrency):
+            first = first or time.perf_counter() - start
+        return first
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        asyncio.run(sequential())
+        print(f"  one after another   {time.perf_counter() - start:6.2f}s", file=sys.__stdout__)
+        for concurrency in (4, 8):
+            history_cache.history_cache.clear()
+            start = time.perf_counter()
+            first = asyncio.run(batched(concurrency))
+            print(f"  batch, {concurrency} at a time  {time.perf_counter() - start:6.2f}s"
+                  f"  (first result after {first:.2f}s)", file=sys.__stdout__)
+
+
+class SyntheticSource(market_data.MarketDataProvider):
+    def history(self, symbol: str, period: str, interval: str) -> pd.DataFrame:
+        return history_cache.slice_period(synthetic_history(symbol, days=300).tz_localize('Asia/Kolkata'), period)
+
+    def fast_info(self, symbol: str) -> dict:
+        closes = synthetic_history(symbol, days=300)['Close']
+        return {'year_high': float(closes.iloc[-250:].max()), 'year_low': float(closes.iloc[-250:].min()),
+                'shares': 10 ** 8, 'market_cap': float(closes.iloc[-1]) * 10 ** 8}
+
+    def fundamentals(self, symbol: str) -> dict:
+        return {'trailing_pe': 20.0, 'trailing_eps': float(synthetic_history(symbol, days=300)['Close'].iloc[-1]) / 20}
+
+    def info(self, symbol: str) -> dict:
+        return {}
+
+
+def bench_replay(size: int = 100, latency: float = 0.02, failure_rates=(0.0, 0.1)) -> None:
+    universe = pd.Series({f"SYM{i:03d}": f"Sector {i % 12}" for i in range(size)})
+    print(f"/trending over {size} replayed symbols, {latency * 1000:.0f} ms injected latency")
+    with tempfile.TemporaryDirectory() as root:
+        market_data.record([f"{symbol}.NS" for symbol in universe.index], root=root, source=SyntheticSource(),
+               windows={'1d': '1y'})
+        for failure_rate in failure_rates:
+            runs = []
+            for _ in range(2):
+                # Same seed each run, so the same calls fail and the screen is identical
+                market_data.provider = market_data.ReplayProvider(root, latency=latency,
+                                                                  failure_rate=failure_rate, seed=1)
+                history_cache.history_cache = history_cache.HistoryCache(fetcher=history_cache.fetch_market_history)
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    result = TrendingStocksAgent(universe=universe).get_trending_stocks()
+                runs.append((time.perf_counter() - start, result, market_data.provider.stats()))
+            (elapsed, first, stats), (_, second, _) = runs
+            print(f"  failure rate {failure_rate:4.0%}  {elapsed:6.2f}s  calls: {stats['calls']}"
+                  f"  failed: {stats['failures']}  repeatable: {first == second}")
+
+
+def stub_search_client(latency: float) -> httpx.AsyncClient:
+    """DuckDuckGo stand-in serving the recorded results page after `latency` seconds."""
+    with open(os.path.join(FIXTURES_DIR, 'ddg_search.html'), encoding='utf-8') as f:
+        page = f.read()
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(latency)
+        return httpx.Response(200, text=page)
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+async def _measure(client: httpx.AsyncClient, paths, concurrency: int) -> dict:
+    """Issue `paths` with `concurrency` requests in flight and summarize their latencies."""
+    queue = list(reversed(paths))
+    timings = []
+
+    async def worker():
+        while queue:
+            path = queue.pop()
+            start = time.perf_counter()
+            response = await client.get(path)
+            timings.append(time.perf_counter() - start)
+            assert response.status_code == 200 and 'error' not in response.json(), response.text
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latency_summary(timings, time.perf_counter() - start)
+
+
+def bench_http(requests: int = 200, concurrency: int = 20, symbols: int = 20, market_latency: float = 0.02,
+               news_latency: float = 0.1, llm_latency: float = 0.3) -> dict:
+    """/analyze/{symbol} and /trending served in-process against replayed market data, stub search and stub Groq."""
+    universe = load_universe('NIFTY50')
+    tickers = list(universe.index[:symbols])
+    print(f"In-process HTTP load, {concurrency} concurrent (market data {market_latency}s, "
+          f"news {news_latency}s, LLM {llm_latency}s)")
+    with tempfile.TemporaryDirectory() as root:
+        market_data.record([f"{symbol}.NS" for symbol in universe.index], root=root, source=SyntheticSource(),
+                           windows={'1d': '1y'})
+        market_data.provider = market_data.ReplayProvider(root, latency=market_latency)
+        history_cache.history_cache = history_cache.HistoryCache(fetcher=history_cache.fetch_market_history)
+
+        agent = AsyncFinancialAnalysisAgent(
+            AsyncWebSearchAgent(client=stub_search_client(news_latency)),
+            AsyncIndianStockAgent(IndianStockAgent(quote_provider=FastQuoteProvider()))
+        )
+        agent.groq_client = SlowGroqClient(llm_latency)
+        # Measure the serving path, not the Groq account quota
+        agent.llm_dispatcher = LLMDispatcher(requests_per_minute=10 ** 6, tokens_per_minute=10 ** 9,
+                                             max_concurrency=10 ** 6)
+        main.financial_agent = agent
+        main.analysis_flights = SingleFlight()
+        main.trending_flights = SingleFlight()
+        main.refresher = main.MarketRefresher(trending=main.load_trending, gather=main.gather_analysis_inputs)
+
+        async def run():
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=60) as client:
+                analyze = await _measure(client, [f"/analyze/{tickers[i % len(tickers)]}" for i in range(requests)],
+                                         concurrency)
+                trending = await _measure(client, ['/trending'] * requests, concurrency)
+            return {'analyze': analyze, 'trending': trending}
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = asyncio.run(run())
+    print_summary('/analyze/{symbol}', results['analyze'])
+    print_summary('/trending', results['trending'])
+    return results
+
+
+def import_profile(module: str = 'main', env: dict = None) -> tuple:
+    """Wall time of a fresh interpreter importing `module`, and -X importtime's per-module cumulative us."""
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"], env=env,
+                            capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stderr
+    wall = time.perf_counter() - start
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nesting is shown by indentation; keep the top-level imports and main's direct ones
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1:
+            modules[name.strip()] = max(modules.get(name.strip(), 0), int(cumulative))
+    return wall, modules
+
+
+def bench_startup(runs: int = 5, top: int = 8) -> dict:
+    """Cold import of the backend, as a container start or new worker pays it."""
+    env = {key: value for key, value in os.environ.items() if key != 'GROQ_API_KEY'}
+    env['MARKET_REFRESH'] = '0'
+    profiles = [import_profile('main', env) for _ in range(runs)]
+    walls = sorted(wall for wall, _ in profiles)
+    imports = sorted(modules['main'] for _, modules in profiles)
+    _, modules = profiles[-1]
+    heaviest = sorted(((us, name) for name, us in modules.items() if name != 'main'), reverse=True)[:top]
+
+    print(f"Cold start: interpreter + import main, median of {runs}")
+    print(f"  process wall time     {np.median(walls) * 1000:8.1f} ms")
+    print(f"  import main           {np.median(imports) / 1000:8.1f} ms")
+    for us, name in heaviest:
+        print(f"    {name:<20}{us / 1000:8.1f} ms")
+    return {
+        'wall_ms': round(float(np.median(walls)) * 1000, 1),
+        'import_main_ms': round(float(np.median(imports)) / 1000, 1),
+        'heaviest_ms': {name: round(us / 1000, 1) for us, name in heaviest}
+    }
+
+
+# Stands in for a long LLM answer: ~4 KiB of markdown, as the analysis prompt asks for
+SAMPLE_ANALYSIS = "\n\n".join(
+    f"{number}. **{heading}**: The stock closed above its 20-day average while RSI stayed in neutral territory. "
+    "Volumes were in line with the monthly average, and the recent news flow is mixed, with brokerages "
+    "revising targets on margin guidance. Watch the 50-day average as support before adding to positions."
+    for number, heading in enumerate(['Current market position', 'Technical analysis', 'News impact',
+                                      'Short-term outlook', 'Long-term outlook', 'Recommendation',
+                                      'Risk factors', 'Sector comparison', 'Key levels', 'Summary'], 1)
+)
+
+
+def serialization_payloads() -> dict:
+    """An /analyze and a /trending payload built by the real agents from synthetic market data."""
+    history_cache.history_cache = history_cache.HistoryCache(fetcher=lambda s, p, i: synthetic_history(s, 80))
+    main.refresher = main.MarketRefresher(trending=main.load_trending, gather=main.gather_analysis_inputs)
+    with open(os.path.join(FIXTURES_DIR, 'ddg_search.html'), encoding='utf-8') as f:
+        news = news_parser.parse_results(f.read())
+    with contextlib.redirect_stdout(io.StringIO()):
+        technical = IndianStockAgent().analyze_technical_indicators('RELIANCE')
+        trending = main.compute_trending('NIFTY50')
+    quote = {
+        'symbol': 'RELIANCE.NS', 'current_price': 2950.35, 'day_high': 2968.0, 'day_low': 2931.1,
+        'volume': 5234987, 'market_cap': 19963500000000, 'pe_ratio': 28.41, '52_week_high': 3217.9,
+        '52_week_low': 2220.3, 'last_updated': time.strftime('%Y-%m-%d %H:%M:%S')
+    }
+    analysis = {'stock_data': quote, 'technical_data': technical, 'news_data': news, 'analysis': SAMPLE_ANALYSIS}
+    now = time.time()
+    return {
+        '/analyze/{symbol}': (main.Snapshot(analysis, now).payload(now), AnalysisResponse),
+        '/trending': (main.Snapshot(trending, now).payload(now), TrendingResponse)
+    }
+
+
+def bench_serialization(repeat: int = 2000) -> dict:
+    """
+    CPU per response and bytes on the wire: the previous path (jsonable_encoder and
+    stdlib json, uncompressed) against the response model, orjson and compression.
+    """
+    print(f"Response serialization, mean of {repeat} (CompressionMiddleware threshold "
+          f"{compression.COMPRESSION_MIN_SIZE} bytes)")
+    results = {}
+    for route, (payload, model) in serialization_payloads().items():
+        adapter = TypeAdapter(Union[model, ErrorResponse])
+
+        def before():
+            return main.JSONResponse(jsonable_encoder(payload)).body
+
+        def after():
+            content = adapter.dump_python(adapter.validate_python(payload), mode='json', exclude_unset=True)
+            return orjson.dumps(content, option=main.ORJSON_OPTIONS)
+
+        timings = {}
+        for label, serialize in (('before', before), ('after', after)):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                body = serialize()
+            timings[label] = (time.perf_counter() - start) / repeat
+        assert json.loads(before()) == json.loads(after())
+
+        sizes = {'json': len(body), 'gzip': len(zlib.compress(body, compression.GZIP_LEVEL))}
+        start = time.perf_counter()
+        for _ in range(repeat):
+            zlib.compress(body, compression.GZIP_LEVEL)
+        gzip_us = (time.perf_counter() - start) / repeat * 10 ** 6
+        if compression.brotli is not None:
+            sizes['br'] = len(compression.brotli.compress(body, quality=compression.BROTLI_QUALITY))
+
+        print(f"  {route}")
+        print(f"    encode      before {timings['before'] * 10 ** 6:8.1f} us  after {timings['after'] * 10 ** 6:8.1f} us"
+              f"  ({timings['before'] / timings['after']:.1f}x)")
+        print(f"    on the wire before {sizes['json']:8d} B   after "
+              + '  '.join(f"{name} {size} B" for name, size in sizes.items() if name != 'json')
+              + f"  (gzip {gzip_us:.0f} us)")
+        results[route] = {
+            'encode_before_us': round(timings['before'] * 10 ** 6, 1),
+            'encode_after_us': round(timings['after'] * 10 ** 6, 1),
+            'gzip_us': round(gzip_us, 1),
+            'bytes': sizes
+        }
+    return results
+
+
+def legacy_prompt(symbol: str, stock_data: dict, technical_data: dict, news_data: list) -> list:
+    """The prompt as first written: raw reprs of every input and the instructions repeated."""
+    return [{"role": "system", "content": prompts.ANALYST_SYSTEM_PROMPT}, {"role": "user", "content": f"""
+        Analyze the following data for {symbol}:
+
+        Stock Data: {stock_data}
+        Technical Indicators: {technical_data}
+        Recent News: {news_data}
+
+        Please provide a comprehensive analysis including:
+        1. Current market position and valuation
+        2. Technical analysis interpretation (if data available)
+        3. News sentiment analysis
+        4. Trading recommendation (Short-term and Long-term)
+        5. Key risks and opportunities
+        6. Also tell if I buy at the current price, what should be the target price and stop loss. Explain your reasoning.
+
+
+        Note: If some data is missing or shows errors, please focus on the available data and mention the limitations in your analysis.
+        Also tell if I buy at the current price, what should be the target price and stop loss.
+        """}]
+
+
+def bench_prompt(repeat: int = 2000) -> dict:
+    """Estimated prompt tokens and build time, before and after the budgeted builder."""
+    payload, _ = serialization_payloads()['/analyze/{symbol}']
+    with open(os.path.join(FIXTURES_DIR, 'ddg_search.html'), encoding='utf-8') as f:
+        # Search pages often repeat a story across sources
+        news = news_parser.parse_results(f.read(), limit=10) * 2
+    cases = {
+        'full data': (payload['stock_data'], payload['technical_data'], news),
+        'upstream errors': ({**payload['stock_data'], 'pe_ratio': 'N/A', 'market_cap': 'N/A'},
+                            {'error': 'Insufficient data points. Got 20, need at least 50'}, news)
+    }
+    print(f"Analysis prompt size (estimated tokens, budget {prompts.PROMPT_TOKEN_BUDGET})")
+    results = {}
+    for case, inputs in cases.items():
+        sizes = {}
+        for label, build in (('before', legacy_prompt), ('after', prompts.build_analysis_messages)):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                messages = build('RELIANCE', *inputs)
+            sizes[label] = prompts.count_message_tokens(messages)
+            sizes[f"{label}_us"] = round((time.perf_counter() - start) / repeat * 10 ** 6, 1)
+        print(f"  {case:<16} before {sizes['before']:5d} tokens  after {sizes['after']:5d} tokens"
+              f"  (build {sizes['after_us']:.0f} us)")
+        results[case] = sizes
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or 'unknown'
+    except OSError:
+        return 'unknown'
+
+
+BENCHMARKS = {
+    'trending': bench_trending,
+    'screen': bench_screen,
+    'load': bench_load,
+    'parse': bench_parse,
+    'indicators': bench_indicators,
+    'batch': bench_batch,
+    'store': bench_store,
+    'snapshot': bench_snapshot,
+    'watchlist': bench_watchlist,
+    'replay': bench_replay,
+    'http': bench_http,
+    'startup': bench_startup,
+    'serialization': bench_serialization,
+    'prompt': bench_prompt
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Backend benchmarks')
+    parser.add_argument('names', nargs='*', help=f"Any of: {', '.join(BENCHMARKS)} (default all)")
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Unknown benchmark: {', '.join(unknown)}")
+
+    results = {}
+    for name in args.names or BENCHMARKS:
+        result = BENCHMARKS[name]()
+        if result is not None:
+            results[name] = result
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({
+                'commit': git_commit(),
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'results': results
+            }, f, indent=2)
+        print(f"Results written to {args.json}")
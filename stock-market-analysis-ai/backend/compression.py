@@ -0,0 +1,77 @@
+"""
+Response compression for JSON payloads above a size threshold.
+
+Brotli is used when the client accepts it and the optional `brotli` package is
+installed, gzip otherwise. Bodies smaller than `minimum_size` go out as they are,
+since compressing them costs more CPU than it saves on the wire. Server-Sent Events
+are never compressed, so each analysis token still reaches the browser as soon as
+it is sent.
+"""
+import os
+
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import DEFAULT_EXCLUDED_CONTENT_TYPES, GZipResponder, IdentityResponder
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Smallest body, in bytes, worth compressing
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+# Levels tuned for per-request compression rather than the smallest output
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+class BrotliResponder(IdentityResponder):
+    content_encoding = 'br'
+
+    def __init__(self, app, minimum_size: int, quality: int = BROTLI_QUALITY, **kwargs):
+        super().__init__(app, minimum_size, **kwargs)
+        self.quality = quality
+        self._compressor = None
+
+    async def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        if self._compressor is None:
+            self._compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=self.quality)
+        if more_body:
+            # Flush each chunk of a streamed response, so NDJSON lines are not held back
+            return self._compressor.process(body) + self._compressor.flush()
+        return self._compressor.process(body) + self._compressor.finish()
+
+
+def _accepts(accept_encoding: str, encoding: str) -> bool:
+    for part in accept_encoding.lower().split(','):
+        name, _, params = part.partition(';')
+        if name.strip() == encoding:
+            return params.replace(' ', '') not in ('q=0', 'q=0.0')
+    return False
+
+
+class CompressionMiddleware:
+    """Brotli or gzip `Content-Encoding` for response bodies of at least `minimum_size` bytes."""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE, gzip_level: int = GZIP_LEVEL,
+                 brotli_quality: int = BROTLI_QUALITY, exclude_content_types=DEFAULT_EXCLUDED_CONTENT_TYPES):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.exclude_content_types = tuple(exclude_content_types)
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = Headers(scope=scope).get('accept-encoding', '')
+        if brotli is not None and _accepts(accept_encoding, 'br'):
+            responder = BrotliResponder(self.app, self.minimum_size, quality=self.brotli_quality,
+                                        exclude_content_types=self.exclude_content_types)
+        elif _accepts(accept_encoding, 'gzip'):
+            responder = GZipResponder(self.app, self.minimum_size, compresslevel=self.gzip_level,
+                                      exclude_content_types=self.exclude_content_types)
+        else:
+            responder = IdentityResponder(self.app, self.minimum_size,
+                                          exclude_content_types=self.exclude_content_types)
+        await responder(scope, receive, send)
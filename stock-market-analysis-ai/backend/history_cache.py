@@ -0,0 +1,213 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Optional
+
+import pandas as pd
+
+from tracing import span
+
+IST = timezone(timedelta(hours=5, minutes=30))
+
+# Seconds a cached window stays fresh, per bar interval
+MARKET_HOURS_TTLS = {
+    '1m': 30, '2m': 45, '5m': 60, '15m': 120, '30m': 180, '60m': 300, '1h': 300,
+    '1d': 300, '5d': 900, '1wk': 1800, '1mo': 3600
+}
+OFF_HOURS_TTLS = {
+    '1m': 900, '2m': 900, '5m': 900, '15m': 1800, '30m': 1800, '60m': 3600, '1h': 3600,
+    '1d': 3600, '5d': 3600, '1wk': 6 * 3600, '1mo': 6 * 3600
+}
+
+# Smallest window fetched per interval, so short lookups warm the cache for longer ones
+MIN_FETCH_PERIODS = {'1d': '3mo'}
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Windows are served as views of the cached bars, which is only safe with copy-on-write
+# (always on from pandas 3)
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+
+def is_market_open(now: Optional[datetime] = None) -> bool:
+    """Check whether NSE is in its regular trading session (09:15-15:30 IST, Mon-Fri)."""
+    now = (now or datetime.now(IST)).astimezone(IST)
+    if now.weekday() >= 5:
+        return False
+    minutes = now.hour * 60 + now.minute
+    return 9 * 60 + 15 <= minutes <= 15 * 60 + 30
+
+
+def period_days(period: str) -> float:
+    """Approximate length of a yfinance period string in calendar days."""
+    if period == 'max':
+        return float('inf')
+    if period == 'ytd':
+        today = datetime.now(IST)
+        return (today - today.replace(month=1, day=1)).days + 1
+    for suffix, days in (('mo', 30), ('d', 1), ('y', 365), ('wk', 7)):
+        if period.endswith(suffix):
+            return int(period[:-len(suffix)]) * days
+    raise ValueError(f"Unsupported period: {period}")
+
+
+def slice_period(frame: pd.DataFrame, period: str) -> pd.DataFrame:
+    """Cut the trailing `period` out of a longer history window."""
+    if frame.empty or period == 'max':
+        return frame
+    last = frame.index[-1]
+    # Bars are in time order, so a positional slice finds the window without copying it
+    if period == 'ytd':
+        start = last.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+        return frame.iloc[frame.index.searchsorted(start, side='left'):]
+    if period.endswith('d'):
+        # Day periods count trading sessions, like yfinance does
+        sessions = frame.index.normalize().unique()
+        first = sessions[-int(period[:-1]):][0]
+        return frame.iloc[frame.index.searchsorted(first, side='left'):]
+    if period.endswith('mo'):
+        start = last - pd.DateOffset(months=int(period[:-2]))
+    elif period.endswith('wk'):
+        start = last - pd.DateOffset(weeks=int(period[:-2]))
+    else:
+        start = last - pd.DateOffset(years=int(period[:-1]))
+    return frame.iloc[frame.index.searchsorted(start, side='right'):]
+
+
+def fetch_market_history(symbol: str, period: str, interval: str) -> pd.DataFrame:
+    """Bars straight from the configured market data provider."""
+    # Imported here because the providers build on this module's helpers
+    import market_data
+    return market_data.provider.history(symbol, period, interval)
+
+
+class _Entry:
+    __slots__ = ('frame', 'period', 'fetched_at', 'nbytes')
+
+    def __init__(self, frame: pd.DataFrame, period: str, fetched_at: float):
+        self.frame = frame
+        self.period = period
+        self.fetched_at = fetched_at
+        self.nbytes = int(frame.memory_usage(deep=True).sum())
+
+
+class HistoryCache:
+    """In-process OHLCV cache keyed by (symbol, interval) with TTL and LRU eviction."""
+
+    def __init__(self, fetcher: Callable[[str, str, str], pd.DataFrame] = fetch_market_history,
+                 max_bytes: int = DEFAULT_MAX_BYTES,
+                 market_hours_ttls: Optional[Dict[str, float]] = None,
+                 off_hours_ttls: Optional[Dict[str, float]] = None,
+                 clock: Callable[[], float] = time.time,
+                 market_open: Callable[[], bool] = is_market_open):
+        self.fetcher = fetcher
+        self.max_bytes = max_bytes
+        self.market_hours_ttls = market_hours_ttls or MARKET_HOURS_TTLS
+        self.off_hours_ttls = off_hours_ttls or OFF_HOURS_TTLS
+        self.clock = clock
+        self.market_open = market_open
+        self._entries: 'OrderedDict[tuple, _Entry]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def ttl(self, interval: str) -> float:
+        ttls = self.market_hours_ttls if self.market_open() else self.off_hours_ttls
+        return ttls.get(interval, ttls['1d'])
+
+    def history(self, symbol: str, period: str = '1mo', interval: str = '1d') -> pd.DataFrame:
+        """Return `period` of bars for `symbol`, slicing a cached longer window when possible."""
+        key = (symbol, interval)
+        wanted = period_days(period)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.clock() - entry.fetched_at < self.ttl(interval):
+                if period_days(entry.period) >= wanted:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._window(entry, period)
+            self.misses += 1
+
+        # Fetch the widest window we know callers need so later lookups are hits
+        fetch_period = period
+        for candidate in (MIN_FETCH_PERIODS.get(interval), entry.period if entry else None):
+            if candidate and period_days(candidate) > period_days(fetch_period):
+                fetch_period = candidate
+
+        frame = self.fetcher(symbol, fetch_period, interval)
+        if frame is None or frame.empty:
+            return pd.DataFrame() if frame is None else frame
+        entry = _Entry(frame, fetch_period, self.clock())
+        self._store(key, entry)
+        return self._window(entry, period)
+
+    @staticmethod
+    def _window(entry: _Entry, period: str) -> pd.DataFrame:
+        # A view of the cached (often memory-mapped) bars rather than a copy; with
+        # copy-on-write a caller that writes to it gets its own copy, never the cache's
+        window = entry.frame if period == entry.period else slice_period(entry.frame, period)
+        return window.iloc[:]
+
+    def fetched_at(self, symbol: str, interval: str = '1d') -> Optional[float]:
+        """When the fresh cached window for (symbol, interval) was fetched, or None."""
+        with self._lock:
+            entry = self._entries.get((symbol, interval))
+            if entry is None or self.clock() - entry.fetched_at >= self.ttl(interval):
+                return None
+            return entry.fetched_at
+
+    def _store(self, key: tuple, entry: _Entry) -> None:
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._entries[key] = entry
+            self._bytes += entry.nbytes
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes
+            }
+
+
+def fetch_from_price_store(symbol: str, period: str, interval: str) -> pd.DataFrame:
+    """Read bars through the on-disk price store, which only downloads what it is missing."""
+    # Imported here because the price store builds on this module's helpers
+    from price_store import price_store
+    return price_store.history(symbol, period, interval)
+
+
+# Shared cache used by every agent in the process
+history_cache = HistoryCache(fetcher=fetch_from_price_store)
+
+
+def get_history(symbol: str, period: str = '1mo', interval: str = '1d') -> pd.DataFrame:
+    """Cached replacement for `yf.Ticker(symbol).history(period=..., interval=...)`."""
+    with span('history'):
+        return history_cache.history(symbol, period, interval)
+
+
+def get_history_version(symbol: str, interval: str = '1d') -> Optional[float]:
+    """Fetch time of the cached window for `symbol`; changes whenever the window is refreshed."""
+    return history_cache.fetched_at(symbol, interval)
@@ -0,0 +1,294 @@
+import math
+from collections import deque
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class IndicatorState:
+    """
+    Running SMA and RSI over a stream of closes, updated in O(1) per bar.
+
+    `push` appends a new bar and `amend` replaces the close of the latest bar
+    (an intraday tick for a bar that is still forming). With rsi_method='sma'
+    the values match the pandas implementation previously used by
+    IndianStockAgent: rolling(min_periods=1) means for the SMAs and a plain
+    rolling mean of gains and losses for RSI. rsi_method='wilder' uses Wilder's
+    smoothing instead.
+    """
+
+    # Re-sum the windows every this many updates so float drift cannot build up
+    RESYNC_EVERY = 1000
+
+    def __init__(self, short_window: int = 20, long_window: int = 50, rsi_window: int = 14,
+                 rsi_method: str = 'sma'):
+        if rsi_method not in ('sma', 'wilder'):
+            raise ValueError(f"Unknown RSI method: {rsi_method}")
+        self.short_window = short_window
+        self.long_window = long_window
+        self.rsi_window = rsi_window
+        self.rsi_method = rsi_method
+        self.reset()
+
+    def reset(self) -> None:
+        self.closes = deque(maxlen=max(self.short_window, self.long_window) + 1)
+        self.gains = deque(maxlen=self.rsi_window)
+        self.losses = deque(maxlen=self.rsi_window)
+        self.count = 0
+        self.short_sum = 0.0
+        self.long_sum = 0.0
+        self.gain_sum = 0.0
+        self.loss_sum = 0.0
+        # Wilder averages before and after the latest bar, so it can be amended
+        self.avg_gain = self.avg_loss = None
+        self.prev_avg_gain = self.prev_avg_loss = None
+        self._updates = 0
+
+    def seed(self, closes: Iterable[float]) -> 'IndicatorState':
+        """Reset and replay a history of closes."""
+        self.reset()
+        for close in closes:
+            self.push(close)
+        return self
+
+    def _leaving(self, window: int) -> Optional[float]:
+        # Close that just dropped out of a `window`-bar window, if the window was full
+        return self.closes[-1 - window] if window < self.count else None
+
+    def push(self, close: float) -> None:
+        """Add a new bar."""
+        close = float(close)
+        previous = self.closes[-1] if self.closes else None
+        self.closes.append(close)
+        self.count += 1
+
+        self.short_sum += close - (self._leaving(self.short_window) or 0.0)
+        self.long_sum += close - (self._leaving(self.long_window) or 0.0)
+
+        if previous is not None:
+            self._push_delta(close - previous)
+        elif self.rsi_method == 'sma':
+            # The pandas reference counts the first bar as a zero gain and zero loss
+            self._push_delta(0.0)
+
+        self._updates += 1
+        if self._updates >= self.RESYNC_EVERY:
+            self._resync()
+
+    def amend(self, close: float) -> None:
+        """Replace the close of the latest bar."""
+        if not self.closes:
+            self.push(close)
+            return
+        close = float(close)
+        change = close - self.closes[-1]
+        self.closes[-1] = close
+        self.short_sum += change
+        self.long_sum += change
+
+        if self.count > 1:
+            gain, loss = self._split(close - self.closes[-2])
+            self.gain_sum += gain - self.gains[-1]
+            self.loss_sum += loss - self.losses[-1]
+            self.gains[-1] = gain
+            self.losses[-1] = loss
+            if self.rsi_method == 'wilder':
+                if self.prev_avg_gain is not None:
+                    self._smooth(gain, loss)
+                elif self.avg_gain is not None:
+                    self.avg_gain = self.gain_sum / self.rsi_window
+                    self.avg_loss = self.loss_sum / self.rsi_window
+
+        self._updates += 1
+        if self._updates >= self.RESYNC_EVERY:
+            self._resync()
+
+    @staticmethod
+    def _split(delta: float):
+        return (delta, 0.0) if delta > 0 else (0.0, -delta if delta < 0 else 0.0)
+
+    def _push_delta(self, delta: float) -> None:
+        gain, loss = self._split(delta)
+        if len(self.gains) == self.rsi_window:
+            self.gain_sum -= self.gains[0]
+            self.loss_sum -= self.losses[0]
+        self.gains.append(gain)
+        self.losses.append(loss)
+        self.gain_sum += gain
+        self.loss_sum += loss
+
+        if self.rsi_method == 'wilder':
+            deltas = self.count - 1
+            if deltas == self.rsi_window:
+                # Wilder seeds the averages with a simple mean of the first window
+                self.avg_gain = self.gain_sum / self.rsi_window
+                self.avg_loss = self.loss_sum / self.rsi_window
+                self.prev_avg_gain = self.prev_avg_loss = None
+            elif deltas > self.rsi_window:
+                self.prev_avg_gain, self.prev_avg_loss = self.avg_gain, self.avg_loss
+                self._smooth(gain, loss)
+
+    def _smooth(self, gain: float, loss: float) -> None:
+        n = self.rsi_window
+        self.avg_gain = (self.prev_avg_gain * (n - 1) + gain) / n
+        self.avg_loss = (self.prev_avg_loss * (n - 1) + loss) / n
+
+    def _resync(self) -> None:
+        closes = list(self.closes)
+        self.short_sum = sum(closes[-min(self.short_window, self.count):])
+        self.long_sum = sum(closes[-min(self.long_window, self.count):])
+        self.gain_sum = sum(self.gains)
+        self.loss_sum = sum(self.losses)
+        self._updates = 0
+
+    @property
+    def last_close(self) -> Optional[float]:
+        return self.closes[-1] if self.closes else None
+
+    def sma(self, window: int) -> float:
+        total = self.short_sum if window == self.short_window else self.long_sum
+        return total / min(window, self.count) if self.count else math.nan
+
+    def rsi(self) -> float:
+        if self.rsi_method == 'wilder':
+            if self.avg_gain is None:
+                return math.nan
+            gain, loss = self.avg_gain, self.avg_loss
+        else:
+            if len(self.gains) < self.rsi_window:
+                return math.nan
+            gain, loss = self.gain_sum / self.rsi_window, self.loss_sum / self.rsi_window
+        if loss == 0:
+            return math.nan if gain == 0 else 100.0
+        return 100 - (100 / (1 + gain / loss))
+
+    def values(self) -> Dict[str, float]:
+        return {
+            'sma20': self.sma(self.short_window),
+            'sma50': self.sma(self.long_window),
+            'rsi': self.rsi()
+        }
+
+
+class TrackedIndicators:
+    """IndicatorState kept in step with a symbol's bar history."""
+
+    def __init__(self, **state_options):
+        self.state = IndicatorState(**state_options)
+        self.last_timestamp = None
+        # Identifies the history snapshot `result` was computed from
+        self.version = None
+        self.result: Optional[Dict] = None
+
+    def sync(self, closes) -> None:
+        """Advance the state to the end of a pandas Series of closes indexed by bar time."""
+        if self.last_timestamp is None or self.last_timestamp not in closes.index or self._rewritten(closes):
+            self.state.seed(closes.to_numpy())
+        else:
+            # The latest bar we saw may still have been forming, so amend it first
+            self.state.amend(closes[self.last_timestamp])
+            for close in closes[closes.index > self.last_timestamp].to_numpy():
+                self.state.push(close)
+        self.last_timestamp = closes.index[-1]
+
+    def _rewritten(self, closes) -> bool:
+        """Whether the settled bars the state holds differ from the same bars in `closes`,
+        as when yfinance back-adjusts the history for a dividend or split."""
+        seen = closes[closes.index <= self.last_timestamp].to_numpy(dtype=float)
+        held = np.fromiter(self.state.closes, dtype=float)
+        # Every bar but the last, which may still have been forming
+        overlap = min(len(seen), len(held)) - 1
+        if overlap <= 0:
+            return False
+        return not np.allclose(seen[-1 - overlap:-1], held[-1 - overlap:-1], rtol=1e-9, atol=0.0)
+
+
+# Vectorized indicators over a bars x symbols matrix of closes. Missing bars are NaN;
+# a symbol that started trading later simply has leading NaNs in its column.
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """Mean of the last `window` rows for every column, NaN until `window` valid rows exist."""
+    valid = ~np.isnan(values)
+    # Prefix sums with a zero row on top, so each window is one subtraction
+    sums = np.zeros((values.shape[0] + 1,) + values.shape[1:])
+    counts = np.zeros_like(sums)
+    np.cumsum(np.where(valid, values, 0.0), axis=0, out=sums[1:])
+    np.cumsum(valid, axis=0, out=counts[1:])
+    window_sums = sums[window:] - sums[:-window]
+    window_counts = counts[window:] - counts[:-window]
+    out = np.full(values.shape, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out[window - 1:] = np.where(window_counts == window, window_sums / window, np.nan)
+    return out
+
+
+def rolling_std(values: np.ndarray, window: int) -> np.ndarray:
+    """Population standard deviation of the last `window` rows, read through a strided window view."""
+    out = np.full(values.shape, np.nan)
+    if values.shape[0] >= window:
+        out[window - 1:] = sliding_window_view(values, window, axis=0).std(axis=-1)
+    return out
+
+
+def ema(values: np.ndarray, span: int) -> np.ndarray:
+    """Exponential moving average (pandas ewm(span, adjust=False)), seeded at each column's first value."""
+    alpha = 2.0 / (span + 1)
+    out = np.empty(values.shape)
+    previous = np.full(values.shape[1:], np.nan)
+    # One step per bar, each covering every symbol at once
+    for row in range(values.shape[0]):
+        current = values[row]
+        previous = np.where(np.isnan(previous), current,
+                            np.where(np.isnan(current), previous, previous + alpha * (current - previous)))
+        out[row] = previous
+    return out
+
+
+def rsi(values: np.ndarray, window: int = 14) -> np.ndarray:
+    """RSI from simple rolling means of gains and losses, the same formula IndicatorState uses by default."""
+    delta = np.zeros(values.shape)
+    delta[1:] = values[1:] - values[:-1]
+    delta[np.isnan(delta)] = 0.0
+    missing = np.isnan(values)
+    gain = np.where(missing, np.nan, np.maximum(delta, 0.0))
+    loss = np.where(missing, np.nan, np.maximum(-delta, 0.0))
+    avg_gain = rolling_mean(gain, window)
+    avg_loss = rolling_mean(loss, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return 100 - (100 / (1 + avg_gain / avg_loss))
+
+
+def macd(values: np.ndarray, fast: int = 12, slow: int = 26,
+         signal: int = 9) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """MACD line, signal line and histogram."""
+    line = ema(values, fast) - ema(values, slow)
+    signal_line = ema(line, signal)
+    return line, signal_line, line - signal_line
+
+
+def bollinger(values: np.ndarray, window: int = 20,
+              num_std: float = 2.0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Upper band, middle band (SMA) and lower band."""
+    middle = rolling_mean(values, window)
+    width = num_std * rolling_std(values, window)
+    return middle + width, middle, middle - width
+
+
+def latest_indicators(closes: np.ndarray) -> Dict[str, np.ndarray]:
+    """Latest value of every indicator for each column of a bars x symbols close matrix."""
+    macd_line, macd_signal, macd_hist = macd(closes)
+    bb_upper, bb_middle, bb_lower = bollinger(closes)
+    return {
+        'sma20': rolling_mean(closes, 20)[-1],
+        'sma50': rolling_mean(closes, 50)[-1],
+        'ema12': ema(closes, 12)[-1],
+        'ema26': ema(closes, 26)[-1],
+        'rsi': rsi(closes)[-1],
+        'macd': macd_line[-1],
+        'macd_signal': macd_signal[-1],
+        'macd_hist': macd_hist[-1],
+        'bb_upper': bb_upper[-1],
+        'bb_middle': bb_middle[-1],
+        'bb_lower': bb_lower[-1]
+    }
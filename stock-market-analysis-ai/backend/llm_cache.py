@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', os.path.join(CACHE_DIR, 'llm_cache.sqlite3'))
+# Seconds an analysis stays reusable; 0 disables the cache
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', '900'))
+
+# Fields that change on every fetch without changing what the model should say
+VOLATILE_KEYS = {'last_updated'}
+
+
+def canonicalize(value: Any) -> Any:
+    """Drop volatile fields, sort dict keys and normalize whitespace so equal inputs compare equal."""
+    if isinstance(value, dict):
+        return {
+            str(key): canonicalize(value[key])
+            for key in sorted(value, key=str)
+            if key not in VOLATILE_KEYS
+        }
+    if isinstance(value, (list, tuple)):
+        return [canonicalize(item) for item in value]
+    if isinstance(value, str):
+        return ' '.join(value.split())
+    if isinstance(value, float):
+        return round(value, 4)
+    return value
+
+
+def make_key(model: str, messages: List[Dict]) -> str:
+    payload = json.dumps({'model': model, 'messages': messages}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    """SQLite-backed cache of LLM completions with a TTL and hit-rate counters."""
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl: float = LLM_CACHE_TTL,
+                 clock: Callable[[], float] = time.time):
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened lazily so importing the module never touches the disk
+        if self._conn is None:
+            if self.path != ':memory:':
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS completions '
+                '(key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)'
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self._connection().execute(
+                'SELECT value, created_at FROM completions WHERE key = ?', (key,)
+            ).fetchone()
+            if row is not None and self.clock() - row[1] < self.ttl:
+                self.hits += 1
+                return row[0]
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: str) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO completions (key, value, created_at) VALUES (?, ?, ?)',
+                (key, value, self.clock())
+            )
+            conn.execute('DELETE FROM completions WHERE created_at < ?', (self.clock() - self.ttl,))
+            conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            entries = 0
+            if self.enabled and self._conn is not None:
+                entries = self._conn.execute('SELECT COUNT(*) FROM completions').fetchone()[0]
+            return {
+                'enabled': self.enabled,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'entries': entries,
+                'ttl': self.ttl
+            }
+
+
+# Shared cache used by the analysis agents
+llm_cache = LLMCache()
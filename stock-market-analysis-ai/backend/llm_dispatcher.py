@@ -0,0 +1,322 @@
+"""
+Central dispatcher for Groq completions.
+
+Every analysis call waits its turn in one bounded priority queue, with
+interactive requests ahead of batch jobs.
+The head of the queue is sent once the requests-per-minute and tokens-per-minute
+buckets have room for it and fewer than `max_concurrency` calls are in flight.
+A 429 pauses all dispatching for the Retry-After the server sent, since the
+limits are per account, and the call is retried in its original queue position.
+
+A call's tokens are taken from the bucket when it is sent. If it fails, the
+dispatcher hands them back; once it returns, the caller settles them against the
+real usage.
+
+One dispatcher is shared by every thread and event loop in the worker. Its state
+sits behind a lock and each waiter is a thread-safe future, so blocking callers
+wait in their own thread and async callers on their own loop.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from tracing import llm_queue_seconds, span
+
+# Groq's per-account limits; the defaults are the free tier's for the analysis model
+GROQ_REQUESTS_PER_MINUTE = float(os.getenv('GROQ_REQUESTS_PER_MINUTE', '30'))
+GROQ_TOKENS_PER_MINUTE = float(os.getenv('GROQ_TOKENS_PER_MINUTE', '15000'))
+GROQ_MAX_CONCURRENCY = int(os.getenv('GROQ_MAX_CONCURRENCY', '4'))
+# Calls allowed to wait; beyond this, new low-priority calls are turned away
+GROQ_QUEUE_SIZE = int(os.getenv('GROQ_QUEUE_SIZE', '100'))
+GROQ_MAX_RETRIES = int(os.getenv('GROQ_MAX_RETRIES', '2'))
+
+# Tokens reserved for a completion until its real usage is known
+COMPLETION_TOKEN_RESERVE = 1024
+# Seconds to pause after a 429 that did not say how long to wait
+DEFAULT_RETRY_AFTER = 2.0
+
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BATCH: 'batch'}
+
+
+class LLMQueueFull(RuntimeError):
+    """The dispatcher queue is full of calls at the same or a higher priority."""
+
+
+class LLMRateLimited(RuntimeError):
+    """Groq still answered 429 after every retry."""
+
+
+class TokenBucket:
+    """`per_minute` units a minute, with at most `capacity` saved up."""
+
+    def __init__(self, per_minute: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity
+        self.clock = clock
+        self.level = float(capacity)
+        self.updated_at = clock()
+        self._lock = threading.RLock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self, cost: float) -> float:
+        """Seconds until `cost` is available; a cost above capacity waits for a full bucket."""
+        with self._lock:
+            self._refill()
+            missing = min(cost, self.capacity) - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, cost: float) -> None:
+        with self._lock:
+            self._refill()
+            self.level -= min(cost, self.capacity)
+
+    def give(self, amount: float) -> None:
+        """Return an over-reservation, or charge more with a negative amount."""
+        with self._lock:
+            self._refill()
+            self.level = min(self.capacity, self.level + amount)
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds to wait before retrying a 429 from the Groq SDK or httpx; None for other errors."""
+    response = getattr(error, 'response', None)
+    status = getattr(error, 'status_code', None) or getattr(response, 'status_code', None)
+    if status != 429:
+        return None
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return max(0.0, float(headers.get('retry-after')))
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+class LLMDispatcher:
+    """Priority queue in front of Groq, paced by request and token buckets."""
+
+    def __init__(self, requests_per_minute: float = GROQ_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = GROQ_TOKENS_PER_MINUTE, max_concurrency: int = GROQ_MAX_CONCURRENCY,
+                 max_queue: int = GROQ_QUEUE_SIZE, max_retries: int = GROQ_MAX_RETRIES,
+                 burst: Optional[int] = None, clock: Callable[[], float] = time.monotonic):
+        self.requests = TokenBucket(requests_per_minute, burst or max_concurrency, clock)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute, clock)
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.clock = clock
+        # Heap of [priority, sequence, tokens, future, enqueued at]
+        self._queue: List[list] = []
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._timer: Optional[threading.Timer] = None
+        self._wake_at = 0.0
+        self._lock = threading.RLock()
+        self.dispatched = 0
+        self.rejected = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+        self.max_queue_depth = 0
+
+    def _make_room(self, priority: int) -> None:
+        if len(self._queue) < self.max_queue:
+            return
+        lowest = max(self._queue, key=lambda entry: (entry[0], entry[1]))
+        self.rejected += 1
+        if lowest[0] <= priority:
+            raise LLMQueueFull(f"AI analysis queue is full ({self.max_queue} waiting)")
+        # Turn away the newest waiting call of the lowest priority instead
+        self._queue.remove(lowest)
+        heapq.heapify(self._queue)
+        if lowest[3].set_running_or_notify_cancel():
+            lowest[3].set_exception(LLMQueueFull(f"AI analysis queue is full ({self.max_queue} waiting)"))
+
+    def _enqueue(self, tokens: int, priority: int, sequence: int) -> list:
+        with self._lock:
+            self._make_room(priority)
+            entry = [priority, sequence, tokens, Future(), self.clock()]
+            heapq.heappush(self._queue, entry)
+            self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+            self._pump()
+        return entry
+
+    def _granted(self, entry: list) -> None:
+        waited = self.clock() - entry[4]
+        llm_queue_seconds.observe(waited, PRIORITY_NAMES.get(entry[0], str(entry[0])))
+        if waited > 0.001:
+            with self._lock:
+                self.waited += 1
+                self.wait_seconds += waited
+
+    async def _acquire(self, tokens: int, priority: int, sequence: int) -> None:
+        entry = self._enqueue(tokens, priority, sequence)
+        future = entry[3]
+        try:
+            with span('llm_queue'):
+                await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            with self._lock:
+                if future.cancel():
+                    if entry in self._queue:
+                        self._queue.remove(entry)
+                        heapq.heapify(self._queue)
+                elif not future.cancelled() and future.exception() is None:
+                    # Granted just as the caller gave up
+                    self._release()
+            raise
+        self._granted(entry)
+
+    def _acquire_sync(self, tokens: int, priority: int, sequence: int) -> None:
+        entry = self._enqueue(tokens, priority, sequence)
+        with span('llm_queue'):
+            entry[3].result()
+        self._granted(entry)
+
+    def _pump(self) -> None:
+        """Grant the queue head, and the entries after it, while the limits allow; called holding the lock."""
+        while self._queue and self._in_flight < self.max_concurrency:
+            priority, _, tokens, future, _ = self._queue[0]
+            if future.done():
+                heapq.heappop(self._queue)
+                continue
+            delay = max(self._paused_until - self.clock(), self.requests.delay(1), self.tokens.delay(tokens))
+            if delay > 0:
+                self._wake_in(delay)
+                return
+            heapq.heappop(self._queue)
+            if not future.set_running_or_notify_cancel():
+                continue
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self._in_flight += 1
+            self.dispatched += 1
+            future.set_result(None)
+
+    def _wake_in(self, delay: float) -> None:
+        wake_at = time.monotonic() + delay
+        if self._timer is not None:
+            if self._wake_at <= wake_at:
+                # An earlier wake-up is set; it pumps again and sets the next one
+                return
+            self._timer.cancel()
+        self._wake_at = wake_at
+        self._timer = threading.Timer(delay, self._wake)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _wake(self) -> None:
+        with self._lock:
+            self._timer = None
+            self._pump()
+
+    def _release(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            self._pump()
+
+    def _failed(self, error: BaseException, tokens: int, attempt: int) -> None:
+        """Free a call that raised; returns if it should be retried, else raises."""
+        delay = retry_after(error) if isinstance(error, Exception) else None
+        with self._lock:
+            # No completion came back, so neither a retry nor the caller pays for this attempt
+            self.tokens.give(tokens)
+            if delay is not None:
+                self.rate_limited += 1
+                # Pause before freeing the slot, so the next queued call waits out Retry-After too
+                self.pause(delay)
+            self._release()
+            if delay is not None and attempt < self.max_retries:
+                self.retries += 1
+                return
+        if delay is None:
+            raise error
+        raise LLMRateLimited(f"Groq rate limit reached, retry in {delay:.0f}s") from error
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, self.clock() + seconds)
+
+    @asynccontextmanager
+    async def dispatch(self, create: Callable[[], Awaitable[Any]], tokens: int,
+                       priority: int = INTERACTIVE) -> AsyncIterator[Any]:
+        """
+        Call `create()` when its turn comes and yield the result, keeping its
+        concurrency slot until the block exits (so a stream is read inside it).
+        `tokens` is the prompt plus the completion tokens reserved for the call;
+        once a result is yielded the caller settles them with `settle`.
+        """
+        sequence = next(self._sequence)
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(tokens, priority, sequence)
+            try:
+                result = await create()
+            except BaseException as e:
+                self._failed(e, tokens, attempt)
+                continue
+            try:
+                yield result
+            finally:
+                self._release()
+            return
+
+    async def call(self, create: Callable[[], Awaitable[Any]], tokens: int, priority: int = INTERACTIVE) -> Any:
+        """`dispatch` for a call that is complete once `create()` returns."""
+        async with self.dispatch(create, tokens, priority) as result:
+            return result
+
+    def call_sync(self, create: Callable[[], Any], tokens: int, priority: int = INTERACTIVE) -> Any:
+        """`call` for blocking code: waits for its turn in the calling thread, then runs `create()` there."""
+        sequence = next(self._sequence)
+        for attempt in range(self.max_retries + 1):
+            self._acquire_sync(tokens, priority, sequence)
+            try:
+                result = create()
+            except BaseException as e:
+                self._failed(e, tokens, attempt)
+                continue
+            self._release()
+            return result
+
+    def settle(self, reserved: int, used: int) -> None:
+        """Correct the token bucket once a call's real usage is known."""
+        self.tokens.give(reserved - used)
+
+    def stats(self) -> Dict:
+        queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        with self._lock:
+            entries = list(self._queue)
+        for entry in entries:
+            name = PRIORITY_NAMES.get(entry[0], str(entry[0]))
+            queued[name] = queued.get(name, 0) + 1
+        return {
+            'requests_per_minute': round(self.requests.rate * 60, 2),
+            'tokens_per_minute': round(self.tokens.rate * 60, 2),
+            'max_concurrency': self.max_concurrency,
+            'queued': queued,
+            'max_queue_depth': self.max_queue_depth,
+            'in_flight': self._in_flight,
+            'dispatched': self.dispatched,
+            'rejected': self.rejected,
+            'rate_limited': self.rate_limited,
+            'retries': self.retries,
+            'waited': self.waited,
+            'wait_seconds': round(self.wait_seconds, 3),
+            'paused_seconds': round(max(0.0, self._paused_until - self.clock()), 3)
+        }
+
+
+# Shared by every agent, so all Groq calls from this worker count against one set of limits
+llm_dispatcher = LLMDispatcher()
@@ -1,18 +1,114 @@
-from fastapi import FastAPI
-from stock_agents import IndianStockAgent, WebSearchAgent, FinancialAnalysisAgent, TrendingStocksAgent
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Union
+import orjson
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from stock_agents import (
+    ANALYZE_BATCH_CONCURRENCY, AsyncFinancialAnalysisAgent, AsyncIndianStockAgent, AsyncWebSearchAgent,
+    IndianStockAgent, TrendingStocksAgent, ai_available, get_groq_client, search_breaker
+)
+import market_data
+from compression import CompressionMiddleware
+from history_cache import history_cache
+from llm_cache import llm_cache
+from llm_dispatcher import BATCH, INTERACTIVE, llm_dispatcher
+from price_store import price_store
+from quotes import quote_provider
+from refresher import MarketRefresher, Snapshot
+from schemas import AnalysisResponse, ErrorResponse, TrendingResponse
+from singleflight import SingleFlight
+from symbols import normalize_symbol, symbol_index, validate_symbol
+from tracing import render_metrics, request_seconds, span, trace
 from dotenv import load_dotenv
 import os
 
 # Load environment variables
 load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Initialize agents; they are cheap to build, since Groq clients and yfinance load on first use
+stock_agent = AsyncIndianStockAgent(IndianStockAgent())
+web_agent = AsyncWebSearchAgent()
+financial_agent = AsyncFinancialAnalysisAgent(web_agent, stock_agent)
+
+# In-flight computations shared by concurrent identical requests
+analysis_flights = SingleFlight()
+trending_flights = SingleFlight()
+
+
+async def load_trending(index: str) -> dict:
+    # The screen makes blocking yfinance calls, so keep it off the event loop,
+    # and concurrent requests for the same index share one computation
+    return await trending_flights.do(index, lambda: asyncio.to_thread(compute_trending, index))
+
+
+async def gather_analysis_inputs(symbol: str) -> dict:
+    return await financial_agent.gather_data(symbol)
+
+
+# Precomputes /trending and the inputs of the most requested analyses in the background
+refresher = MarketRefresher(trending=load_trending, gather=gather_analysis_inputs)
+MARKET_REFRESH_ENABLED = os.getenv('MARKET_REFRESH', '1') != '0'
+PRELOAD_ENABLED = os.getenv('PRELOAD_DEPENDENCIES', '1') != '0'
+
+
+def preload_dependencies() -> None:
+    """Load the slow-to-import clients the first requests need, once the server is already up."""
+    if isinstance(market_data.provider, market_data.YFinanceProvider):
+        import yfinance  # noqa: F401
+    get_groq_client(async_client=True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if PRELOAD_ENABLED:
+        # In a worker thread, so startup does not wait for it; the reference keeps the task alive
+        app.state.preload = asyncio.create_task(asyncio.to_thread(preload_dependencies))
+    if MARKET_REFRESH_ENABLED:
+        refresher.start()
+    yield
+    await refresher.stop()
+
+
+# numpy values are written as numbers, NaN and infinity as null
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def dumps(content) -> str:
+    """One JSON document for the streamed endpoints, serialized the same way as the others."""
+    return orjson.dumps(content, default=str, option=ORJSON_OPTIONS).decode()
+
+
+class TimedJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        with span('serialize'):
+            return orjson.dumps(content, option=ORJSON_OPTIONS)
+
 
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan, default_response_class=TimedJSONResponse)
+# Inside the timing middleware below, so request latency includes compression
+app.add_middleware(CompressionMiddleware)
+
+# Request header asking for the stage breakdown of that request in a Server-Timing header
+DEBUG_TIMING_HEADER = 'X-Debug-Timing'
+
 
-# Initialize agents
-stock_agent = IndianStockAgent()
-web_agent = WebSearchAgent()
-financial_agent = FinancialAnalysisAgent()
+@app.middleware("http")
+async def record_timings(request: Request, call_next):
+    start = time.perf_counter()
+    with trace() as current:
+        response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    route = request.scope.get('route')
+    request_seconds.observe(elapsed, request.method, route.path if route else 'unmatched', str(response.status_code))
+    if request.headers.get(DEBUG_TIMING_HEADER):
+        response.headers['Server-Timing'] = current.server_timing(elapsed)
+    return response
 
 
 @app.get("/")
@@ -20,37 +116,76 @@ def read_root():
     return {"message": "Welcome to Indian Stock Market Analysis Tool"}
 
 
-@app.get("/analyze/{symbol}")
-def analyze_stock(symbol: str):
+# Symbols accepted by one /analyze/batch request, and the most analyzed at once
+MAX_BATCH_SYMBOLS = 50
+MAX_BATCH_CONCURRENCY = 8
+
+
+# Declared before /analyze/{symbol} so 'batch' is not taken for a symbol
+@app.get("/analyze/batch")
+async def analyze_batch(symbols: str, concurrency: int = ANALYZE_BATCH_CONCURRENCY):
+    """
+    Analyze a comma-separated list of symbols as newline-delimited JSON, one line per
+    symbol in the order they finish. Data fetches run `concurrency` symbols at a time
+    and AI calls wait behind interactive requests in the LLM dispatcher queue.
+    """
+    symbol_list = [s for s in (part.strip() for part in symbols.split(',')) if s]
+    if not symbol_list:
+        return {"error": "No symbols given"}
+    if len(symbol_list) > MAX_BATCH_SYMBOLS:
+        return {"error": f"Too many symbols: {len(symbol_list)}, maximum is {MAX_BATCH_SYMBOLS}"}
+    concurrency = min(max(1, concurrency), MAX_BATCH_CONCURRENCY)
+
+    async def analyze_one(symbol: str) -> dict:
+        refresher.record_request(symbol)
+        # Keyed by priority too, so an interactive request never joins a flight queued behind batch work
+        return await analysis_flights.do((symbol, BATCH), lambda: run_analysis(symbol, BATCH))
+
+    async def lines():
+        async for result in financial_agent.analyze_batch(symbol_list, concurrency, analyze_one):
+            yield dumps(result) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.get("/analyze/{symbol}", response_model=Union[AnalysisResponse, ErrorResponse],
+         response_model_exclude_unset=True)
+async def analyze_stock(symbol: str):
     """
     Analyze stock based on symbol.
     Returns stock data, technical indicators, recent news, and AI analysis.
+    Concurrent requests for the same symbol share one analysis.
     """
+    # Clean symbol input and reject unknown tickers before any upstream call
+    symbol = normalize_symbol(symbol)
+    check = await validate_symbol(symbol)
+    if not check['valid']:
+        return {"error": check['error'], "suggestions": check['suggestions']}
+    refresher.record_request(symbol)
+    return await analysis_flights.do((symbol, INTERACTIVE), lambda: run_analysis(symbol))
+
+
+async def run_analysis(symbol: str, priority: int = INTERACTIVE) -> dict:
     try:
-        # Clean symbol input
-        symbol = symbol.strip().upper().replace('.NS', '')
-        
-        print(f"Analyzing symbol: {symbol}")  # Debug log
+        logger.debug("Analyzing symbol: %s", symbol)
         
-        # Fetch stock data
-        stock_data = stock_agent.get_stock_info(symbol)
-        print(f"Stock data: {stock_data}")  # Debug log
+        # Use the inputs the background refresher keeps warm for popular symbols,
+        # otherwise fetch stock data, technical indicators and recent news concurrently
+        snapshot = refresher.data_snapshot(symbol)
+        if snapshot is None:
+            snapshot = Snapshot(await financial_agent.gather_data(symbol), refresher.clock())
+        data = snapshot.data
+        stock_data = data['stock_data']
+        technical_data = data['technical_data']
+        news_data = data['news_data']
         
-        # Fetch technical indicators
-        technical_data = stock_agent.analyze_technical_indicators(symbol)
-        print(f"Technical data: {technical_data}")  # Debug log
-        
-        # Fetch recent news
-        news_data = web_agent.search(f"{symbol} stock news NSE India")
-        print(f"News data: {len(news_data)} articles found")  # Debug log
-        
-        # Generate AI analysis
-        analysis_result = financial_agent.analyze_stock(symbol)
+        # Generate AI analysis from the data fetched above
+        analysis_result = await financial_agent.analyze_stock(symbol, data, priority)
         
         # Ensure we're getting the analysis from the result
         analysis = analysis_result.get('analysis', 'No AI analysis available.')
         if isinstance(analysis_result, dict) and 'error' in analysis_result:
-            print(f"AI Analysis error: {analysis_result['error']}")  # Debug log
+            logger.warning("AI analysis error for %s: %s", symbol, analysis_result['error'])
             analysis = f"Error in AI analysis: {analysis_result['error']}"
         
         response_data = {
@@ -60,37 +195,153 @@ def analyze_stock(symbol: str):
             "analysis": analysis
         }
         
-        print(f"Complete response data: {response_data}")  # Debug log
-        return response_data
+        return Snapshot(response_data, snapshot.as_of).payload(refresher.clock())
         
     except Exception as e:
-        print(f"Error in analyze_stock: {str(e)}")  # Debug log
+        logger.exception("Error in analyze_stock for %s", symbol)
         return {"error": f"Failed to analyze stock: {str(e)}"}
 
 
+@app.get("/analyze/{symbol}/stream")
+async def analyze_stock_stream(symbol: str):
+    """
+    Stream the analysis as Server-Sent Events.
+    Sends stock_data, technical_data and news_data as each is fetched,
+    then the AI analysis token by token, and finally a done event.
+    """
+    symbol = normalize_symbol(symbol)
+    check = await validate_symbol(symbol)
+    if check['valid']:
+        refresher.record_request(symbol)
+
+    async def events():
+        if not check['valid']:
+            yield f"event: error\ndata: {json.dumps(check['error'])}\n\n"
+            yield "event: done\ndata: null\n\n"
+            return
+        try:
+            async for event, payload in financial_agent.stream_analysis(symbol):
+                yield f"event: {event}\ndata: {dumps(payload)}\n\n"
+        except Exception as e:
+            logger.exception("Error in analyze_stock_stream for %s", symbol)
+            yield f"event: error\ndata: {json.dumps(f'Failed to analyze stock: {str(e)}')}\n\n"
+        yield "event: done\ndata: null\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# Largest symbol list accepted by /indicators in one request
+MAX_INDICATOR_SYMBOLS = 500
+
+
+@app.get("/indicators")
+async def get_indicators(symbols: str):
+    """
+    Technical indicators (SMA, EMA, RSI, MACD, Bollinger bands) for a comma-separated
+    list of symbols, computed in one vectorized pass.
+    """
+    symbol_list = list(dict.fromkeys(normalize_symbol(part) for part in symbols.split(',') if part.strip()))
+    if not symbol_list:
+        return {"error": "No symbols given"}
+    if len(symbol_list) > MAX_INDICATOR_SYMBOLS:
+        return {"error": f"Too many symbols: {len(symbol_list)}, maximum is {MAX_INDICATOR_SYMBOLS}"}
+    try:
+        checks = await asyncio.gather(*(validate_symbol(symbol) for symbol in symbol_list))
+        results = {
+            check['symbol']: {"error": check['error'], "suggestions": check['suggestions']}
+            for check in checks if not check['valid']
+        }
+        valid = [check['symbol'] for check in checks if check['valid']]
+        if valid:
+            results.update(await stock_agent.analyze_technical_indicators_batch(valid))
+        return {symbol: results[symbol] for symbol in symbol_list}
+    except Exception as e:
+        logger.exception("Error in get_indicators")
+        return {"error": f"Failed to compute indicators: {str(e)}"}
+
 
 @app.get("/health")
 def health_check():
     """
-    Health check endpoint to verify if the API is running.
+    Health check endpoint to verify if the API is running, and whether AI analysis
+    is available (it is not without GROQ_API_KEY).
     """
-    return {"status": "API is running fine."}
+    return {"status": "API is running fine.", "ai_analysis": "available" if ai_available() else "unavailable"}
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    """
+    Counters for the price history cache and on-disk price store, the LLM analysis
+    cache, request coalescing, the news search circuit breaker, the background
+    refresher, the LLM dispatcher (queue depth, waits and 429s), the symbol index,
+    the quote caches and the market data provider.
+    """
+    return {
+        "history_cache": history_cache.stats(),
+        "price_store": price_store.stats(),
+        "llm_cache": llm_cache.stats(),
+        "singleflight": {"analyze": analysis_flights.stats(), "trending": trending_flights.stats()},
+        "search_breaker": search_breaker.stats(),
+        "refresher": refresher.stats(),
+        "llm_dispatcher": llm_dispatcher.stats(),
+        "symbol_index": symbol_index.stats(),
+        "quotes": quote_provider.stats(),
+        "market_data": market_data.provider.stats()
+    }
+
+
+@app.get("/metrics")
+def metrics():
+    """
+    Prometheus metrics: request latency per route, time spent per analysis stage
+    (quote, history, indicators, news search and parsing, LLM, serialization)
+    and the /cache/stats counters.
+    """
+    return PlainTextResponse(render_metrics(cache_stats()), media_type='text/plain; version=0.0.4')
 
 
 @app.get("/test_ai")
-def test_ai_analysis():
+async def test_ai_analysis():
     """
     Test the AI analysis endpoint directly to verify Groq integration.
     """
     try:
-        test_result = financial_agent.analyze_stock("TEST")
+        test_result = await financial_agent.analyze_stock("TEST")
         return {"test_analysis": test_result.get('analysis', 'No analysis generated.')}
     except Exception as e:
         return {"error": f"AI analysis failed: {str(e)}"}
     
-@app.get("/trending")
-async def get_trending_stocks():
-    trending_agent = TrendingStocksAgent()
+def not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """A 304 when the client already has the `etag` version; otherwise tag `response` with it."""
+    if etag in (tag.strip() for tag in request.headers.get('if-none-match', '').split(',')):
+        return Response(status_code=304, headers={'ETag': etag})
+    response.headers['ETag'] = etag
+    return None
+
+
+@app.get("/trending", response_model=Union[TrendingResponse, ErrorResponse], response_model_exclude_unset=True)
+async def get_trending_stocks(request: Request, response: Response, index: str = 'NIFTY50'):
+    """
+    Top movers, most active stocks and sector performance for an index, served from
+    the background refresher's snapshot with its as_of time and age in seconds.
+    The response carries an ETag; a request with a matching If-None-Match gets a 304
+    until the snapshot is recomputed.
+    """
+    try:
+        index = index.upper()
+        snapshot = refresher.trending_snapshot(index)
+        if snapshot is None:
+            # First request for this index, or the refresher is not keeping up
+            snapshot = await refresher.refresh_trending(index)
+        return not_modified(request, response, snapshot.etag(index)) or snapshot.payload(refresher.clock())
+    except ValueError as e:
+        return {"error": str(e)}
+
+
+def compute_trending(index: str) -> dict:
+    trending_agent = TrendingStocksAgent(universe=index)
     trending_data = trending_agent.get_trending_stocks()
     sector_performance = trending_agent.get_sector_performance()
     
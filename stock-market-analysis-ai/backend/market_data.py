@@ -0,0 +1,246 @@
+"""
+Market data providers: the one place the backend talks to Yahoo Finance.
+
+The price store, history cache and quote provider read bars, `fast_info` levels
+and fundamentals through `provider`. YFinanceProvider is the live source.
+ReplayProvider serves fixtures recorded with `record` and can inject latency and
+failures, so benchmarks and load tests run offline and give the same numbers on
+every run. Set MARKET_DATA_PROVIDER=replay to run the whole backend against
+MARKET_DATA_FIXTURES.
+
+Record fixtures with: python market_data.py RELIANCE TCS INFY
+"""
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import Callable, Dict, Iterable, Optional
+
+import pandas as pd
+
+from history_cache import slice_period
+
+logger = logging.getLogger(__name__)
+
+MARKET_DATA_FIXTURES = os.getenv(
+    'MARKET_DATA_FIXTURES',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'market')
+)
+
+BAR_FIELDS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+
+class ReplayFailure(ConnectionError):
+    """Failure injected by ReplayProvider in place of an upstream error."""
+
+
+class MarketDataProvider(ABC):
+    """Source of OHLCV bars, fast_info levels and fundamentals for Yahoo tickers (e.g. TCS.NS)."""
+
+    @abstractmethod
+    def history(self, symbol: str, period: str, interval: str) -> pd.DataFrame:
+        """Bars with BAR_FIELDS columns, indexed by bar time; empty for an unknown symbol."""
+
+    @abstractmethod
+    def fast_info(self, symbol: str) -> Dict:
+        """{'year_high', 'year_low', 'shares', 'market_cap'}."""
+
+    @abstractmethod
+    def fundamentals(self, symbol: str) -> Dict:
+        """{'trailing_pe', 'trailing_eps'}."""
+
+    @abstractmethod
+    def info(self, symbol: str) -> Dict:
+        """The full `Ticker.info` mapping."""
+
+    def stats(self) -> Dict:
+        return {'provider': type(self).__name__}
+
+
+def _ticker(symbol: str):
+    # yfinance is slow to import, so it is loaded on the first live request
+    import yfinance as yf
+    return yf.Ticker(symbol)
+
+
+class YFinanceProvider(MarketDataProvider):
+    """Live data from Yahoo Finance."""
+
+    def history(self, symbol: str, period: str, interval: str) -> pd.DataFrame:
+        return _ticker(symbol).history(period=period, interval=interval)
+
+    def fast_info(self, symbol: str) -> Dict:
+        fast = _ticker(symbol).fast_info
+        return {
+            'year_high': fast['yearHigh'],
+            'year_low': fast['yearLow'],
+            'shares': fast['shares'],
+            'market_cap': fast['marketCap']
+        }
+
+    def fundamentals(self, symbol: str) -> Dict:
+        info = _ticker(symbol).info
+        return {'trailing_pe': info.get('trailingPE'), 'trailing_eps': info.get('trailingEps')}
+
+    def info(self, symbol: str) -> Dict:
+        return _ticker(symbol).info
+
+
+def _fixture_name(symbol: str) -> str:
+    return symbol.replace(os.sep, '_')
+
+
+class ReplayProvider(MarketDataProvider):
+    """
+    Serves recorded fixtures: `<root>/<interval>/<symbol>.csv` bars and
+    `<root>/quotes/<symbol>.json` fast_info, fundamentals and info.
+
+    Every call sleeps `latency` seconds plus up to `jitter` more, then fails with
+    ReplayFailure with probability `failure_rate`. The draws depend only on
+    `seed`, the request and how many times it was made, so a run is repeatable
+    however a thread pool orders the calls.
+    """
+
+    def __init__(self, root: str = MARKET_DATA_FIXTURES, latency: float = 0.0, jitter: float = 0.0,
+                 failure_rate: float = 0.0, seed: int = 0, sleep: Callable[[float], None] = time.sleep):
+        self.root = root
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.sleep = sleep
+        self.seed = seed
+        self._requests: Counter = Counter()
+        self._bars: Dict[tuple, pd.DataFrame] = {}
+        self._quotes: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.misses = 0
+
+    def _upstream(self, *request) -> None:
+        with self._lock:
+            self.calls += 1
+            self._requests[request] += 1
+            draws = random.Random(f"{self.seed}:{request}:{self._requests[request]}")
+        delay = self.latency + draws.uniform(0, self.jitter)
+        fail = draws.random() < self.failure_rate
+        if delay:
+            self.sleep(delay)
+        if fail:
+            with self._lock:
+                self.failures += 1
+            raise ReplayFailure(f"Injected market data failure for {request[0]}")
+
+    def _load_bars(self, symbol: str, interval: str) -> Optional[pd.DataFrame]:
+        key = (symbol, interval)
+        if key not in self._bars:
+            path = os.path.join(self.root, interval, _fixture_name(symbol) + '.csv')
+            try:
+                frame = pd.read_csv(path, index_col=0)
+            except OSError:
+                frame = None
+            if frame is not None:
+                index = pd.to_datetime(frame.index, utc=True)
+                frame.index = index.tz_convert('Asia/Kolkata')
+                frame = frame[BAR_FIELDS]
+            with self._lock:
+                self._bars[key] = frame
+        return self._bars[key]
+
+    def _load_quote(self, symbol: str) -> Dict:
+        if symbol not in self._quotes:
+            path = os.path.join(self.root, 'quotes', _fixture_name(symbol) + '.json')
+            try:
+                with open(path, encoding='utf-8') as f:
+                    quote = json.load(f)
+            except (OSError, ValueError):
+                quote = {}
+            with self._lock:
+                self._quotes[symbol] = quote
+        return self._quotes[symbol]
+
+    def history(self, symbol: str, period: str, interval: str) -> pd.DataFrame:
+        self._upstream(symbol, period, interval)
+        frame = self._load_bars(symbol, interval)
+        if frame is None:
+            self.misses += 1
+            return pd.DataFrame()
+        # A copy, as callers may add columns to what an upstream fetch returns
+        return slice_period(frame, period).copy()
+
+    def _quote_part(self, symbol: str, part: str) -> Dict:
+        self._upstream(symbol, part)
+        quote = self._load_quote(symbol).get(part)
+        if quote is None:
+            self.misses += 1
+            raise KeyError(f"No {part} fixture for {symbol}")
+        return dict(quote)
+
+    def fast_info(self, symbol: str) -> Dict:
+        return self._quote_part(symbol, 'fast_info')
+
+    def fundamentals(self, symbol: str) -> Dict:
+        return self._quote_part(symbol, 'fundamentals')
+
+    def info(self, symbol: str) -> Dict:
+        return self._quote_part(symbol, 'info')
+
+    def stats(self) -> Dict:
+        return {
+            'provider': type(self).__name__,
+            'root': self.root,
+            'calls': self.calls,
+            'failures': self.failures,
+            'misses': self.misses
+        }
+
+
+def record(symbols: Iterable[str], root: str = MARKET_DATA_FIXTURES,
+           source: Optional[MarketDataProvider] = None,
+           windows: Optional[Dict[str, str]] = None) -> None:
+    """Save bars and quote data for `symbols` from `source` as ReplayProvider fixtures."""
+    source = source or YFinanceProvider()
+    windows = windows or {'1d': '2y', '5m': '5d'}
+    for symbol in symbols:
+        for interval, period in windows.items():
+            frame = source.history(symbol, period, interval)
+            if frame.empty:
+                logger.warning("No %s bars for %s", interval, symbol)
+                continue
+            os.makedirs(os.path.join(root, interval), exist_ok=True)
+            # Timestamps keep their UTC offset, so the replayed bars land on the same instants
+            frame[BAR_FIELDS].to_csv(os.path.join(root, interval, _fixture_name(symbol) + '.csv'))
+
+        quote = {}
+        for part in ('fast_info', 'fundamentals', 'info'):
+            try:
+                quote[part] = getattr(source, part)(symbol)
+            except Exception as e:
+                logger.warning("Error recording %s for %s: %s", part, symbol, e)
+        os.makedirs(os.path.join(root, 'quotes'), exist_ok=True)
+        with open(os.path.join(root, 'quotes', _fixture_name(symbol) + '.json'), 'w', encoding='utf-8') as f:
+            json.dump(quote, f, default=str)
+
+
+def provider_from_env() -> MarketDataProvider:
+    if os.getenv('MARKET_DATA_PROVIDER', 'yfinance').lower() == 'replay':
+        return ReplayProvider(
+            latency=float(os.getenv('REPLAY_LATENCY_MS', '0')) / 1000,
+            jitter=float(os.getenv('REPLAY_JITTER_MS', '0')) / 1000,
+            failure_rate=float(os.getenv('REPLAY_FAILURE_RATE', '0')),
+            seed=int(os.getenv('REPLAY_SEED', '0'))
+        )
+    return YFinanceProvider()
+
+
+# Shared provider; replace it to point the whole backend at another source
+provider = provider_from_env()
+
+
+if __name__ == "__main__":
+    record(f"{symbol.upper().replace('.NS', '')}.NS" for symbol in sys.argv[1:])
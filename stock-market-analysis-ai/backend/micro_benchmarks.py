@@ -0,0 +1,64 @@
+"""
+Micro-benchmarks for the per-request CPU work, using pytest-benchmark.
+
+Install with: pip install -r requirements-dev.txt
+Usage: python -m pytest micro_benchmarks.py --benchmark-json=micro.json
+Compare two saved runs with: pytest-benchmark compare micro_old.json micro.json
+"""
+import contextlib
+import io
+import os
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+os.environ.setdefault('GROQ_API_KEY', 'benchmark-key')
+
+import history_cache
+import news_parser
+from benchmark import FIXTURES_DIR, legacy_indicators, synthetic_history
+from indicators import latest_indicators
+from stock_agents import IndianStockAgent, WebSearchAgent, stack_histories
+
+
+@pytest.fixture
+def search_page():
+    with open(os.path.join(FIXTURES_DIR, 'ddg_search.html'), encoding='utf-8') as f:
+        return f.read()
+
+
+@pytest.fixture
+def cached_history(monkeypatch):
+    hist = synthetic_history('RELIANCE.NS', days=63)
+    monkeypatch.setattr(history_cache, 'history_cache', history_cache.HistoryCache(fetcher=lambda s, p, i: hist))
+    return hist
+
+
+def test_technical_indicators_repeated_request(benchmark, cached_history):
+    agent = IndianStockAgent()
+    with contextlib.redirect_stdout(io.StringIO()):
+        agent.analyze_technical_indicators('RELIANCE')
+    result = benchmark(agent.analyze_technical_indicators, 'RELIANCE')
+    assert 'rsi' in result
+
+
+def test_technical_indicators_pandas_reference(benchmark, cached_history):
+    benchmark(legacy_indicators, cached_history)
+
+
+def test_latest_indicators_500_symbols(benchmark):
+    histories = {f"SYM{i:03d}": synthetic_history(f"SYM{i:03d}", days=63) for i in range(500)}
+    closes = stack_histories(histories, 'Close').ffill().to_numpy()
+    result = benchmark(latest_indicators, closes)
+    assert result['sma20'].shape == (500,)
+
+
+def test_web_search_parse(benchmark, search_page):
+    results = benchmark(WebSearchAgent._parse_results, search_page)
+    assert results
+
+
+@pytest.mark.parametrize('parser', sorted(news_parser.PARSERS))
+def test_news_parser(benchmark, search_page, parser):
+    benchmark(news_parser.PARSERS[parser], search_page)
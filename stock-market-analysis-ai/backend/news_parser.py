@@ -0,0 +1,111 @@
+"""
+Extraction of news results from DuckDuckGo HTML pages.
+
+Uses the fastest parser installed: selectolax, then a streaming lxml parse that
+stops after `limit` results, then BeautifulSoup restricted to result blocks.
+"""
+import re
+from io import BytesIO
+from typing import Callable, Dict, List, Optional
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    try:
+        from selectolax.parser import HTMLParser
+    except ImportError:
+        HTMLParser = None
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+DEFAULT_LIMIT = 5
+# The strainer sees the raw class attribute, so match 'result' as a whole word
+RESULT_CLASS = re.compile(r'(^|\s)result(\s|$)')
+
+
+def _clean(text: str) -> str:
+    # Collapse the indentation every parser keeps around titles in slightly different ways
+    return ' '.join(text.split())
+
+
+def _has_class(classes: Optional[str], name: str) -> bool:
+    return bool(classes) and name in classes.split()
+
+
+def parse_with_selectolax(html: str, limit: int = DEFAULT_LIMIT) -> List[Dict]:
+    results = []
+    for node in HTMLParser(html).css('div.result'):
+        title = node.css_first('h2')
+        snippet = node.css_first('a.result__snippet')
+        results.append({
+            'title': _clean(title.text()) if title is not None else '',
+            'snippet': _clean(snippet.text()) if snippet is not None else ''
+        })
+        if len(results) == limit:
+            break
+    return results
+
+
+def parse_with_lxml(html: str, limit: int = DEFAULT_LIMIT) -> List[Dict]:
+    if not html.strip():
+        return []
+    results = []
+    in_result = False
+    title = snippet = None
+    # Stream the page and stop as soon as `limit` result blocks have been closed
+    events = etree.iterparse(BytesIO(html.encode('utf-8')), events=('start', 'end'), html=True,
+                             encoding='utf-8', recover=True, no_network=True)
+    for event, element in events:
+        is_result = element.tag == 'div' and _has_class(element.get('class'), 'result')
+        if event == 'start':
+            if is_result:
+                in_result = True
+                title = snippet = None
+            continue
+        if is_result:
+            results.append({'title': _clean(title or ''), 'snippet': _clean(snippet or '')})
+            in_result = False
+            if len(results) == limit:
+                break
+        elif in_result:
+            if element.tag == 'h2' and title is None:
+                title = ''.join(element.itertext())
+            elif element.tag == 'a' and snippet is None and _has_class(element.get('class'), 'result__snippet'):
+                snippet = ''.join(element.itertext())
+            # Keep children of an open result until its fields have been read
+            continue
+        element.clear()
+    return results
+
+
+def parse_with_bs4(html: str, limit: int = DEFAULT_LIMIT) -> List[Dict]:
+    # Imported here since it is only the fallback parser and slow to import
+    from bs4 import BeautifulSoup, SoupStrainer
+    # Only build tree nodes for result blocks, and look each field up once
+    soup = BeautifulSoup(html, 'html.parser', parse_only=SoupStrainer('div', class_=RESULT_CLASS))
+    results = []
+    for node in soup.find_all('div', class_='result', limit=limit):
+        title = node.find('h2')
+        snippet = node.find('a', class_='result__snippet')
+        results.append({
+            'title': _clean(title.text) if title is not None else '',
+            'snippet': _clean(snippet.text) if snippet is not None else ''
+        })
+    return results
+
+
+PARSERS: Dict[str, Callable[[str, int], List[Dict]]] = {'bs4': parse_with_bs4}
+if etree is not None:
+    PARSERS['lxml'] = parse_with_lxml
+if HTMLParser is not None:
+    PARSERS['selectolax'] = parse_with_selectolax
+
+DEFAULT_BACKEND = next(name for name in ('selectolax', 'lxml', 'bs4') if name in PARSERS)
+
+
+def parse_results(html: str, limit: int = DEFAULT_LIMIT, backend: str = DEFAULT_BACKEND) -> List[Dict]:
+    """Return up to `limit` {'title', 'snippet'} dicts from a DuckDuckGo results page."""
+    return PARSERS[backend](html, limit)
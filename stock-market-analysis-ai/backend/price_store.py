@@ -0,0 +1,187 @@
+"""
+On-disk store of OHLCV bars, one memory-mapped .npy file per (symbol, interval).
+
+Bars are kept as a column-major float64 array with columns BAR_COLUMNS, so every
+column is contiguous and frames read from the store are views of the mapped file.
+Stale series are brought up to date by fetching only the shortest period that
+covers the bars since the last stored one. Files are replaced atomically, so
+several backend workers can share one store directory.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from history_cache import (
+    MARKET_HOURS_TTLS, OFF_HOURS_TTLS, fetch_market_history, is_market_open, period_days, slice_period
+)
+
+logger = logging.getLogger(__name__)
+
+PRICE_STORE_DIR = os.getenv(
+    'PRICE_STORE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'prices')
+)
+
+BAR_COLUMNS = ['Timestamp', 'Open', 'High', 'Low', 'Close', 'Volume']
+
+# Periods tried, shortest first, when fetching only the bars after the last stored one
+INCREMENTAL_PERIODS = ['5d', '1mo', '3mo', '6mo', '1y', '2y', '5y', '10y', 'max']
+
+
+def incremental_period(last: pd.Timestamp, now: pd.Timestamp) -> str:
+    """Shortest yfinance period reaching back past `last`."""
+    gap = (now - last).total_seconds() / 86400
+    return next(period for period in INCREMENTAL_PERIODS if period_days(period) > gap + 1)
+
+
+def frame_to_bars(frame: pd.DataFrame) -> np.ndarray:
+    """Pack a yfinance history frame into a column-major bars array."""
+    index = frame.index
+    if index.tz is not None:
+        index = index.tz_convert('UTC').tz_localize(None)
+    bars = np.empty((len(frame), len(BAR_COLUMNS)), order='F')
+    bars[:, 0] = index.as_unit('ns').asi8 / 1e9
+    for position, column in enumerate(BAR_COLUMNS[1:], start=1):
+        bars[:, position] = frame[column].to_numpy(dtype=float) if column in frame else np.nan
+    return bars
+
+
+def bars_to_frame(bars: np.ndarray, tz: Optional[str]) -> pd.DataFrame:
+    """Frame over the price columns of `bars`; no copy is made for a column-major array."""
+    index = pd.DatetimeIndex(np.round(bars[:, 0] * 1e9).astype('int64').view('datetime64[ns]'))
+    if tz is not None:
+        index = index.tz_localize('UTC').tz_convert(tz)
+    return pd.DataFrame(bars[:, 1:], index=index, columns=BAR_COLUMNS[1:], copy=False)
+
+
+class PriceStore:
+    """Persistent, incrementally refreshed OHLCV bars with the same call shape as a history fetcher."""
+
+    def __init__(self, root: str = PRICE_STORE_DIR,
+                 fetcher: Callable[[str, str, str], pd.DataFrame] = fetch_market_history,
+                 market_hours_ttls: Optional[Dict[str, float]] = None,
+                 off_hours_ttls: Optional[Dict[str, float]] = None,
+                 clock: Callable[[], float] = time.time,
+                 market_open: Callable[[], bool] = is_market_open):
+        self.root = root
+        self.fetcher = fetcher
+        self.market_hours_ttls = market_hours_ttls or MARKET_HOURS_TTLS
+        self.off_hours_ttls = off_hours_ttls or OFF_HOURS_TTLS
+        self.clock = clock
+        self.market_open = market_open
+        self._locks: Dict[tuple, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        self.disk_hits = 0
+        self.incremental_fetches = 0
+        self.full_fetches = 0
+        self.stale_served = 0
+
+    def ttl(self, interval: str) -> float:
+        ttls = self.market_hours_ttls if self.market_open() else self.off_hours_ttls
+        return ttls.get(interval, ttls['1d'])
+
+    def _paths(self, symbol: str, interval: str) -> Tuple[str, str]:
+        base = os.path.join(self.root, interval, symbol.replace(os.sep, '_'))
+        return base + '.npy', base + '.json'
+
+    def _lock(self, key: tuple) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def load(self, symbol: str, interval: str = '1d') -> Tuple[Optional[np.ndarray], Optional[Dict]]:
+        """Read-only memory map of the stored bars and their metadata, or (None, None)."""
+        bars_path, meta_path = self._paths(symbol, interval)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            return np.load(bars_path, mmap_mode='r'), meta
+        except (OSError, ValueError):
+            return None, None
+
+    def _save(self, symbol: str, interval: str, bars: np.ndarray, meta: Dict) -> None:
+        bars_path, meta_path = self._paths(symbol, interval)
+        os.makedirs(os.path.dirname(bars_path), exist_ok=True)
+        # Write beside the target and rename, so readers only ever see whole files
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(bars_path + suffix, 'wb') as f:
+            np.save(f, np.asfortranarray(bars))
+        os.replace(bars_path + suffix, bars_path)
+        with open(meta_path + suffix, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + suffix, meta_path)
+
+    def history(self, symbol: str, period: str = '1mo', interval: str = '1d') -> pd.DataFrame:
+        """Return `period` of bars for `symbol`, downloading only what the store is missing."""
+        with self._lock((symbol, interval)):
+            bars, meta = self.load(symbol, interval)
+            covered = bars is not None and len(bars) > 0 and period_days(meta['period']) >= period_days(period)
+            if covered and self.clock() - meta['synced_at'] < self.ttl(interval):
+                self.disk_hits += 1
+                return slice_period(bars_to_frame(bars, meta['tz']), period)
+
+            stored = bars_to_frame(bars, meta['tz']) if covered else None
+            store_period = meta['period'] if covered else period
+            if covered:
+                last = stored.index[-1]
+                last = last.tz_convert('UTC') if last.tz is not None else last.tz_localize('UTC')
+                fetch_period = incremental_period(last, pd.Timestamp(self.clock(), unit='s', tz='UTC'))
+                if period_days(fetch_period) >= period_days(store_period):
+                    fetch_period = store_period
+            else:
+                fetch_period = period
+
+            try:
+                fresh = self.fetcher(symbol, fetch_period, interval)
+            except Exception as e:
+                if stored is None:
+                    raise
+                logger.warning("Price store refresh failed for %s: %s; serving stored bars", symbol, e)
+                fresh = None
+            if fresh is None or fresh.empty:
+                if stored is None:
+                    return pd.DataFrame() if fresh is None else fresh
+                self.stale_served += 1
+                return slice_period(stored, period)
+
+            if fetch_period == store_period:
+                self.full_fetches += 1
+                merged = frame_to_bars(fresh)
+            else:
+                self.incremental_fetches += 1
+                # Refetched bars replace stored ones, since the last stored bar may have still been forming
+                new = frame_to_bars(fresh)
+                keep = np.asarray(bars[:, 0] < new[0, 0])
+                merged = np.concatenate([np.asarray(bars)[keep], new])
+            tz = str(fresh.index.tz) if fresh.index.tz is not None else None
+            # Trim to the stored period so intraday series do not grow without bound
+            merged = frame_to_bars(slice_period(bars_to_frame(merged, tz), store_period))
+            self._save(symbol, interval, merged, {'period': store_period, 'synced_at': self.clock(), 'tz': tz})
+
+            bars, meta = self.load(symbol, interval)
+            return slice_period(bars_to_frame(bars, meta['tz']), period)
+
+    def stats(self) -> Dict:
+        series = 0
+        if os.path.isdir(self.root):
+            for interval in os.listdir(self.root):
+                directory = os.path.join(self.root, interval)
+                if os.path.isdir(directory):
+                    series += sum(name.endswith('.npy') for name in os.listdir(directory))
+        return {
+            'disk_hits': self.disk_hits,
+            'incremental_fetches': self.incremental_fetches,
+            'full_fetches': self.full_fetches,
+            'stale_served': self.stale_served,
+            'series': series,
+            'root': self.root
+        }
+
+
+# Shared store behind the in-process history cache
+price_store = PriceStore()
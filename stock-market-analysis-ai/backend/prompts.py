@@ -0,0 +1,174 @@
+"""
+Prompt building for the stock analysis, within a token budget.
+
+The quote and indicators are sent as compact JSON without placeholders ('N/A',
+None, empty values) or fields that change on every fetch. News is deduplicated and
+each snippet shortened. Sections that failed upstream are listed as unavailable
+instead of passing their error text to the model. If the prompt is still over
+PROMPT_TOKEN_BUDGET, the last news items are dropped until it fits.
+
+Token counts are a local estimate (see `estimate_tokens`). They are close enough
+to size the prompt without loading a tokenizer or calling the API. `record_usage`
+logs the counts Groq reports for each completion.
+"""
+import json
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from llm_cache import VOLATILE_KEYS
+from tracing import llm_tokens
+
+logger = logging.getLogger(__name__)
+
+ANALYST_SYSTEM_PROMPT = "You are a professional Indian stock market analyst with expertise in technical and fundamental analysis."
+
+# Estimated tokens for the system and user messages together
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '1000'))
+# Characters kept from each news snippet
+NEWS_SNIPPET_CHARS = int(os.getenv('NEWS_SNIPPET_CHARS', '240'))
+
+ANALYSIS_INSTRUCTIONS = """Provide:
+1. Current market position and valuation
+2. Technical analysis interpretation
+3. News sentiment
+4. Trading recommendation (short-term and long-term)
+5. Key risks and opportunities
+6. If I buy at the current price, the target price and stop loss, with your reasoning
+
+If some data is missing, focus on what is available and mention the limitations."""
+
+# Values that carry no information for the model
+EMPTY_VALUES = (None, '', 'N/A')
+# Already part of the prompt's first line
+REDUNDANT_KEYS = {'symbol'}
+
+# Words, single digits and single symbols, roughly as a BPE tokenizer splits text
+_TOKEN_PIECES = re.compile(r"[^\W\d_]+|\d|[^\w\s]|_")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Token count estimate: one token per digit and symbol, and one per four letters
+    of a word. It rounds up, so a prompt within the budget by this count is within
+    it for the real tokenizer too, give or take a few percent.
+    """
+    return sum((len(piece) + 3) // 4 for piece in _TOKEN_PIECES.findall(text))
+
+
+def count_message_tokens(messages: List[Dict]) -> int:
+    # Plus a few tokens per message for the role markers
+    return sum(estimate_tokens(message['content']) + 4 for message in messages)
+
+
+def compact(value: Any) -> Any:
+    """`value` without placeholders, empty containers and volatile fields; None when nothing is left."""
+    if isinstance(value, dict):
+        items = {}
+        for key, item in value.items():
+            if key in VOLATILE_KEYS or key in REDUNDANT_KEYS:
+                continue
+            item = compact(item)
+            if item is not None:
+                items[key] = item
+        return items or None
+    if isinstance(value, (list, tuple)):
+        items = [item for item in (compact(item) for item in value) if item is not None]
+        return items or None
+    if isinstance(value, float) and value != value:
+        return None
+    if isinstance(value, str):
+        value = ' '.join(value.split())
+    return None if value in EMPTY_VALUES else value
+
+
+def shorten(text: str, limit: int) -> str:
+    """`text` cut at a word boundary to at most `limit` characters."""
+    if len(text) <= limit:
+        return text
+    return text[:limit].rsplit(' ', 1)[0].rstrip(',.;:') + '…'
+
+
+def news_lines(news_data: Any, snippet_chars: int = NEWS_SNIPPET_CHARS) -> List[str]:
+    """One line per distinct headline, in the order found."""
+    if not isinstance(news_data, list):
+        return []
+    lines = []
+    seen = set()
+    for item in news_data:
+        if not isinstance(item, dict):
+            continue
+        title = ' '.join(str(item.get('title') or '').split())
+        snippet = ' '.join(str(item.get('snippet') or '').split())
+        key = (title or snippet).lower()
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        snippet = shorten(snippet, snippet_chars)
+        lines.append(f"- {title}: {snippet}" if title and snippet else f"- {title or snippet}")
+    return lines
+
+
+def _section(value: Any) -> Optional[str]:
+    if not isinstance(value, dict) or 'error' in value:
+        return None
+    value = compact(value)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str) if value else None
+
+
+def _user_prompt(symbol: str, sections: Dict[str, Optional[str]], news: List[str]) -> str:
+    lines = [f"Analyze {symbol} (NSE) from this data."]
+    for label, text in sections.items():
+        if text:
+            lines.append(f"{label}: {text}")
+    if news:
+        lines.append('Recent news:')
+        lines.extend(news)
+    missing = [label.lower() for label, text in sections.items() if not text]
+    if not news:
+        missing.append('recent news')
+    if missing:
+        lines.append(f"Unavailable: {', '.join(missing)}.")
+    return '\n'.join(lines) + '\n\n' + ANALYSIS_INSTRUCTIONS
+
+
+def build_analysis_messages(symbol: str, stock_data: Dict, technical_data: Dict, news_data: List[Dict],
+                            budget: int = PROMPT_TOKEN_BUDGET) -> List[Dict]:
+    """Build the chat messages sent to Groq for a stock analysis, within `budget` estimated tokens."""
+    sections = {'Quote': _section(stock_data), 'Technical indicators': _section(technical_data)}
+    news = news_lines(news_data)
+    system = {"role": "system", "content": ANALYST_SYSTEM_PROMPT}
+    # Drop news from the end until the prompt fits; the quote and indicators are always sent
+    for kept in range(len(news), -1, -1):
+        messages = [system, {"role": "user", "content": _user_prompt(symbol, sections, news[:kept])}]
+        if count_message_tokens(messages) <= budget:
+            break
+    return messages
+
+
+def _usage_counts(usage: Any) -> Optional[tuple]:
+    prompt = getattr(usage, 'prompt_tokens', None)
+    completion = getattr(usage, 'completion_tokens', None)
+    if isinstance(prompt, int) and isinstance(completion, int):
+        return prompt, completion
+    return None
+
+
+def record_usage(symbol: str, messages: List[Dict], completion: str, elapsed: float, usage: Any = None) -> Dict:
+    """
+    Log and record the prompt and completion tokens of one Groq call. `usage` is the
+    usage Groq reported; without it (stub clients, streams that did not send it)
+    the counts are estimated.
+    """
+    counts = _usage_counts(usage)
+    source = 'reported'
+    if counts is None:
+        counts = (count_message_tokens(messages), estimate_tokens(completion))
+        source = 'estimated'
+    prompt_tokens, completion_tokens = counts
+    llm_tokens.observe(prompt_tokens, 'prompt')
+    llm_tokens.observe(completion_tokens, 'completion')
+    logger.info("LLM %s: %d prompt + %d completion tokens (%s) in %.2fs",
+                symbol, prompt_tokens, completion_tokens, source, elapsed)
+    return {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'source': source}
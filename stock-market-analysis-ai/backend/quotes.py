@@ -0,0 +1,202 @@
+"""
+Quote providers behind IndianStockAgent.get_stock_info.
+
+FastQuoteProvider derives the day's range and volume from cached intraday bars,
+52-week levels and share count from `fast_info`, and P/E from a long-lived cache
+of `Ticker.info`, so the slow `.info` scrape runs about once a day per symbol
+instead of on every request. A quote does not wait out that scrape: it answers
+without P/E and the cache is filled in the background for the next one. InfoQuoteProvider is the original `.info`-per-call
+path.
+"""
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+import pandas as pd
+
+import market_data
+from history_cache import get_history
+
+logger = logging.getLogger(__name__)
+
+# Seconds 52-week levels / share count and P/E inputs stay cached
+LEVELS_TTL = 6 * 3600
+FUNDAMENTALS_TTL = 24 * 3600
+# Seconds a quote waits for an uncached `.info` scrape before answering with P/E 'N/A'
+FUNDAMENTALS_WAIT = 0.25
+
+# Shared by every provider for fetching the cached parts of a quote side by side
+_quote_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='quotes')
+
+
+def fetch_fast_info(nse_symbol: str) -> Dict:
+    return market_data.provider.fast_info(nse_symbol)
+
+
+def fetch_fundamentals(nse_symbol: str) -> Dict:
+    return market_data.provider.fundamentals(nse_symbol)
+
+
+def _number(value, digits: int = 2):
+    """Round a finite number, or 'N/A' like the original quote fields."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 'N/A'
+    if value != value or value in (float('inf'), float('-inf')):
+        return 'N/A'
+    return round(value, digits) if digits else int(value)
+
+
+class TTLCache:
+    """Small per-key cache of slow-changing lookups; concurrent misses for a key share one fetch."""
+
+    def __init__(self, fetcher: Callable[[str], Dict], ttl: float, clock: Callable[[], float] = time.time):
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: Dict[str, tuple] = {}
+        # key -> (lock, callers holding or waiting on it); dropped when the last caller leaves
+        self._key_locks: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            key_lock, users = self._key_locks.get(key, (None, 0))
+            key_lock = key_lock or threading.Lock()
+            self._key_locks[key] = (key_lock, users + 1)
+        try:
+            with key_lock:
+                return self._get(key)
+        finally:
+            with self._lock:
+                users = self._key_locks[key][1] - 1
+                if users:
+                    self._key_locks[key] = (key_lock, users)
+                else:
+                    del self._key_locks[key]
+
+    def _get(self, key: str) -> Optional[Dict]:
+        entry = self._entries.get(key)
+        if entry is not None and self.clock() - entry[0] < self.ttl:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        try:
+            value = self.fetcher(key)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Error fetching %s: %s", key, e)
+            # An expired value beats none while the upstream is failing
+            return entry[1] if entry is not None else None
+        self._entries[key] = (self.clock(), value)
+        return value
+
+    def stats(self) -> Dict:
+        return {'hits': self.hits, 'misses': self.misses, 'errors': self.errors,
+                'entries': len(self._entries), 'in_flight': len(self._key_locks), 'ttl': self.ttl}
+
+
+class QuoteProvider(ABC):
+    """Builds the quote dict returned by IndianStockAgent.get_stock_info."""
+
+    @abstractmethod
+    def quote(self, nse_symbol: str) -> Dict:
+        """Quote for a Yahoo ticker such as TCS.NS, or {'error': ...}."""
+
+    def stats(self) -> Dict:
+        return {}
+
+
+class InfoQuoteProvider(QuoteProvider):
+    """The original path: today's daily bar plus a full `Ticker.info` scrape per call."""
+
+    def quote(self, nse_symbol: str) -> Dict:
+        current_data = get_history(nse_symbol, period='1d')
+        if current_data.empty:
+            return {'error': 'No current data available'}
+        info = market_data.provider.info(nse_symbol)
+        return {
+            'symbol': nse_symbol,
+            'current_price': round(float(current_data['Close'].iloc[-1]), 2),
+            'day_high': info.get('dayHigh', 'N/A'),
+            'day_low': info.get('dayLow', 'N/A'),
+            'volume': info.get('volume', 'N/A'),
+            'market_cap': info.get('marketCap', 'N/A'),
+            'pe_ratio': info.get('trailingPE', 'N/A'),
+            '52_week_high': info.get('fiftyTwoWeekHigh', 'N/A'),
+            '52_week_low': info.get('fiftyTwoWeekLow', 'N/A'),
+            'last_updated': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+
+class FastQuoteProvider(QuoteProvider):
+    """Quote from cached intraday bars, cached `fast_info` levels and long-TTL fundamentals."""
+
+    def __init__(self, history: Callable[..., pd.DataFrame] = get_history,
+                 levels: Optional[TTLCache] = None, fundamentals: Optional[TTLCache] = None,
+                 intraday_interval: str = '5m', fundamentals_wait: float = FUNDAMENTALS_WAIT):
+        self.history = history
+        self.levels = levels or TTLCache(fetch_fast_info, LEVELS_TTL)
+        self.fundamentals = fundamentals or TTLCache(fetch_fundamentals, FUNDAMENTALS_TTL)
+        self.intraday_interval = intraday_interval
+        self.fundamentals_wait = fundamentals_wait
+
+    def _session_bars(self, nse_symbol: str) -> pd.DataFrame:
+        # The latest session's intraday bars; fall back to the cached daily bar before the first print
+        bars = self.history(nse_symbol, period='1d', interval=self.intraday_interval)
+        if bars.empty:
+            bars = self.history(nse_symbol, period='1d', interval='1d')
+        return bars
+
+    def quote(self, nse_symbol: str) -> Dict:
+        levels = _quote_pool.submit(self.levels.get, nse_symbol)
+        fundamentals = _quote_pool.submit(self.fundamentals.get, nse_symbol)
+        bars = self._session_bars(nse_symbol)
+        if bars.empty:
+            return {'error': 'No current data available'}
+
+        price = float(bars['Close'].iloc[-1])
+        day_high = float(bars['High'].max())
+        day_low = float(bars['Low'].min())
+        levels = levels.result() or {}
+        try:
+            fundamentals = fundamentals.result(timeout=self.fundamentals_wait) or {}
+        except FutureTimeout:
+            # Still scraping: P/E is 'N/A' until the fetch lands in the cache
+            fundamentals = {}
+
+        shares = levels.get('shares')
+        market_cap = shares * price if shares else levels.get('market_cap')
+        eps = fundamentals.get('trailing_eps')
+        pe_ratio = price / eps if eps and eps > 0 else fundamentals.get('trailing_pe')
+        # Today's range can extend the cached 52-week levels
+        year_high = levels.get('year_high')
+        year_low = levels.get('year_low')
+
+        return {
+            'symbol': nse_symbol,
+            'current_price': round(price, 2),
+            'day_high': round(day_high, 2),
+            'day_low': round(day_low, 2),
+            'volume': int(bars['Volume'].sum()),
+            'market_cap': _number(market_cap, 0),
+            'pe_ratio': _number(pe_ratio),
+            '52_week_high': _number(max(year_high, day_high) if year_high else None),
+            '52_week_low': _number(min(year_low, day_low) if year_low else None),
+            'last_updated': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+    def stats(self) -> Dict:
+        return {'levels': self.levels.stats(), 'fundamentals': self.fundamentals.stats()}
+
+
+# Shared provider, so the levels and fundamentals caches outlive individual agents
+quote_provider = FastQuoteProvider()
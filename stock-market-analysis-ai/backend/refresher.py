@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from history_cache import is_market_open
+
+logger = logging.getLogger(__name__)
+
+# Seconds between background refreshes
+MARKET_HOURS_INTERVAL = 60
+OFF_HOURS_INTERVAL = 900
+
+# How many of the most requested symbols have their analysis inputs kept warm
+HOT_SYMBOLS = 5
+# Request counts are halved every cycle so recent interest outweighs old
+POPULARITY_DECAY = 0.5
+
+
+class Snapshot:
+    """A precomputed result and the time it was computed."""
+    __slots__ = ('data', 'as_of')
+
+    def __init__(self, data: Dict, as_of: float):
+        self.data = data
+        self.as_of = as_of
+
+    def age(self, now: float) -> float:
+        return max(0.0, now - self.as_of)
+
+    def etag(self, key: str) -> str:
+        """Weak validator that changes whenever the snapshot is recomputed."""
+        return f'W/"{key}-{int(self.as_of * 1000):x}"'
+
+    def payload(self, now: float) -> Dict:
+        """`data` with the snapshot time and its age in seconds."""
+        return {
+            **self.data,
+            'as_of': datetime.fromtimestamp(self.as_of, timezone.utc).isoformat(),
+            'age_seconds': round(self.age(now), 1)
+        }
+
+
+class MarketRefresher:
+    """
+    Keeps /trending snapshots and the analysis inputs of the most requested symbols
+    fresh in the background, on a shorter interval while the market is open.
+    """
+
+    def __init__(self, trending: Callable[[str], Awaitable[Dict]],
+                 gather: Callable[[str], Awaitable[Dict]],
+                 indexes: List[str] = None, hot_symbols: int = HOT_SYMBOLS,
+                 market_hours_interval: float = MARKET_HOURS_INTERVAL,
+                 off_hours_interval: float = OFF_HOURS_INTERVAL,
+                 clock: Callable[[], float] = time.time,
+                 market_open: Callable[[], bool] = is_market_open):
+        self.trending = trending
+        self.gather = gather
+        self.indexes = list(indexes or ['NIFTY50'])
+        self.hot_symbols = hot_symbols
+        self.market_hours_interval = market_hours_interval
+        self.off_hours_interval = off_hours_interval
+        self.clock = clock
+        self.market_open = market_open
+        self.popularity: Counter = Counter()
+        self._trending: Dict[str, Snapshot] = {}
+        self._data: Dict[str, Snapshot] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.cycles = 0
+        self.failures = 0
+
+    def interval(self) -> float:
+        return self.market_hours_interval if self.market_open() else self.off_hours_interval
+
+    def max_age(self) -> float:
+        # A snapshot older than this means the loop is not keeping up (or not running)
+        return 2 * self.interval()
+
+    def _fresh(self, snapshot: Optional[Snapshot]) -> Optional[Snapshot]:
+        if snapshot is None or snapshot.age(self.clock()) > self.max_age():
+            return None
+        return snapshot
+
+    def trending_snapshot(self, index: str) -> Optional[Snapshot]:
+        return self._fresh(self._trending.get(index))
+
+    def data_snapshot(self, symbol: str) -> Optional[Snapshot]:
+        return self._fresh(self._data.get(symbol))
+
+    def record_request(self, symbol: str) -> None:
+        self.popularity[symbol] += 1
+
+    def hot(self) -> List[str]:
+        return [symbol for symbol, _ in self.popularity.most_common(self.hot_symbols)]
+
+    async def refresh_trending(self, index: str) -> Snapshot:
+        snapshot = Snapshot(await self.trending(index), self.clock())
+        self._trending[index] = snapshot
+        if index not in self.indexes:
+            self.indexes.append(index)
+        return snapshot
+
+    async def refresh_symbol(self, symbol: str) -> Snapshot:
+        snapshot = Snapshot(await self.gather(symbol), self.clock())
+        self._data[symbol] = snapshot
+        return snapshot
+
+    async def refresh_once(self) -> None:
+        """Recompute every tracked index and the hot symbols once."""
+        hot = self.hot()
+        jobs = [self.refresh_trending(index) for index in self.indexes]
+        jobs += [self.refresh_symbol(symbol) for symbol in hot]
+        for result in await asyncio.gather(*jobs, return_exceptions=True):
+            if isinstance(result, Exception):
+                self.failures += 1
+                logger.warning("Background refresh failed: %s", result, exc_info=result)
+
+        # Stop warming symbols nobody asks for any more
+        for symbol in set(self._data) - set(hot):
+            del self._data[symbol]
+        for symbol in list(self.popularity):
+            self.popularity[symbol] *= POPULARITY_DECAY
+            if self.popularity[symbol] < 0.1:
+                del self.popularity[symbol]
+        self.cycles += 1
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.refresh_once()
+            except Exception as e:
+                logger.exception("Background refresh cycle failed")
+            await asyncio.sleep(self.interval())
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict:
+        now = self.clock()
+        return {
+            'running': self._task is not None and not self._task.done(),
+            'interval': self.interval(),
+            'cycles': self.cycles,
+            'failures': self.failures,
+            'indexes': {index: round(s.age(now), 1) for index, s in self._trending.items()},
+            'hot_symbols': {symbol: round(s.age(now), 1) for symbol, s in self._data.items()}
+        }
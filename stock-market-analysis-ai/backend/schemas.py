@@ -0,0 +1,48 @@
+"""
+Response models for /analyze and /trending.
+
+The handlers still return plain dicts. FastAPI validates them against these models
+and serializes the result itself, so these routes skip `jsonable_encoder`. Upstream
+sections whose shape depends on what Yahoo returned (quotes, indicators, or an
+{'error': ...} in their place) are kept as free-form mappings.
+"""
+from typing import Any, Dict, List, Optional, Union
+
+from pydantic import BaseModel
+
+
+class ErrorResponse(BaseModel):
+    error: str
+    suggestions: Optional[List[str]] = None
+
+
+class NewsItem(BaseModel):
+    title: str
+    snippet: str
+
+
+class AnalysisResponse(BaseModel):
+    stock_data: Dict[str, Any]
+    technical_data: Dict[str, Any]
+    news_data: List[NewsItem]
+    analysis: str
+    as_of: str
+    age_seconds: float
+
+
+class TrendingStock(BaseModel):
+    symbol: str
+    current_price: float
+    performance_5d: float
+    avg_volume: int
+    volume_rank: int
+    sector: str
+
+
+class TrendingResponse(BaseModel):
+    top_movers: List[TrendingStock]
+    most_active: List[TrendingStock]
+    # sector -> average 5-day performance, or {'error': ...} when the screen failed
+    sector_performance: Dict[str, Union[float, str]]
+    as_of: str
+    age_seconds: float
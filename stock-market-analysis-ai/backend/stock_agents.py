@@ -1,53 +1,157 @@
-import autogen
-from typing import List, Dict
-import yfinance as yf
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Dict, Optional, Tuple, Union
 import requests
-from bs4 import BeautifulSoup
+import httpx
+import threading
+import time
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
 import os
-from datetime import datetime
-from groq import Groq
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from history_cache import get_history, get_history_version
+from indicators import TrackedIndicators, latest_indicators
+from universe import load_universe
+from llm_cache import canonicalize, llm_cache, make_key
+from news_parser import parse_results
+from llm_dispatcher import BATCH, COMPLETION_TOKEN_RESERVE, INTERACTIVE, llm_dispatcher
+from prompts import build_analysis_messages, count_message_tokens, record_usage
+from quotes import QuoteProvider, quote_provider as default_quote_provider
+from symbols import SYMBOL_PATTERN, normalize_symbol, validate_symbol
+from resilience import CircuitBreaker, RetryableError, backoff_delays
+from tracing import span
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 GROQ_API_KEY = os.getenv('GROQ_API_KEY')
+logger = logging.getLogger(__name__)
 
-if not GROQ_API_KEY:
-    raise ValueError("GROQ_API_KEY not found in .env file")
+# Without a key the agents still fetch and return market data, with this in place of the AI analysis
+AI_UNAVAILABLE_MESSAGE = "AI analysis is unavailable: GROQ_API_KEY is not set."
 
-# Initialize Groq client
-groq_client = Groq(api_key=GROQ_API_KEY)
+# Groq clients, built on first use so importing this module neither loads the SDK nor needs the key
+_groq_clients: Dict[str, Any] = {}
+_groq_clients_lock = threading.Lock()
+
+
+def get_groq_client(async_client: bool = False):
+    """Shared Groq (or AsyncGroq) client, or None when GROQ_API_KEY is not set."""
+    if not GROQ_API_KEY:
+        return None
+    kind = 'async' if async_client else 'sync'
+    with _groq_clients_lock:
+        if kind not in _groq_clients:
+            from groq import AsyncGroq, Groq
+            # 429s are retried by the LLM dispatcher, which honours Retry-After
+            _groq_clients[kind] = (AsyncGroq(api_key=GROQ_API_KEY, max_retries=0) if async_client
+                                   else Groq(api_key=GROQ_API_KEY, max_retries=0))
+        return _groq_clients[kind]
+
+
+def ai_available() -> bool:
+    return bool(GROQ_API_KEY)
+
+ANALYSIS_MODEL = "gemma2-9b-it"
+
+# Symbols analyzed at once by a batch
+ANALYZE_BATCH_CONCURRENCY = int(os.getenv('ANALYZE_BATCH_CONCURRENCY', '4'))
+
+# News search connection settings
+SEARCH_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+SEARCH_CONNECT_TIMEOUT = 3.05
+SEARCH_READ_TIMEOUT = 8.0
+SEARCH_RETRIES = 2
+
+def _pooled_session() -> requests.Session:
+    """requests.Session that keeps connections to the search host alive between queries."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update(SEARCH_HEADERS)
+    return session
+
+# Shared by every WebSearchAgent so all requests reuse one pool and one failure history
+search_session = _pooled_session()
+search_breaker = CircuitBreaker('duckduckgo')
 
 class WebSearchAgent:
-    def __init__(self):
-        self.groq_client = groq_client
+    search_url = "https://duckduckgo.com/html/"
+    headers = SEARCH_HEADERS
+    # Last good results per query, served while the circuit breaker is open
+    max_recent_results = 256
+    _recent_results: 'OrderedDict[str, List[Dict]]' = OrderedDict()
+    _recent_lock = threading.Lock()
+
+    def __init__(self, session: Optional[requests.Session] = None,
+                 breaker: Optional[CircuitBreaker] = None,
+                 timeout: Tuple[float, float] = (SEARCH_CONNECT_TIMEOUT, SEARCH_READ_TIMEOUT),
+                 retries: int = SEARCH_RETRIES):
+        self.session = session or search_session
+        self.breaker = breaker or search_breaker
+        self.timeout = timeout
+        self.retries = retries
+
+    @staticmethod
+    def _parse_results(html: str) -> List[Dict]:
+        return parse_results(html, limit=5)
+
+    def _remember(self, query: str, results: List[Dict]) -> None:
+        with self._recent_lock:
+            self._recent_results[query] = results
+            self._recent_results.move_to_end(query)
+            while len(self._recent_results) > self.max_recent_results:
+                self._recent_results.popitem(last=False)
+
+    def _fallback(self, query: str) -> List[Dict]:
+        with self._recent_lock:
+            return list(self._recent_results.get(query, []))
+
+    def _handle_response(self, query: str, status_code: int, html: str) -> List[Dict]:
+        if status_code >= 500 or status_code == 429:
+            raise RetryableError(f"Search returned HTTP {status_code}")
+        with span('news_parse'):
+            results = self._parse_results(html)
+        self.breaker.record_success()
+        self._remember(query, results)
+        return results
 
     def search(self, query: str) -> List[Dict]:
-        url = f"https://duckduckgo.com/html/?q={query}"
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        
-        try:
-            response = requests.get(url, headers=headers)
-            soup = BeautifulSoup(response.text, 'html.parser')
-            results = []
-            
-            for result in soup.find_all('div', class_='result'):
-                title = result.find('h2').text if result.find('h2') else ''
-                snippet = result.find('a', class_='result__snippet').text if result.find('a', class_='result__snippet') else ''
-                results.append({
-                    'title': title,
-                    'snippet': snippet
-                })
-            return results[:5]
-        except Exception as e:
-            print(f"Error in web search: {str(e)}")
-            return []
+        with span('news_search'):
+            return self._search(query)
+
+    def _search(self, query: str) -> List[Dict]:
+        if not self.breaker.allow():
+            logger.warning("Web search circuit open, serving cached results for: %s", query)
+            return self._fallback(query)
+
+        delays = backoff_delays(self.retries)
+        while True:
+            try:
+                response = self.session.get(self.search_url, params={'q': query}, timeout=self.timeout)
+                return self._handle_response(query, response.status_code, response.text)
+            except (requests.ConnectionError, requests.Timeout, RetryableError) as e:
+                delay = next(delays, None)
+                if delay is None:
+                    self.breaker.record_failure()
+                    logger.warning("Error in web search: %s", e)
+                    return self._fallback(query)
+                time.sleep(delay)
+            except Exception as e:
+                self.breaker.record_failure()
+                logger.warning("Error in web search: %s", e)
+                return []
 
 class IndianStockAgent:
-    def __init__(self):
-        self.groq_client = groq_client
+    def __init__(self, quote_provider: Optional[QuoteProvider] = None):
+        self.quote_provider = quote_provider or default_quote_provider
+        # Per-symbol running indicators, seeded once from history and advanced bar by bar
+        self._indicators: Dict[str, TrackedIndicators] = {}
+        self._indicator_lock = threading.Lock()
 
     def get_stock_info(self, symbol: str) -> Dict:
         try:
@@ -55,28 +159,8 @@ class IndianStockAgent:
             symbol = symbol.replace('.NS', '')
             nse_symbol = f"{symbol}.NS"
             
-            stock = yf.Ticker(nse_symbol)
-            
-            # First try to get current data
-            current_data = stock.history(period='1d')
-            if current_data.empty:
-                return {'error': 'No current data available'}
-            
-            # Get stock info
-            info = stock.info
-            
-            return {
-                'symbol': nse_symbol,
-                'current_price': round(float(current_data['Close'].iloc[-1]), 2),
-                'day_high': info.get('dayHigh', 'N/A'),
-                'day_low': info.get('dayLow', 'N/A'),
-                'volume': info.get('volume', 'N/A'),
-                'market_cap': info.get('marketCap', 'N/A'),
-                'pe_ratio': info.get('trailingPE', 'N/A'),
-                '52_week_high': info.get('fiftyTwoWeekHigh', 'N/A'),
-                '52_week_low': info.get('fiftyTwoWeekLow', 'N/A'),
-                'last_updated': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            }
+            with span('quote'):
+                return self.quote_provider.quote(nse_symbol)
         except Exception as e:
             return {'error': f"Error fetching stock info: {str(e)}"}
 
@@ -86,119 +170,190 @@ class IndianStockAgent:
             symbol = symbol.replace('.NS', '')
             nse_symbol = f"{symbol}.NS"
             
-            # Fetch historical data
-            stock = yf.Ticker(nse_symbol)
-            hist = stock.history(period='1mo', interval='1d')
+            # Nothing new since the last call: reuse the result without touching the history
+            version = get_history_version(nse_symbol)
+            with self._indicator_lock:
+                tracked = self._indicators.get(nse_symbol)
+                if tracked is not None and version is not None and tracked.version == version:
+                    return dict(tracked.result)
+            
+            # Fetch historical data; 3 months is the shortest window with 50 daily bars
+            hist = get_history(nse_symbol, period='3mo', interval='1d')
             
             if hist.empty:
                 return {'error': 'No historical data available'}
             
-            print(f"Debug: Retrieved {len(hist)} days of historical data")
-            
             # Ensure we have enough data points
             if len(hist) < 50:
-                hist = stock.history(period='3mo', interval='1d')
-                if len(hist) < 50:
-                    return {
-                        'error': f'Insufficient data points. Got {len(hist)}, need at least 50'
-                    }
-            
-            # Calculate SMAs
-            try:
-                hist['SMA20'] = hist['Close'].rolling(window=20, min_periods=1).mean()
-                hist['SMA50'] = hist['Close'].rolling(window=50, min_periods=1).mean()
-                
-                # Calculate RSI
-                delta = hist['Close'].diff()
-                gain = delta.where(delta > 0, 0).rolling(window=14).mean()
-                loss = -delta.where(delta < 0, 0).rolling(window=14).mean()
-                rs = gain / loss
-                hist['RSI'] = 100 - (100 / (1 + rs))
-                
-                # Get the most recent values
-                latest = hist.iloc[-1]
-                
                 return {
-                    'sma20': round(float(latest['SMA20']), 2),
-                    'sma50': round(float(latest['SMA50']), 2),
-                    'rsi': round(float(latest['RSI']), 2),
-                    'trend': 'Bullish' if latest['SMA20'] > latest['SMA50'] else 'Bearish',
-                    'rsi_signal': 'Oversold' if latest['RSI'] < 30 else 'Overbought' if latest['RSI'] > 70 else 'Neutral',
-                    'last_close': round(float(latest['Close']), 2),
-                    'last_volume': int(latest['Volume']),
-                    'data_points': len(hist)
+                    'error': f'Insufficient data points. Got {len(hist)}, need at least 50'
                 }
+            
+            # Advance the running SMA/RSI state with any new or updated bars
+            try:
+                with span('indicators'), self._indicator_lock:
+                    tracked = self._indicators.setdefault(nse_symbol, TrackedIndicators())
+                    tracked.sync(hist['Close'])
+                    values = tracked.state.values()
+                    latest = hist.iloc[-1]
+                    
+                    tracked.result = {
+                        'sma20': round(values['sma20'], 2),
+                        'sma50': round(values['sma50'], 2),
+                        'rsi': round(values['rsi'], 2),
+                        'trend': 'Bullish' if values['sma20'] > values['sma50'] else 'Bearish',
+                        'rsi_signal': 'Oversold' if values['rsi'] < 30 else 'Overbought' if values['rsi'] > 70 else 'Neutral',
+                        'last_close': round(float(latest['Close']), 2),
+                        'last_volume': int(latest['Volume']),
+                        'data_points': len(hist)
+                    }
+                    tracked.version = get_history_version(nse_symbol)
+                    return dict(tracked.result)
             except Exception as calc_error:
                 return {'error': f'Error in calculations: {str(calc_error)}'}
                 
         except Exception as e:
             return {'error': f"Failed to fetch technical data: {str(e)}"}
 
-def verify_stock_data(symbol: str) -> bool:
-    """Verify if stock data is available for the given symbol."""
-    try:
-        symbol = symbol.replace('.NS', '')
-        nse_symbol = f"{symbol}.NS"
-        stock = yf.Ticker(nse_symbol)
-        hist = stock.history(period='1mo')
-        return not hist.empty
-    except Exception as e:
-        print(f"Error verifying {symbol}: {str(e)}")
-        return False
+    def _fetch_indicator_history(self, symbol: str) -> Optional[pd.DataFrame]:
+        try:
+            hist = get_history(f"{symbol}.NS", period='3mo', interval='1d')
+            return None if hist.empty else hist
+        except Exception as e:
+            logger.warning("Error fetching history for %s: %s", symbol, e)
+            return None
+
+    def analyze_technical_indicators_batch(self, symbols: List[str], max_workers: int = 16) -> Dict[str, Dict]:
+        """
+        Indicators for many symbols at once: histories are fetched concurrently, stacked
+        into one dates x symbols close matrix and every indicator is computed column-wise.
+        """
+        symbols = list(dict.fromkeys(s.strip().upper().replace('.NS', '') for s in symbols if s.strip()))
+        if not symbols:
+            return {}
+
+        workers = max(1, min(max_workers, len(symbols)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            histories = dict(zip(symbols, pool.map(self._fetch_indicator_history, symbols)))
+
+        results: Dict[str, Dict] = {
+            symbol: {'error': 'No historical data available'}
+            for symbol, hist in histories.items() if hist is None
+        }
+        histories = {symbol: hist for symbol, hist in histories.items() if hist is not None}
+        if not histories:
+            return results
+
+        try:
+            closes = stack_histories(histories, 'Close')
+            # Each symbol's own latest volume, as analyze_technical_indicators reports it
+            last_volume = stack_histories(histories, 'Volume').ffill().iloc[-1]
+            data_points = closes.notna().sum()
+            # Carry the last price over days a symbol did not trade so windows stay full
+            closes = closes.ffill()
+            latest = latest_indicators(closes.to_numpy(dtype=float))
+            last_close = closes.iloc[-1]
+        except Exception as calc_error:
+            error = {'error': f'Error in calculations: {str(calc_error)}'}
+            return {**results, **{symbol: dict(error) for symbol in histories}}
+
+        for column, symbol in enumerate(closes.columns):
+            points = int(data_points[symbol])
+            if points < 50:
+                results[symbol] = {'error': f'Insufficient data points. Got {points}, need at least 50'}
+                continue
+            values = {name: float(series[column]) for name, series in latest.items()}
+            results[symbol] = {
+                **{name: round(value, 2) for name, value in values.items()},
+                'trend': 'Bullish' if values['sma20'] > values['sma50'] else 'Bearish',
+                'rsi_signal': 'Oversold' if values['rsi'] < 30 else 'Overbought' if values['rsi'] > 70 else 'Neutral',
+                'last_close': round(float(last_close[symbol]), 2),
+                'last_volume': int(last_volume[symbol]),
+                'data_points': points
+            }
+        return {symbol: results[symbol] for symbol in symbols}
 
 class FinancialAnalysisAgent:
-    def __init__(self):
-        self.web_search_agent = WebSearchAgent()
-        self.indian_stock_agent = IndianStockAgent()
-        self.groq_client = groq_client
+    def __init__(self, web_search_agent: Optional[WebSearchAgent] = None,
+                 indian_stock_agent: Optional[IndianStockAgent] = None):
+        self.web_search_agent = web_search_agent or WebSearchAgent()
+        self.indian_stock_agent = indian_stock_agent or IndianStockAgent()
+        self._groq_client = None
+        self.llm_cache = llm_cache
+        self.llm_dispatcher = llm_dispatcher
 
-    def analyze_stock(self, symbol: str) -> Dict:
-        # Clean the symbol
+    @property
+    def groq_client(self):
+        # Resolved on first use, so building an agent never loads the Groq SDK
+        if self._groq_client is None:
+            self._groq_client = get_groq_client(async_client=False)
+        return self._groq_client
+
+    @groq_client.setter
+    def groq_client(self, client) -> None:
+        self._groq_client = client
+
+    def _create_completion(self, messages: List[Dict]) -> Tuple[Any, float]:
+        """The Groq completion for `messages`, and when the call started."""
+        start = time.perf_counter()
+        return self.groq_client.chat.completions.create(model=ANALYSIS_MODEL, messages=messages), start
+
+    def gather_data(self, symbol: str) -> Dict:
+        """Fetch quote, technical indicators and news once for a single request."""
         symbol = symbol.strip().upper().replace('.NS', '')
-        
-        print(f"Fetching data for {symbol}...")
-        
+
+        logger.debug("Fetching data for %s", symbol)
+
         stock_data = self.indian_stock_agent.get_stock_info(symbol)
         if 'error' in stock_data:
-            print(f"Warning: {stock_data['error']}")
-            
+            logger.warning("%s: %s", symbol, stock_data['error'])
+
         technical_data = self.indian_stock_agent.analyze_technical_indicators(symbol)
         if 'error' in technical_data:
-            print(f"Warning: {technical_data['error']}")
-            
+            logger.warning("%s: %s", symbol, technical_data['error'])
+
         news_data = self.web_search_agent.search(f"{symbol} stock news NSE India")
-        
-        analysis_prompt = f"""
-        Analyze the following data for {symbol}:
-        
-        Stock Data: {stock_data}
-        Technical Indicators: {technical_data}
-        Recent News: {news_data}
-        
-        Please provide a comprehensive analysis including:
-        1. Current market position and valuation
-        2. Technical analysis interpretation (if data available)
-        3. News sentiment analysis
-        4. Trading recommendation (Short-term and Long-term)
-        5. Key risks and opportunities
-        6. Also tell if I buy at the current price, what should be the target price and stop loss. Explain your reasoning.
 
-        
-        Note: If some data is missing or shows errors, please focus on the available data and mention the limitations in your analysis.
-        Also tell if I buy at the current price, what should be the target price and stop loss.
-        """
-        
+        return {
+            'stock_data': stock_data,
+            'technical_data': technical_data,
+            'news_data': news_data
+        }
+
+    def analyze_stock(self, symbol: str, data: Optional[Dict] = None) -> Dict:
+        """Run the AI analysis, reusing `data` from `gather_data` when given."""
+        # Clean the symbol
+        symbol = symbol.strip().upper().replace('.NS', '')
+
+        if data is None:
+            data = self.gather_data(symbol)
+
+        stock_data = data['stock_data']
+        technical_data = data['technical_data']
+        news_data = data['news_data']
+
+        if self.groq_client is None:
+            return {**data, 'analysis': AI_UNAVAILABLE_MESSAGE}
+
+        cache_key = analysis_cache_key(symbol, data)
+        cached = self.llm_cache.get(cache_key)
+        if cached is not None:
+            return {**data, 'analysis': cached}
+
         try:
-            completion = self.groq_client.chat.completions.create(
-                model="gemma2-9b-it",
-                messages=[
-                    {"role": "system", "content": "You are a professional Indian stock market analyst with expertise in technical and fundamental analysis."},
-                    {"role": "user", "content": analysis_prompt}
-                ]
-            )
-            
-            analysis = completion.choices[0].message.content
-            print(analysis)
+            messages = build_analysis_messages(symbol, stock_data, technical_data, news_data)
+            # Waits its turn in the same queue, and under the same limits, as the async agent's calls
+            reserved = count_message_tokens(messages) + COMPLETION_TOKEN_RESERVE
+            completion, start = self.llm_dispatcher.call_sync(lambda: self._create_completion(messages), reserved)
+            used = 0
+            try:
+                analysis = completion.choices[0].message.content
+                usage = record_usage(symbol, messages, analysis, time.perf_counter() - start,
+                                     getattr(completion, 'usage', None))
+                used = usage['prompt_tokens'] + usage['completion_tokens']
+            finally:
+                self.llm_dispatcher.settle(reserved, used)
+            self.llm_cache.set(cache_key, analysis)
             
             return {
                 'stock_data': stock_data,
@@ -209,6 +364,248 @@ class FinancialAnalysisAgent:
         except Exception as e:
             return {'error': f"Error in analysis: {str(e)}"}
 
+class AsyncWebSearchAgent(WebSearchAgent):
+    """WebSearchAgent that fetches results with a shared, pooled httpx.AsyncClient."""
+    def __init__(self, client: Optional[httpx.AsyncClient] = None,
+                 breaker: Optional[CircuitBreaker] = None,
+                 timeout: Tuple[float, float] = (SEARCH_CONNECT_TIMEOUT, SEARCH_READ_TIMEOUT),
+                 retries: int = SEARCH_RETRIES):
+        super().__init__(breaker=breaker, timeout=timeout, retries=retries)
+        connect_timeout, read_timeout = timeout
+        self.client = client or httpx.AsyncClient(
+            headers=self.headers,
+            follow_redirects=True,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=16, max_keepalive_connections=8)
+        )
+
+    async def search(self, query: str) -> List[Dict]:
+        with span('news_search'):
+            return await self._search_async(query)
+
+    async def _search_async(self, query: str) -> List[Dict]:
+        if not self.breaker.allow():
+            logger.warning("Web search circuit open, serving cached results for: %s", query)
+            return self._fallback(query)
+
+        delays = backoff_delays(self.retries)
+        try:
+            while True:
+                try:
+                    response = await self.client.get(self.search_url, params={'q': query})
+                    # Parsing is CPU-bound, keep it off the event loop
+                    return await asyncio.to_thread(self._handle_response, query, response.status_code,
+                                                   response.text)
+                except (httpx.TransportError, RetryableError) as e:
+                    delay = next(delays, None)
+                    if delay is None:
+                        self.breaker.record_failure()
+                        logger.warning("Error in web search: %s", e)
+                        return self._fallback(query)
+                    await asyncio.sleep(delay)
+                except Exception as e:
+                    self.breaker.record_failure()
+                    logger.warning("Error in web search: %s", e)
+                    return []
+        except asyncio.CancelledError:
+            # A cancelled call has no outcome; if it was the half-open trial, let the next call try
+            self.breaker.release()
+            raise
+
+class AsyncIndianStockAgent:
+    """Non-blocking facade over IndianStockAgent; market data calls run in the default executor."""
+    def __init__(self, stock_agent: Optional[IndianStockAgent] = None):
+        self.stock_agent = stock_agent or IndianStockAgent()
+
+    async def get_stock_info(self, symbol: str) -> Dict:
+        return await asyncio.to_thread(self.stock_agent.get_stock_info, symbol)
+
+    async def analyze_technical_indicators(self, symbol: str) -> Dict:
+        return await asyncio.to_thread(self.stock_agent.analyze_technical_indicators, symbol)
+
+    async def analyze_technical_indicators_batch(self, symbols: List[str]) -> Dict[str, Dict]:
+        return await asyncio.to_thread(self.stock_agent.analyze_technical_indicators_batch, symbols)
+
+class AsyncFinancialAnalysisAgent:
+    """Async counterpart of FinancialAnalysisAgent that fetches its inputs concurrently."""
+    def __init__(self, web_search_agent: Optional[AsyncWebSearchAgent] = None,
+                 indian_stock_agent: Optional[AsyncIndianStockAgent] = None):
+        self.web_search_agent = web_search_agent or AsyncWebSearchAgent()
+        self.indian_stock_agent = indian_stock_agent or AsyncIndianStockAgent()
+        self._groq_client = None
+        self.llm_cache = llm_cache
+        self.llm_dispatcher = llm_dispatcher
+
+    @property
+    def groq_client(self):
+        # Resolved on first use, so building an agent never loads the Groq SDK
+        if self._groq_client is None:
+            self._groq_client = get_groq_client(async_client=True)
+        return self._groq_client
+
+    @groq_client.setter
+    def groq_client(self, client) -> None:
+        self._groq_client = client
+
+    async def _create_completion(self, messages: List[Dict], **kwargs) -> Tuple[Any, float]:
+        """The Groq completion (or stream) for `messages`, and when the call started."""
+        start = time.perf_counter()
+        return await self.groq_client.chat.completions.create(model=ANALYSIS_MODEL, messages=messages,
+                                                              **kwargs), start
+
+    async def gather_data(self, symbol: str) -> Dict:
+        """Fetch quote, technical indicators and news concurrently for a single request."""
+        symbol = symbol.strip().upper().replace('.NS', '')
+
+        logger.debug("Fetching data for %s", symbol)
+
+        stock_data, technical_data, news_data = await asyncio.gather(
+            self.indian_stock_agent.get_stock_info(symbol),
+            self.indian_stock_agent.analyze_technical_indicators(symbol),
+            self.web_search_agent.search(f"{symbol} stock news NSE India")
+        )
+        for result in (stock_data, technical_data):
+            if 'error' in result:
+                logger.warning("%s: %s", symbol, result['error'])
+
+        return {
+            'stock_data': stock_data,
+            'technical_data': technical_data,
+            'news_data': news_data
+        }
+
+    async def analyze_stock(self, symbol: str, data: Optional[Dict] = None, priority: int = INTERACTIVE) -> Dict:
+        """
+        Run the AI analysis, reusing `data` from `gather_data` when given. The Groq call
+        waits in the LLM dispatcher queue at `priority`.
+        """
+        symbol = symbol.strip().upper().replace('.NS', '')
+
+        if data is None:
+            data = await self.gather_data(symbol)
+
+        if self.groq_client is None:
+            return {**data, 'analysis': AI_UNAVAILABLE_MESSAGE}
+
+        cache_key = analysis_cache_key(symbol, data)
+        cached = self.llm_cache.get(cache_key)
+        if cached is not None:
+            return {**data, 'analysis': cached}
+
+        try:
+            messages = build_analysis_messages(symbol, data['stock_data'], data['technical_data'], data['news_data'])
+            reserved = count_message_tokens(messages) + COMPLETION_TOKEN_RESERVE
+            with span('llm'):
+                completion, start = await self.llm_dispatcher.call(
+                    lambda: self._create_completion(messages), reserved, priority
+                )
+            used = 0
+            try:
+                analysis = completion.choices[0].message.content
+                usage = record_usage(symbol, messages, analysis, time.perf_counter() - start,
+                                     getattr(completion, 'usage', None))
+                used = usage['prompt_tokens'] + usage['completion_tokens']
+            finally:
+                self.llm_dispatcher.settle(reserved, used)
+            self.llm_cache.set(cache_key, analysis)
+            return {**data, 'analysis': analysis}
+        except Exception as e:
+            return {'error': f"Error in analysis: {str(e)}"}
+
+    async def stream_analysis(self, symbol: str) -> AsyncIterator[Tuple[str, Any]]:
+        """Yield (event, payload) pairs: each input as soon as it is ready, then analysis tokens."""
+        symbol = symbol.strip().upper().replace('.NS', '')
+
+        async def labelled(name: str, awaitable) -> Tuple[str, Any]:
+            return name, await awaitable
+
+        data = {}
+        pending = [
+            labelled('stock_data', self.indian_stock_agent.get_stock_info(symbol)),
+            labelled('technical_data', self.indian_stock_agent.analyze_technical_indicators(symbol)),
+            labelled('news_data', self.web_search_agent.search(f"{symbol} stock news NSE India"))
+        ]
+        for next_ready in asyncio.as_completed(pending):
+            name, result = await next_ready
+            data[name] = result
+            yield name, result
+
+        if self.groq_client is None:
+            yield 'analysis', AI_UNAVAILABLE_MESSAGE
+            return
+
+        cache_key = analysis_cache_key(symbol, data)
+        cached = self.llm_cache.get(cache_key)
+        if cached is not None:
+            yield 'analysis', cached
+            return
+
+        try:
+            tokens = []
+            usage = None
+            messages = build_analysis_messages(symbol, data['stock_data'], data['technical_data'], data['news_data'])
+            reserved = count_message_tokens(messages) + COMPLETION_TOKEN_RESERVE
+            with span('llm'):
+                async with self.llm_dispatcher.dispatch(
+                    lambda: self._create_completion(messages, stream=True), reserved, INTERACTIVE
+                ) as (stream, start):
+                    used = 0
+                    try:
+                        async for chunk in stream:
+                            # Groq reports usage on the last chunk, under x_groq
+                            usage = getattr(getattr(chunk, 'x_groq', None), 'usage', None) or usage
+                            token = chunk.choices[0].delta.content if chunk.choices else None
+                            if token:
+                                tokens.append(token)
+                                yield 'analysis', token
+                        usage = record_usage(symbol, messages, ''.join(tokens), time.perf_counter() - start, usage)
+                        used = usage['prompt_tokens'] + usage['completion_tokens']
+                    finally:
+                        self.llm_dispatcher.settle(reserved, used)
+            self.llm_cache.set(cache_key, ''.join(tokens))
+        except Exception as e:
+            yield 'error', f"Error in analysis: {str(e)}"
+
+    async def analyze_batch(self, symbols: List[str], concurrency: int = ANALYZE_BATCH_CONCURRENCY,
+                            analyze: Optional[Callable[[str], Awaitable[Dict]]] = None) -> AsyncIterator[Dict]:
+        """
+        Analyze several symbols, at most `concurrency` at a time, yielding each result
+        (with its 'symbol') as soon as it is ready. `analyze` defaults to `analyze_stock`
+        at batch priority, behind interactive requests.
+        """
+        analyze = analyze or (lambda symbol: self.analyze_stock(symbol, priority=BATCH))
+        valid = []
+        for symbol in dict.fromkeys(normalize_symbol(s) for s in symbols if s.strip()):
+            if SYMBOL_PATTERN.match(symbol):
+                valid.append(symbol)
+            else:
+                yield {'symbol': symbol, 'error': f"Invalid symbol: {symbol}"}
+
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def run(symbol: str) -> Dict:
+            async with semaphore:
+                try:
+                    # Unknown tickers are rejected by the local symbol index before any upstream call
+                    check = await validate_symbol(symbol)
+                    if not check['valid']:
+                        return {'symbol': symbol, 'error': check['error'], 'suggestions': check['suggestions']}
+                    return {'symbol': symbol, **await analyze(symbol)}
+                except Exception as e:
+                    return {'symbol': symbol, 'error': f"Failed to analyze stock: {str(e)}"}
+
+        # Start the tasks here so symbols take concurrency slots in the order given
+        tasks = [asyncio.ensure_future(run(symbol)) for symbol in valid]
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+
+def analysis_cache_key(symbol: str, data: Dict) -> str:
+    """LLM cache key for an analysis; volatile fields such as last_updated are ignored."""
+    canonical = {name: canonicalize(data[name]) for name in ('stock_data', 'technical_data', 'news_data')}
+    return make_key(ANALYSIS_MODEL, build_analysis_messages(
+        symbol, canonical['stock_data'], canonical['technical_data'], canonical['news_data']
+    ))
+
 def format_output(analysis: Dict) -> None:
     """Format and print the analysis output."""
     if 'error' in analysis:
@@ -235,98 +632,117 @@ def format_output(analysis: Dict) -> None:
     print("\nAI Analysis:")
     print(analysis['analysis'])
 
+def stack_histories(histories: Dict[str, pd.DataFrame], column: str) -> pd.DataFrame:
+    """Build a dates x symbols matrix of one history column, NaN where a symbol has no bar"""
+    symbols = list(histories)
+    index = histories[symbols[0]].index if symbols else pd.DatetimeIndex([])
+    if all(hist.index.equals(index) for hist in histories.values()):
+        # Common case: every symbol traded on the same days, so just stack columns
+        return pd.DataFrame({s: histories[s][column].to_numpy(dtype=float) for s in symbols},
+                            index=index, columns=symbols)
+    return pd.concat({s: hist[column] for s, hist in histories.items()}, axis=1).astype(float)
+
 class TrendingStocksAgent:
     """Agent to identify and analyze trending stocks in the Indian market"""
-    def __init__(self):
-        self.nifty50_symbols = [
-            'RELIANCE', 'TCS', 'HDFCBANK', 'INFY', 'ICICIBANK', 'HINDUNILVR', 
-            'ITC', 'SBIN', 'BHARTIARTL', 'KOTAKBANK'
-        ]  # Add more symbols as needed
+    def __init__(self, universe: Union[str, pd.Series] = 'NIFTY50', max_workers: int = 16):
+        # Either an index name from the bundled universe file or a symbol -> sector Series
+        self.universe = load_universe(universe) if isinstance(universe, str) else universe
+        self.symbols = list(self.universe.index)
+        self.max_workers = max_workers
+        self._histories: Optional[Dict[str, pd.DataFrame]] = None
+        self._matrix: Optional[Tuple[pd.DataFrame, pd.DataFrame]] = None
+        self._screen: Optional[pd.DataFrame] = None
 
-    def get_trending_stocks(self) -> Dict:
+    def _fetch_history(self, symbol: str) -> Optional[pd.DataFrame]:
         try:
-            trending_stocks = []
-            
-            for symbol in self.nifty50_symbols:
-                try:
-                    stock = yf.Ticker(f"{symbol}.NS")
-                    hist = stock.history(period='5d')
-                    
-                    if hist.empty:
-                        continue
-                    
-                    # Calculate 5-day performance
-                    performance = ((hist['Close'].iloc[-1] / hist['Close'].iloc[0]) - 1) * 100
-                    
-                    # Get current price and volume
-                    current_price = hist['Close'].iloc[-1]
-                    avg_volume = hist['Volume'].mean()
-                    
-                    trending_stocks.append({
-                        'symbol': symbol,
-                        'current_price': round(float(current_price), 2),
-                        'performance_5d': round(float(performance), 2),
-                        'avg_volume': int(avg_volume),
-                        'sector': self._get_sector(symbol)
-                    })
-                    
-                except Exception as e:
-                    print(f"Error processing {symbol}: {str(e)}")
-                    continue
-            
-            # Sort by performance
-            trending_stocks.sort(key=lambda x: abs(x['performance_5d']), reverse=True)
-            
+            hist = get_history(f"{symbol}.NS", period='5d')
+            return None if hist.empty else hist
+        except Exception as e:
+            logger.warning("Error processing %s: %s", symbol, e)
+            return None
+
+    def _load_histories(self) -> Dict[str, pd.DataFrame]:
+        """Fetch 5-day history for every symbol once, using a bounded worker pool"""
+        if self._histories is None:
+            workers = max(1, min(self.max_workers, len(self.symbols)))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                histories = pool.map(self._fetch_history, self.symbols)
+            self._histories = {
+                symbol: hist
+                for symbol, hist in zip(self.symbols, histories)
+                if hist is not None
+            }
+        return self._histories
+
+    def _load_matrix(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Build dates x symbols close and volume matrices from the loaded histories"""
+        if self._matrix is None:
+            histories = self._load_histories()
+            self._matrix = (stack_histories(histories, 'Close'), stack_histories(histories, 'Volume'))
+        return self._matrix
+
+    def _screen_universe(self) -> pd.DataFrame:
+        """Compute per-symbol screening metrics across the whole close/volume matrix"""
+        if self._screen is None:
+            closes, volumes = self._load_matrix()
+            if closes.empty:
+                self._screen = pd.DataFrame({
+                    'current_price': pd.Series(dtype=float),
+                    'performance_5d': pd.Series(dtype=float),
+                    'avg_volume': pd.Series(dtype='int64'),
+                    'volume_rank': pd.Series(dtype='int64'),
+                    'sector': pd.Series(dtype=object)
+                })
+                return self._screen
+
+            first = closes.bfill().iloc[0]
+            last = closes.ffill().iloc[-1]
+            avg_volume = volumes.mean()
+            screen = pd.DataFrame({
+                'current_price': last.round(2),
+                'performance_5d': ((last / first - 1) * 100).round(2),
+                'avg_volume': avg_volume,
+                'volume_rank': avg_volume.rank(ascending=False, method='min'),
+                'sector': self.universe.reindex(closes.columns).fillna('Unknown')
+            }).dropna(subset=['current_price', 'performance_5d', 'avg_volume'])
+            screen['avg_volume'] = screen['avg_volume'].astype('int64')
+            screen['volume_rank'] = screen['volume_rank'].astype('int64')
+            self._screen = screen
+        return self._screen
+
+    @staticmethod
+    def _records(screen: pd.DataFrame) -> List[Dict]:
+        return [
+            {
+                'symbol': symbol,
+                'current_price': float(row.current_price),
+                'performance_5d': float(row.performance_5d),
+                'avg_volume': int(row.avg_volume),
+                'volume_rank': int(row.volume_rank),
+                'sector': row.sector
+            }
+            for symbol, row in zip(screen.index, screen.itertuples(index=False))
+        ]
+
+    def get_trending_stocks(self, top_n: int = 5) -> Dict:
+        try:
+            screen = self._screen_universe()
+            top_movers = screen.loc[screen['performance_5d'].abs().nlargest(top_n).index]
+            most_active = screen.loc[screen['avg_volume'].nlargest(top_n).index]
+
             return {
-                'top_movers': trending_stocks[:5],
-                'most_active': sorted(trending_stocks, key=lambda x: x['avg_volume'], reverse=True)[:5]
+                'top_movers': self._records(top_movers),
+                'most_active': self._records(most_active)
             }
         except Exception as e:
             return {'error': f"Error fetching trending stocks: {str(e)}"}
 
-    def _get_sector(self, symbol: str) -> str:
-        """Get sector information for a stock"""
-        sector_mapping = {
-            'RELIANCE': 'Oil & Gas',
-            'TCS': 'IT',
-            'HDFCBANK': 'Banking',
-            'INFY': 'IT',
-            'ICICIBANK': 'Banking',
-            'HINDUNILVR': 'FMCG',
-            'ITC': 'FMCG',
-            'SBIN': 'Banking',
-            'BHARTIARTL': 'Telecom',
-            'KOTAKBANK': 'Banking'
-        }
-        return sector_mapping.get(symbol, 'Unknown')
-
     def get_sector_performance(self) -> Dict:
         """Get sector-wise performance"""
         try:
-            sector_performance = {}
-            
-            for symbol in self.nifty50_symbols:
-                sector = self._get_sector(symbol)
-                if sector not in sector_performance:
-                    sector_performance[sector] = []
-                
-                try:
-                    stock = yf.Ticker(f"{symbol}.NS")
-                    hist = stock.history(period='5d')
-                    if not hist.empty:
-                        performance = ((hist['Close'].iloc[-1] / hist['Close'].iloc[0]) - 1) * 100
-                        sector_performance[sector].append(performance)
-                except Exception:
-                    continue
-            
-            # Calculate average performance for each sector
-            sector_avg = {
-                sector: round(sum(performances)/len(performances), 2)
-                for sector, performances in sector_performance.items()
-                if performances
-            }
-            
-            return sector_avg
+            screen = self._screen_universe()
+            sector_avg = screen.groupby('sector')['performance_5d'].mean().round(2)
+            return {sector: float(performance) for sector, performance in sector_avg.items()}
         except Exception as e:
             return {'error': f"Error calculating sector performance: {str(e)}"}
 
@@ -371,6 +787,15 @@ def display_trending_stocks():
         for sector, performance in sorted(sector_perf.items(), key=lambda x: x[1], reverse=True):
             print(f"{sector}: {performance}%")
 
+async def analyze_stocks(symbols: List[str]) -> None:
+    """Analyze symbols concurrently, printing each one as soon as it finishes."""
+    analyst = AsyncFinancialAnalysisAgent()
+    async for analysis in analyst.analyze_batch(symbols):
+        print(f"\n{'='*50}")
+        print(f"Analyzing {analysis['symbol']}")
+        print(f"{'='*50}")
+        format_output(analysis)
+
 # Modify the main function to include trending stocks
 def main():
     print("Indian Stock Market Analysis Tool")
@@ -393,20 +818,7 @@ def main():
             user_input = input().strip()
             
             stocks = [s.strip() for s in user_input.split(',')]
-            
-            for symbol in stocks:
-                print(f"\nVerifying data availability for {symbol}...")
-                if not verify_stock_data(symbol):
-                    print(f"Warning: No data available for {symbol}. Skipping...")
-                    continue
-                
-                print(f"\n{'='*50}")
-                print(f"Analyzing {symbol}")
-                print(f"{'='*50}")
-                
-                analyst = FinancialAnalysisAgent()
-                analysis = analyst.analyze_stock(symbol)
-                format_output(analysis)
+            asyncio.run(analyze_stocks(stocks))
         
         elif choice == '3':
             print("\nThank you for using the Indian Stock Market Analysis Tool!")
@@ -0,0 +1,240 @@
+"""
+Local NSE symbol index used to validate tickers before any upstream call.
+
+Symbols come from the bundled universe file and NSE's full equity list
+(data/EQUITY_L.csv, a snapshot refreshed with `python symbols.py`; NSE_SYMBOLS_CSV points
+elsewhere). With the full list loaded, unknown tickers are rejected without
+touching the network. Without it, a ticker outside the universe file is checked
+once against the cached price history; a confirmed empty history is remembered,
+while an upstream error lets the ticker through to be checked again next time.
+"""
+import asyncio
+import difflib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+import requests
+
+from history_cache import get_history
+from universe import DATA_DIR, EXTRA_UNIVERSE_CSV, UNIVERSE_CSV
+
+logger = logging.getLogger(__name__)
+
+# NSE's list of every listed equity, bundled and refreshed from EQUITY_LIST_URL
+EQUITY_LIST_URL = 'https://nsearchives.nseindia.com/content/equities/EQUITY_L.csv'
+NSE_SYMBOLS_CSV = os.getenv('NSE_SYMBOLS_CSV', os.path.join(DATA_DIR, 'EQUITY_L.csv'))
+
+# NSE tickers: letters, digits, '&' and '-' (e.g. M&M, BAJAJ-AUTO)
+SYMBOL_PATTERN = re.compile(r'^[A-Z0-9&-]{1,20}$')
+
+# Seconds an unknown ticker stays rejected, and how many are remembered
+NEGATIVE_TTL = 6 * 3600
+MAX_NEGATIVE_ENTRIES = 10000
+# Probed tickers remembered as listed when the full list is missing
+MAX_LEARNED_ENTRIES = 10000
+# Seconds between checks for a newer symbol file
+RELOAD_CHECK_INTERVAL = 300
+
+
+def normalize_symbol(symbol: str) -> str:
+    return symbol.strip().upper().replace('.NS', '')
+
+
+def probe_history(symbol: str) -> bool:
+    """
+    Whether Yahoo has bars for the symbol; the window is cached for the analysis that
+    follows. Upstream errors are raised, since they say nothing about the ticker.
+    """
+    return not get_history(f"{symbol}.NS", period='1mo').empty
+
+
+def download_equity_list(path: str = NSE_SYMBOLS_CSV, url: str = EQUITY_LIST_URL) -> int:
+    """Fetch NSE's equity list into `path` and return the number of symbols in it."""
+    response = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'}, timeout=30)
+    response.raise_for_status()
+    # Write beside the target and swap it in, so a running index never reads half a file
+    partial = f"{path}.partial"
+    with open(partial, 'wb') as f:
+        f.write(response.content)
+    count = len(_read_symbols(partial))
+    os.replace(partial, path)
+    return count
+
+
+def _read_symbols(path: str) -> Dict[str, str]:
+    """symbol -> company name (or '') from the universe file or NSE's equity list."""
+    frame = pd.read_csv(path)
+    frame.columns = [column.strip().lower() for column in frame.columns]
+    if 'series' in frame.columns:
+        # EQUITY_L.csv also lists non-equity series; keep the ones quoted on yfinance
+        frame = frame[frame['series'].str.strip().isin(['EQ', 'BE', 'BZ'])]
+    names = frame['name of company'] if 'name of company' in frame.columns else pd.Series('', index=frame.index)
+    return dict(zip(frame['symbol'].str.strip().str.upper(), names.fillna('').str.strip()))
+
+
+class SymbolIndex:
+    """O(1) symbol lookups with typo suggestions and a negative cache for unknown tickers."""
+
+    def __init__(self, paths: Optional[List[str]] = None, complete: Optional[bool] = None,
+                 probe: Callable[[str], bool] = probe_history, negative_ttl: float = NEGATIVE_TTL,
+                 clock: Callable[[], float] = time.time):
+        # Default sources are looked up again on reload, so a list downloaded later is picked up
+        self._default_paths = not paths
+        self._complete = complete
+        self.paths = paths or self._find_sources()
+        self.complete = self._is_complete()
+        self.probe = probe
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self._names: Dict[str, str] = {}
+        self._learned: 'OrderedDict[str, None]' = OrderedDict()
+        self._negative: 'OrderedDict[str, float]' = OrderedDict()
+        self._mtimes: Dict[str, float] = {}
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.probes = 0
+        self.rejected = 0
+        self.load()
+
+    @staticmethod
+    def _find_sources() -> List[str]:
+        sources = (UNIVERSE_CSV, EXTRA_UNIVERSE_CSV, NSE_SYMBOLS_CSV)
+        return [p for p in sources if p and os.path.exists(p)]
+
+    def _is_complete(self) -> bool:
+        # A complete list means anything missing from it is unknown, with no need to probe
+        return NSE_SYMBOLS_CSV in self.paths if self._complete is None else self._complete
+
+    def load(self) -> None:
+        names = {}
+        mtimes = {}
+        for path in self.paths:
+            try:
+                names.update(_read_symbols(path))
+                mtimes[path] = os.path.getmtime(path)
+            except (OSError, KeyError, ValueError) as e:
+                logger.warning("Error loading symbols from %s: %s", path, e)
+        with self._lock:
+            self._names = names
+            self._mtimes = mtimes
+            self._checked_at = self.clock()
+
+    def _maybe_reload(self) -> None:
+        if self.clock() - self._checked_at < RELOAD_CHECK_INTERVAL:
+            return
+        self._checked_at = self.clock()
+        if self._default_paths:
+            paths = self._find_sources()
+            if paths != self.paths:
+                self.paths = paths
+                self.complete = self._is_complete()
+                self.load()
+                return
+        for path in self.paths:
+            try:
+                if os.path.getmtime(path) != self._mtimes.get(path):
+                    self.load()
+                    return
+            except OSError:
+                continue
+
+    def is_known(self, symbol: str) -> bool:
+        symbol = normalize_symbol(symbol)
+        return symbol in self._names or symbol in self._learned
+
+    def suggest(self, symbol: str, n: int = 3) -> List[str]:
+        """Closest known tickers, matching company names as well when they are loaded."""
+        symbol = normalize_symbol(symbol)
+        known = list(self._names) + list(self._learned)
+        matches = difflib.get_close_matches(symbol, known, n=n, cutoff=0.6)
+        if len(matches) < n:
+            by_name = {name.upper(): ticker for ticker, name in self._names.items() if name}
+            for name in difflib.get_close_matches(symbol, list(by_name), n=n, cutoff=0.6):
+                if by_name[name] not in matches:
+                    matches.append(by_name[name])
+        return matches[:n]
+
+    def _reject(self, symbol: str, error: str) -> Dict:
+        self.rejected += 1
+        suggestions = self.suggest(symbol) if SYMBOL_PATTERN.match(symbol) else []
+        if suggestions:
+            error += f". Did you mean {', '.join(suggestions)}?"
+        return {'symbol': symbol, 'valid': False, 'error': error, 'suggestions': suggestions}
+
+    def validate(self, symbol: str) -> Dict:
+        """{'symbol', 'valid'} plus 'error' and 'suggestions' for a rejected ticker."""
+        symbol = normalize_symbol(symbol)
+        self.lookups += 1
+        self._maybe_reload()
+        if not SYMBOL_PATTERN.match(symbol):
+            return self._reject(symbol, f"Invalid symbol: {symbol}")
+        if symbol in self._names or symbol in self._learned:
+            return {'symbol': symbol, 'valid': True}
+
+        with self._lock:
+            expires_at = self._negative.get(symbol)
+            if expires_at is not None and expires_at > self.clock():
+                self._negative.move_to_end(symbol)
+                return self._reject(symbol, f"Unknown symbol: {symbol}")
+
+        if not self.complete:
+            self.probes += 1
+            try:
+                listed = self.probe(symbol)
+            except Exception as e:
+                # Not cached either way: the analysis that follows reports the upstream error
+                logger.warning("Error probing %s: %s", symbol, e)
+                return {'symbol': symbol, 'valid': True}
+            if listed:
+                with self._lock:
+                    self._learned[symbol] = None
+                    self._learned.move_to_end(symbol)
+                    while len(self._learned) > MAX_LEARNED_ENTRIES:
+                        self._learned.popitem(last=False)
+                    self._negative.pop(symbol, None)
+                return {'symbol': symbol, 'valid': True}
+
+        with self._lock:
+            self._negative[symbol] = self.clock() + self.negative_ttl
+            self._negative.move_to_end(symbol)
+            while len(self._negative) > MAX_NEGATIVE_ENTRIES:
+                self._negative.popitem(last=False)
+        return self._reject(symbol, f"Unknown symbol: {symbol}")
+
+    def stats(self) -> Dict:
+        return {
+            'symbols': len(self._names),
+            'learned': len(self._learned),
+            'negative': len(self._negative),
+            'complete': self.complete,
+            'lookups': self.lookups,
+            'probes': self.probes,
+            'rejected': self.rejected
+        }
+
+
+# Shared index used by the API and the agents
+symbol_index = SymbolIndex()
+
+
+async def validate_symbol(symbol: str) -> Dict:
+    """Validate without blocking the event loop; known tickers never leave this thread."""
+    if symbol_index.is_known(symbol):
+        return {'symbol': normalize_symbol(symbol), 'valid': True}
+    return await asyncio.to_thread(symbol_index.validate, symbol)
+
+
+def verify_stock_data(symbol: str) -> bool:
+    """Check a symbol against the local index instead of downloading its history."""
+    return symbol_index.validate(symbol)['valid']
+
+
+if __name__ == "__main__":
+    print(f"{download_equity_list()} symbols written to {NSE_SYMBOLS_CSV}")
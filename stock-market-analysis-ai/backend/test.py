@@ -0,0 +1,1650 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Dict
+
+import httpx
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+os.environ.setdefault('GROQ_API_KEY', 'test-key')
+# Tests that exercise the LLM cache build their own instance
+os.environ['LLM_CACHE_TTL'] = '0'
+# Stub Groq calls should never wait on the shared rate limiter
+os.environ['GROQ_REQUESTS_PER_MINUTE'] = '60000'
+os.environ['GROQ_TOKENS_PER_MINUTE'] = '100000000'
+
+import main
+import market_data
+import news_parser
+import stock_agents
+import symbols
+import tracing
+import history_cache
+from history_cache import HistoryCache, slice_period
+from indicators import IndicatorState, TrackedIndicators
+from llm_cache import LLMCache
+from llm_dispatcher import BATCH, COMPLETION_TOKEN_RESERVE, INTERACTIVE, LLMDispatcher, LLMQueueFull
+from market_data import MarketDataProvider, ReplayFailure, ReplayProvider, record
+from price_store import PriceStore
+from prompts import build_analysis_messages, count_message_tokens, estimate_tokens
+from quotes import FastQuoteProvider, QuoteProvider, TTLCache
+from refresher import MarketRefresher
+from resilience import CircuitBreaker
+from singleflight import SingleFlight
+from symbols import SymbolIndex
+from universe import load_universe
+from stock_agents import (
+    AsyncFinancialAnalysisAgent, AsyncIndianStockAgent, AsyncWebSearchAgent, FinancialAnalysisAgent,
+    IndianStockAgent, TrendingStocksAgent, WebSearchAgent, analysis_cache_key
+)
+
+
+class StubStockAgent:
+    def __init__(self, calls: Counter):
+        self.calls = calls
+
+    def get_stock_info(self, symbol):
+        self.calls['quote'] += 1
+        return {'symbol': f"{symbol}.NS", 'current_price': 100.0}
+
+    def analyze_technical_indicators(self, symbol):
+        self.calls['history'] += 1
+        return {'sma20': 99.0, 'sma50': 98.0, 'rsi': 55.0}
+
+
+class StubWebAgent:
+    def __init__(self, calls: Counter):
+        self.calls = calls
+
+    def search(self, query):
+        self.calls['news'] += 1
+        return [{'title': 'Headline', 'snippet': 'Snippet'}]
+
+
+class StubGroqClient:
+    def __init__(self, calls: Counter):
+        self.calls = calls
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        self.calls['llm'] += 1
+        message = SimpleNamespace(content='Stub analysis')
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class AsyncStubWebAgent(StubWebAgent):
+    async def search(self, query):
+        return super().search(query)
+
+
+class AsyncStubGroqClient(StubGroqClient):
+    async def _create(self, **kwargs):
+        if kwargs.get('stream'):
+            self.calls['llm'] += 1
+            return self._stream(['Stub ', 'analysis'])
+        return super()._create(**kwargs)
+
+    @staticmethod
+    async def _stream(tokens):
+        for token in tokens:
+            delta = SimpleNamespace(content=token)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+def make_stub_financial_agent(calls: Counter) -> FinancialAnalysisAgent:
+    agent = FinancialAnalysisAgent(StubWebAgent(calls), StubStockAgent(calls))
+    agent.groq_client = StubGroqClient(calls)
+    return agent
+
+
+def make_async_stub_financial_agent(calls: Counter) -> AsyncFinancialAnalysisAgent:
+    agent = AsyncFinancialAnalysisAgent(AsyncStubWebAgent(calls), AsyncIndianStockAgent(StubStockAgent(calls)))
+    agent.groq_client = AsyncStubGroqClient(calls)
+    return agent
+
+
+def test_analyze_fetches_each_upstream_once(monkeypatch):
+    calls = Counter()
+    monkeypatch.setattr(main, 'financial_agent', make_async_stub_financial_agent(calls))
+
+    result = asyncio.run(main.analyze_stock('reliance.ns'))
+
+    assert result['analysis'] == 'Stub analysis'
+    assert result['stock_data']['symbol'] == 'RELIANCE.NS'
+    assert calls == Counter({'quote': 1, 'history': 1, 'news': 1, 'llm': 1})
+
+
+def test_async_gather_data_fetches_concurrently():
+    class SlowStockAgent(StubStockAgent):
+        def get_stock_info(self, symbol):
+            time.sleep(0.2)
+            return super().get_stock_info(symbol)
+
+        def analyze_technical_indicators(self, symbol):
+            time.sleep(0.2)
+            return super().analyze_technical_indicators(symbol)
+
+    class SlowWebAgent(AsyncStubWebAgent):
+        async def search(self, query):
+            await asyncio.sleep(0.2)
+            return await super().search(query)
+
+    calls = Counter()
+    agent = AsyncFinancialAnalysisAgent(SlowWebAgent(calls), AsyncIndianStockAgent(SlowStockAgent(calls)))
+
+    start = time.perf_counter()
+    data = asyncio.run(agent.gather_data('INFY'))
+
+    assert time.perf_counter() - start < 0.4
+    assert data['news_data'] and data['stock_data']['symbol'] == 'INFY.NS'
+
+
+def test_analyze_stock_without_data_fetches_once():
+    calls = Counter()
+    agent = make_stub_financial_agent(calls)
+
+    result = agent.analyze_stock('TCS')
+
+    assert result['news_data'][0]['title'] == 'Headline'
+    assert calls == Counter({'quote': 1, 'history': 1, 'news': 1, 'llm': 1})
+
+
+def make_history(days: int, start: str = '2024-01-01') -> pd.DataFrame:
+    index = pd.bdate_range(start, periods=days)
+    closes = np.linspace(100, 100 + days, days)
+    return pd.DataFrame({
+        'Open': closes, 'High': closes + 1, 'Low': closes - 1,
+        'Close': closes, 'Volume': np.full(days, 1000)
+    }, index=index)
+
+
+class CountingFetcher:
+    def __init__(self, days: int = 70):
+        self.days = days
+        self.calls = []
+
+    def __call__(self, symbol, period, interval):
+        self.calls.append((symbol, period, interval))
+        return make_history(self.days)
+
+
+def test_history_cache_serves_short_periods_from_cached_window():
+    fetcher = CountingFetcher()
+    cache = HistoryCache(fetcher=fetcher, market_open=lambda: True)
+
+    one_day = cache.history('RELIANCE.NS', '1d')
+    five_days = cache.history('RELIANCE.NS', '5d')
+    three_months = cache.history('RELIANCE.NS', '3mo')
+    one_month = cache.history('RELIANCE.NS', '1mo')
+
+    assert fetcher.calls == [('RELIANCE.NS', '3mo', '1d')]
+    assert len(one_day) == 1 and len(five_days) == 5 and len(three_months) == 70
+    assert one_month.index[0] > one_month.index[-1] - pd.DateOffset(months=1)
+    assert cache.stats()['hits'] == 3 and cache.stats()['misses'] == 1
+
+
+def test_history_cache_serves_views_that_callers_cannot_corrupt():
+    cache = HistoryCache(fetcher=CountingFetcher(), market_open=lambda: True)
+
+    first = cache.history('TCS.NS', '3mo')
+    month = cache.history('TCS.NS', '1mo')
+    assert np.shares_memory(first['Close'].to_numpy(), month['Close'].to_numpy())
+
+    # A caller writing to its window gets a private copy
+    first['Close'] = 0.0
+    first['sma'] = 1.0
+    again = cache.history('TCS.NS', '3mo')
+    assert 'sma' not in again and again['Close'].iloc[0] == 100.0
+
+
+def test_history_cache_ttl_is_shorter_during_market_hours():
+    now = [0.0]
+    market_open = [True]
+    fetcher = CountingFetcher()
+    cache = HistoryCache(fetcher=fetcher, clock=lambda: now[0], market_open=lambda: market_open[0],
+                         market_hours_ttls={'1d': 60}, off_hours_ttls={'1d': 3600})
+
+    cache.history('TCS.NS', '5d')
+    now[0] = 120
+    cache.history('TCS.NS', '5d')
+    assert len(fetcher.calls) == 2
+
+    market_open[0] = False
+    now[0] = 1000
+    cache.history('TCS.NS', '5d')
+    assert len(fetcher.calls) == 2
+
+
+def test_history_cache_evicts_least_recently_used():
+    fetcher = CountingFetcher()
+    entry_bytes = int(make_history(70).memory_usage(deep=True).sum())
+    cache = HistoryCache(fetcher=fetcher, max_bytes=entry_bytes * 2, market_open=lambda: True)
+
+    cache.history('A.NS', '1mo')
+    cache.history('B.NS', '1mo')
+    cache.history('A.NS', '1mo')
+    cache.history('C.NS', '1mo')
+    cache.history('A.NS', '1mo')
+    cache.history('B.NS', '1mo')
+
+    assert [call[0] for call in fetcher.calls] == ['A.NS', 'B.NS', 'C.NS', 'B.NS']
+    stats = cache.stats()
+    assert stats['evictions'] == 2 and stats['entries'] == 2
+    assert stats['bytes'] <= stats['max_bytes']
+
+
+def test_trending_fetches_each_symbol_once(monkeypatch):
+    fetcher = CountingFetcher(days=10)
+    monkeypatch.setattr(history_cache, 'history_cache', HistoryCache(fetcher=fetcher))
+    agent = TrendingStocksAgent()
+
+    trending = agent.get_trending_stocks()
+    sectors = agent.get_sector_performance()
+
+    assert len(agent.symbols) == 50
+    assert sorted(call[0] for call in fetcher.calls) == sorted(f"{s}.NS" for s in agent.symbols)
+    assert len(trending['top_movers']) == 5 and len(trending['most_active']) == 5
+    assert set(sectors) == set(agent.universe)
+
+
+def test_universe_rejects_indices_it_has_no_constituents_for(tmp_path):
+    assert len(load_universe('NIFTY50')) == 50
+    assert len(load_universe('NIFTY100')) == 100
+    with pytest.raises(ValueError, match='No NIFTY500 constituents'):
+        load_universe('NIFTY500')
+
+    # NSE's NIFTY 500 list is merged in as the wider level; bundled membership is kept
+    path = tmp_path / 'ind_nifty500list.csv'
+    path.write_text("Company Name,Industry,Symbol\nInfosys,Information Technology,INFY\n"
+                    "Suzlon Energy Ltd.,Capital Goods,SUZLON\n")
+    nifty500 = load_universe('NIFTY500', extra=str(path))
+    assert len(nifty500) == 101 and nifty500['SUZLON'] == 'Capital Goods'
+    assert nifty500['INFY'] == load_universe('NIFTY50')['INFY']
+    assert load_universe('NIFTY50', extra=str(path)).equals(load_universe('NIFTY50'))
+    assert len(load_universe('NIFTY100', extra=str(path))) == 100
+
+
+def test_trending_screen_matches_per_symbol_calculation(monkeypatch):
+    def fetcher(symbol, period, interval):
+        frame = make_history(5)
+        scale = {'AAA.NS': 1.0, 'BBB.NS': -1.0, 'CCC.NS': 3.0}[symbol]
+        frame['Close'] = 100 + scale * np.arange(5)
+        frame['Volume'] = 1000 * (1 + np.arange(5)) * abs(scale)
+        return frame
+
+    monkeypatch.setattr(history_cache, 'history_cache', HistoryCache(fetcher=fetcher))
+    universe = pd.Series({'AAA': 'IT', 'BBB': 'IT', 'CCC': 'Banking'})
+    agent = TrendingStocksAgent(universe=universe)
+
+    trending = agent.get_trending_stocks(top_n=2)
+    sectors = agent.get_sector_performance()
+
+    assert [s['symbol'] for s in trending['top_movers']] == ['CCC', 'AAA']
+    assert trending['top_movers'][0] == {
+        'symbol': 'CCC', 'current_price': 112.0, 'performance_5d': 12.0,
+        'avg_volume': 9000, 'volume_rank': 1, 'sector': 'Banking'
+    }
+    assert [s['symbol'] for s in trending['most_active']] == ['CCC', 'AAA']
+    assert sectors == {'Banking': 12.0, 'IT': 0.0}
+
+
+def parse_sse(body: str):
+    events = []
+    for block in body.strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines())
+        events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def test_analyze_stream_sends_inputs_then_tokens(monkeypatch):
+    calls = Counter()
+    monkeypatch.setattr(main, 'financial_agent', make_async_stub_financial_agent(calls))
+
+    async def fetch():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            return await client.get('/analyze/TCS/stream')
+
+    response = asyncio.run(fetch())
+    events = parse_sse(response.text)
+
+    assert response.headers['content-type'].startswith('text/event-stream')
+    assert {name for name, _ in events[:3]} == {'stock_data', 'technical_data', 'news_data'}
+    assert events[3:] == [('analysis', 'Stub '), ('analysis', 'analysis'), ('done', None)]
+    assert calls == Counter({'quote': 1, 'history': 1, 'news': 1, 'llm': 1})
+
+
+def test_llm_cache_key_ignores_volatile_fields():
+    data = {
+        'stock_data': {'symbol': 'TCS.NS', 'current_price': 100.0, 'last_updated': '2024-01-01 10:00:00'},
+        'technical_data': {'rsi': 55.0, 'sma20': 99.0},
+        'news_data': [{'title': 'Headline', 'snippet': 'Snippet  text'}]
+    }
+    later = {
+        'stock_data': {'last_updated': '2024-01-01 10:05:00', 'current_price': 100.0, 'symbol': 'TCS.NS'},
+        'technical_data': {'sma20': 99.0, 'rsi': 55.0},
+        'news_data': [{'title': 'Headline', 'snippet': 'Snippet text'}]
+    }
+    moved = {**data, 'stock_data': {**data['stock_data'], 'current_price': 101.0}}
+
+    assert analysis_cache_key('TCS', data) == analysis_cache_key('TCS', later)
+    assert analysis_cache_key('TCS', data) != analysis_cache_key('TCS', moved)
+    assert analysis_cache_key('TCS', data) != analysis_cache_key('INFY', data)
+
+
+def test_llm_cache_reuses_analysis_until_ttl_expires(tmp_path):
+    now = [0.0]
+    calls = Counter()
+    agent = make_stub_financial_agent(calls)
+    agent.llm_cache = LLMCache(str(tmp_path / 'llm.sqlite3'), ttl=60, clock=lambda: now[0])
+
+    agent.analyze_stock('TCS')
+    agent.analyze_stock('TCS')
+    assert calls['llm'] == 1
+    assert agent.llm_cache.stats()['hit_rate'] == 0.5
+
+    now[0] = 61
+    agent.analyze_stock('TCS')
+    assert calls['llm'] == 2
+
+
+def test_llm_cache_survives_restart(tmp_path):
+    path = str(tmp_path / 'llm.sqlite3')
+    LLMCache(path, ttl=60).set('key', 'cached analysis')
+
+    restarted = LLMCache(path, ttl=60)
+
+    assert restarted.get('key') == 'cached analysis'
+    assert restarted.stats()['hits'] == 1 and restarted.stats()['entries'] == 1
+
+
+def test_streamed_analysis_is_cached(monkeypatch, tmp_path):
+    calls = Counter()
+    agent = make_async_stub_financial_agent(calls)
+    agent.llm_cache = LLMCache(str(tmp_path / 'llm.sqlite3'), ttl=60)
+
+    async def collect():
+        return [event async for event in agent.stream_analysis('TCS')]
+
+    first = asyncio.run(collect())
+    second = asyncio.run(collect())
+
+    assert [payload for name, payload in first if name == 'analysis'] == ['Stub ', 'analysis']
+    assert [payload for name, payload in second if name == 'analysis'] == ['Stub analysis']
+    assert calls['llm'] == 1
+
+
+def test_concurrent_analyze_requests_share_one_pipeline(monkeypatch):
+    class SlowWebAgent(AsyncStubWebAgent):
+        async def search(self, query):
+            await asyncio.sleep(0.1)
+            return await super().search(query)
+
+    calls = Counter()
+    agent = AsyncFinancialAnalysisAgent(SlowWebAgent(calls), AsyncIndianStockAgent(StubStockAgent(calls)))
+    agent.groq_client = AsyncStubGroqClient(calls)
+    monkeypatch.setattr(main, 'financial_agent', agent)
+    monkeypatch.setattr(main, 'analysis_flights', SingleFlight())
+
+    async def burst():
+        return await asyncio.gather(*(main.analyze_stock(symbol) for symbol in ['RELIANCE', 'reliance.ns'] * 10))
+
+    results = asyncio.run(burst())
+
+    assert all(result == results[0] for result in results)
+    assert calls == Counter({'quote': 1, 'history': 1, 'news': 1, 'llm': 1})
+    assert main.analysis_flights.stats() == {'started': 1, 'shared': 19, 'in_flight': 0}
+
+
+def test_interactive_analysis_does_not_join_a_batch_flight(monkeypatch):
+    started = []
+
+    async def run_analysis(symbol, priority=INTERACTIVE):
+        started.append((symbol, priority))
+        await asyncio.sleep(0.3 if priority == BATCH else 0.0)
+        return {'analysis': f"{symbol} at {priority}"}
+
+    monkeypatch.setattr(main, 'run_analysis', run_analysis)
+    monkeypatch.setattr(main, 'analysis_flights', SingleFlight())
+    monkeypatch.setattr(main, 'refresher', make_refresher())
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            batch = asyncio.ensure_future(client.get('/analyze/batch', params={'symbols': 'TCS'}))
+            await asyncio.sleep(0.05)
+            start = time.monotonic()
+            interactive = await main.analyze_stock('TCS')
+            elapsed = time.monotonic() - start
+            return interactive, elapsed, await batch
+
+    interactive, elapsed, batch = asyncio.run(run())
+
+    assert interactive == {'analysis': f"TCS at {INTERACTIVE}"} and elapsed < 0.2
+    assert json.loads(batch.text) == {'symbol': 'TCS', 'analysis': f"TCS at {BATCH}"}
+    assert started == [('TCS', BATCH), ('TCS', INTERACTIVE)]
+
+
+def make_refresher(**kwargs) -> MarketRefresher:
+    return MarketRefresher(trending=main.load_trending, gather=main.gather_analysis_inputs,
+                           market_open=lambda: True, **kwargs)
+
+
+def test_concurrent_trending_requests_share_one_computation(monkeypatch):
+    def slow_fetcher(symbol, period, interval):
+        time.sleep(0.05)
+        return fetcher(symbol, period, interval)
+
+    fetcher = CountingFetcher(days=10)
+    monkeypatch.setattr(history_cache, 'history_cache', HistoryCache(fetcher=slow_fetcher))
+    monkeypatch.setattr(main, 'trending_flights', SingleFlight())
+    monkeypatch.setattr(main, 'refresher', make_refresher(clock=lambda: 0.0))
+
+    async def burst():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            return await asyncio.gather(*(client.get('/trending') for _ in range(10)))
+
+    results = [response.json() for response in asyncio.run(burst())]
+
+    assert all(result == results[0] for result in results)
+    assert len(fetcher.calls) == len(set(fetcher.calls)) == 50
+    assert main.trending_flights.stats()['started'] == 1
+
+
+SEARCH_PAGE = """
+<html><body>
+<div class="result"><h2>Reliance hits record high</h2><a class="result__snippet">Shares rose 3%.</a></div>
+<div class="result"><h2>Reliance Q2 results</h2><a class="result__snippet">Profit beats estimates.</a></div>
+</body></html>
+"""
+
+
+class StubSearchServer:
+    """Local DuckDuckGo stand-in that replays a script of 'ok', '500' and 'hang' responses."""
+
+    def __init__(self, script, hang_seconds=1.0):
+        self.script = list(script)
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                mode = server.script.pop(0) if server.script else 'ok'
+                if mode == 'hang':
+                    time.sleep(hang_seconds)
+                    return
+                status = 200 if mode == 'ok' else int(mode)
+                body = SEARCH_PAGE.encode() if status == 200 else b'error'
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/html/"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def search_server():
+    servers = []
+
+    def start(script, hang_seconds=1.0):
+        servers.append(StubSearchServer(script, hang_seconds))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def no_backoff(retries):
+    return iter([0.0] * retries)
+
+
+def make_search_agent(server, agent_class=WebSearchAgent, **kwargs):
+    kwargs.setdefault('breaker', CircuitBreaker('test', failure_threshold=2, reset_timeout=60))
+    kwargs.setdefault('timeout', (0.5, 0.3))
+    agent = agent_class(**kwargs)
+    agent.search_url = server.url
+    agent._recent_results = OrderedDict()
+    return agent
+
+
+def test_search_retries_through_5xx_burst(search_server, monkeypatch):
+    monkeypatch.setattr(stock_agents, 'backoff_delays', no_backoff)
+    server = search_server(['500', '503', 'ok'])
+    agent = make_search_agent(server)
+
+    results = agent.search('RELIANCE stock news NSE India')
+
+    assert [r['title'] for r in results] == ['Reliance hits record high', 'Reliance Q2 results']
+    assert server.requests == 3
+    assert agent.breaker.state == 'closed'
+
+
+def test_search_times_out_on_hung_upstream(search_server):
+    server = search_server(['hang', 'hang', 'hang'])
+    agent = make_search_agent(server, retries=1)
+
+    start = time.perf_counter()
+    results = agent.search('TCS stock news NSE India')
+
+    assert results == []
+    assert time.perf_counter() - start < 1.5
+    assert server.requests == 2
+
+
+def test_open_breaker_serves_cached_news_without_upstream_calls(search_server, monkeypatch):
+    monkeypatch.setattr(stock_agents, 'backoff_delays', no_backoff)
+    server = search_server(['ok', '500', '500', '500', '500'])
+    agent = make_search_agent(server, retries=1)
+    query = 'INFY stock news NSE India'
+
+    fresh = agent.search(query)
+    agent.search(query)
+    agent.search(query)
+    requests_before = server.requests
+
+    start = time.perf_counter()
+    cached = agent.search(query)
+
+    assert agent.breaker.state == 'open'
+    assert cached == fresh
+    assert server.requests == requests_before == 5
+    assert time.perf_counter() - start < 0.05
+    assert agent.search('unseen query') == []
+
+
+def test_cancelled_half_open_trial_lets_the_next_call_try():
+    now = [0.0]
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=30, clock=lambda: now[0])
+    breaker.record_failure()
+    now[0] = 30
+    requests_seen = []
+
+    async def handler(request):
+        requests_seen.append(request)
+        if len(requests_seen) == 1:
+            await asyncio.sleep(10)
+        return httpx.Response(200, text=SEARCH_PAGE)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    agent = AsyncWebSearchAgent(client=client, breaker=breaker)
+
+    async def run():
+        # The trial call is abandoned, as when the client disconnects
+        trial = asyncio.ensure_future(agent.search('TCS stock news NSE India'))
+        await asyncio.sleep(0.05)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        return await agent.search('TCS stock news NSE India')
+
+    results = asyncio.run(run())
+
+    assert len(requests_seen) == 2 and results
+    assert breaker.state == 'closed'
+
+
+def test_async_search_retries_and_times_out(search_server, monkeypatch):
+    monkeypatch.setattr(stock_agents, 'backoff_delays', no_backoff)
+    server = search_server(['502', 'hang', 'ok'])
+    agent = make_search_agent(server, AsyncWebSearchAgent)
+
+    async def run():
+        try:
+            return await agent.search('HDFCBANK stock news NSE India')
+        finally:
+            await agent.client.aclose()
+
+    results = asyncio.run(run())
+
+    assert len(results) == 2
+    assert server.requests == 3
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+@pytest.mark.parametrize('backend', sorted(news_parser.PARSERS))
+def test_news_parsers_agree_on_fixture_page(backend):
+    with open(os.path.join(FIXTURES_DIR, 'ddg_search.html'), encoding='utf-8') as f:
+        html = f.read()
+
+    results = news_parser.parse_results(html, limit=5, backend=backend)
+
+    assert results == news_parser.parse_with_bs4(html, limit=5)
+    assert len(results) == 5
+    assert results[0] == {
+        'title': 'Reliance AGM 20: Key announcements for investors',
+        'snippet': 'Market participants remained cautious ahead of the monetary policy decision, '
+                   'with the Nifty 50 hovering near 4 points.'
+    }
+    assert len(news_parser.parse_results(html, limit=50, backend=backend)) == 30
+    assert news_parser.parse_results('', backend=backend) == []
+
+
+def pandas_indicators(closes: pd.Series) -> Dict:
+    # The rolling-window implementation IndicatorState replaced
+    delta = closes.diff()
+    gain = delta.where(delta > 0, 0).rolling(window=14).mean()
+    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
+    return {
+        'sma20': closes.rolling(window=20, min_periods=1).mean().iloc[-1],
+        'sma50': closes.rolling(window=50, min_periods=1).mean().iloc[-1],
+        'rsi': (100 - (100 / (1 + gain / loss))).iloc[-1]
+    }
+
+
+def test_indicator_state_matches_pandas_reference():
+    closes = pd.Series(100 + np.cumsum(np.random.default_rng(7).normal(0, 1.5, 3000)))
+    state = IndicatorState()
+
+    for end, close in enumerate(closes, start=1):
+        state.push(close)
+        if end in (20, 51, 1200, 3000):
+            expected = pandas_indicators(closes[:end])
+            assert state.values() == pytest.approx(expected, rel=1e-9, abs=1e-7)
+
+    amended = closes.copy()
+    amended.iloc[-1] += 4.2
+    state.amend(amended.iloc[-1])
+    assert state.values() == pytest.approx(pandas_indicators(amended), rel=1e-9, abs=1e-7)
+
+
+def test_wilder_rsi_amend_matches_full_recompute():
+    closes = 100 + np.cumsum(np.random.default_rng(3).normal(0, 1, 200))
+    state = IndicatorState(rsi_method='wilder').seed(closes)
+    state.amend(closes[-1] - 2.5)
+
+    replayed = IndicatorState(rsi_method='wilder').seed(np.append(closes[:-1], closes[-1] - 2.5))
+    assert state.rsi() == pytest.approx(replayed.rsi(), rel=1e-12)
+
+
+def test_technical_indicators_update_incrementally(monkeypatch):
+    now = [0.0]
+    frames = [make_history(70)]
+    fetcher_calls = []
+
+    def fetch(symbol, period, interval):
+        fetcher_calls.append(symbol)
+        return frames[-1]
+
+    monkeypatch.setattr(history_cache, 'history_cache', HistoryCache(
+        fetcher=fetch, clock=lambda: now[0], market_open=lambda: True, market_hours_ttls={'1d': 60}))
+    agent = IndianStockAgent()
+
+    first = agent.analyze_technical_indicators('TCS')
+    assert agent.analyze_technical_indicators('TCS') == first
+    assert fetcher_calls == ['TCS.NS']
+
+    # Next refresh: today's bar moved and a new bar opened
+    frame = pd.concat([frames[0], make_history(1, start='2024-04-08')])
+    frame.iloc[-2, frame.columns.get_loc('Close')] -= 3
+    frames.append(frame)
+    now[0] = 120
+    state = agent._indicators['TCS.NS'].state
+    monkeypatch.setattr(state, 'seed', lambda closes: pytest.fail('state was re-seeded'))
+
+    updated = agent.analyze_technical_indicators('TCS')
+    expected = pandas_indicators(frame['Close'])
+
+    assert fetcher_calls == ['TCS.NS', 'TCS.NS']
+    assert updated['data_points'] == 71 and updated['last_close'] == round(frame['Close'].iloc[-1], 2)
+    assert updated['sma20'] == round(expected['sma20'], 2)
+    assert updated['sma50'] == round(expected['sma50'], 2)
+    assert updated['rsi'] == round(expected['rsi'], 2)
+
+
+def test_tracked_indicators_reseed_when_history_is_back_adjusted():
+    closes = make_history(70)['Close']
+    tracked = TrackedIndicators()
+    tracked.sync(closes)
+
+    # A dividend adjustment rescales every past close, and a new bar arrives
+    adjusted = pd.concat([closes * 0.97, make_history(1, start='2024-04-08')['Close']])
+    tracked.sync(adjusted)
+
+    expected = pandas_indicators(adjusted)
+    assert tracked.state.count == 71
+    assert tracked.state.values() == pytest.approx(expected, rel=1e-9, abs=1e-7)
+
+
+def random_walk_history(symbol: str, days: int = 63) -> pd.DataFrame:
+    frame = make_history(days)
+    seed = sum(map(ord, symbol))
+    frame['Close'] = 100 + np.cumsum(np.random.default_rng(seed).normal(0, 2, days))
+    frame['Volume'] = 1000 * seed + np.arange(days)
+    return frame
+
+
+def test_batch_indicators_match_pandas_and_per_symbol(monkeypatch):
+    def fetcher(symbol, period, interval):
+        if symbol == 'MISSING.NS':
+            return pd.DataFrame()
+        # A late listing with too few bars, and one missing a day the others traded
+        if symbol == 'NEW.NS':
+            return random_walk_history(symbol).iloc[-30:]
+        if symbol == 'GAP.NS':
+            return random_walk_history(symbol).drop(make_history(63).index[40])
+        return random_walk_history(symbol)
+
+    monkeypatch.setattr(history_cache, 'history_cache', HistoryCache(fetcher=fetcher))
+    # The made-up tickers are probed against the stub history rather than the bundled list
+    monkeypatch.setattr(symbols, 'symbol_index', SymbolIndex(complete=False))
+    agent = IndianStockAgent()
+
+    batch = asyncio.run(main.get_indicators('infy, tcs.ns,MISSING,NEW,GAP'))
+
+    assert list(batch) == ['INFY', 'TCS', 'MISSING', 'NEW', 'GAP']
+    assert batch['MISSING']['error'].startswith('Unknown symbol: MISSING')
+    assert batch['NEW'] == {'error': 'Insufficient data points. Got 30, need at least 50'}
+    assert batch['GAP']['data_points'] == 62
+    assert all(np.isfinite(value) for value in batch['GAP'].values() if isinstance(value, float))
+    assert batch['GAP']['last_volume'] == agent.analyze_technical_indicators('GAP')['last_volume']
+    for symbol in ('INFY', 'TCS'):
+        closes = random_walk_history(f"{symbol}.NS")['Close']
+        single = agent.analyze_technical_indicators(symbol)
+        # Every per-symbol field is in the batch result, with the same value
+        assert {key: batch[symbol][key] for key in single} == single
+
+        ema12 = closes.ewm(span=12, adjust=False).mean()
+        macd = ema12 - closes.ewm(span=26, adjust=False).mean()
+        signal = macd.ewm(span=9, adjust=False).mean()
+        middle = closes.rolling(20).mean()
+        width = 2 * closes.rolling(20).std(ddof=0)
+        assert batch[symbol]['ema12'] == round(ema12.iloc[-1], 2)
+        assert batch[symbol]['macd'] == round(macd.iloc[-1], 2)
+        assert batch[symbol]['macd_signal'] == round(signal.iloc[-1], 2)
+        assert batch[symbol]['bb_upper'] == round((middle + width).iloc[-1], 2)
+        assert batch[symbol]['bb_lower'] == round((middle - width).iloc[-1], 2)
+
+
+def assert_same_bars(left: pd.DataFrame, right: pd.DataFrame) -> None:
+    # The store keeps float volumes and nanosecond timestamps whatever the source used
+    assert_frame_equal(left, right, check_dtype=False, check_index_type=False, check_freq=False)
+
+
+class GrowingFetcher:
+    """Daily bars up to `days`, for a series that gains bars as the test advances."""
+
+    def __init__(self, days: int = 70):
+        self.days = days
+        self.calls = []
+
+    def __call__(self, symbol, period, interval):
+        self.calls.append(period)
+        closes = 100.0 + np.arange(self.days)
+        closes[-1] += 0.5  # the last bar is still forming
+        frame = make_history(self.days)
+        frame[['Open', 'High', 'Low', 'Close']] = np.column_stack([closes, closes + 1, closes - 1, closes])
+        return slice_period(frame, period)
+
+
+def test_price_store_survives_restart_and_appends_incrementally(tmp_path):
+    now = [pd.Timestamp('2024-04-06').timestamp()]
+    fetcher = GrowingFetcher()
+
+    def make_store():
+        return PriceStore(root=str(tmp_path), fetcher=fetcher, clock=lambda: now[0],
+                          market_open=lambda: False, off_hours_ttls={'1d': 3600})
+
+    first = make_store().history('INFY.NS', '3mo')
+    restarted = make_store()
+    assert_same_bars(restarted.history('INFY.NS', '1mo'), slice_period(first, '1mo'))
+    assert fetcher.calls == ['3mo'] and restarted.stats()['disk_hits'] == 1
+
+    # Three days later two more bars exist; only a short period is downloaded
+    fetcher.days = 72
+    now[0] += 3 * 86400
+    updated = restarted.history('INFY.NS', '3mo')
+    expected = slice_period(GrowingFetcher(72)('INFY.NS', '3mo', '1d'), '3mo')
+
+    assert fetcher.calls == ['3mo', '1mo']
+    assert restarted.stats()['incremental_fetches'] == 1
+    assert_same_bars(updated, expected)
+
+    # Reads are views of the memory-mapped file
+    bars, _ = restarted.load('INFY.NS')
+    assert isinstance(bars, np.memmap) and bars.flags.f_contiguous
+    array = updated['Close'].to_numpy()
+    while array is not None and not isinstance(array, np.memmap):
+        array = array.base
+    assert array is not None
+
+
+def test_price_store_serves_stored_bars_when_refresh_fails(tmp_path):
+    now = [0.0]
+    calls = []
+
+    def flaky(symbol, period, interval):
+        calls.append(period)
+        if len(calls) > 1:
+            raise ConnectionError('upstream down')
+        return make_history(70)
+
+    store = PriceStore(root=str(tmp_path), fetcher=flaky, clock=lambda: now[0],
+                       market_open=lambda: True, market_hours_ttls={'1d': 60})
+    first = store.history('TCS.NS', '3mo')
+    now[0] = 120
+
+    assert_same_bars(store.history('TCS.NS', '3mo'), first)
+    assert len(calls) == 2 and store.stats()['stale_served'] == 1
+
+
+def test_trending_is_served_from_refreshed_snapshot(monkeypatch):
+    now = [1_700_000_000.0]
+    fetcher = CountingFetcher(days=10)
+    monkeypatch.setattr(history_cache, 'history_cache', HistoryCache(fetcher=fetcher, clock=lambda: now[0]))
+    monkeypatch.setattr(main, 'trending_flights', SingleFlight())
+    monkeypatch.setattr(main, 'refresher', make_refresher(clock=lambda: now[0], market_hours_interval=60))
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            first = (await client.get('/trending')).json()
+            now[0] += 30
+            second = (await client.get('/trending')).json()
+
+            assert main.trending_flights.stats()['started'] == 1
+            assert second['as_of'] == first['as_of'] and second['age_seconds'] == 30.0
+            assert second['top_movers'] == first['top_movers']
+
+            # The background cycle recomputes it; a snapshot past twice the interval is recomputed inline
+            await main.refresher.refresh_once()
+            assert (await client.get('/trending')).json()['age_seconds'] == 0.0
+            now[0] += 121
+            assert (await client.get('/trending')).json()['age_seconds'] == 0.0
+
+    asyncio.run(run())
+    assert main.trending_flights.stats()['started'] == 3
+
+
+def test_refresher_prewarms_most_requested_symbols(monkeypatch):
+    calls = Counter()
+    monkeypatch.setattr(main, 'financial_agent', make_async_stub_financial_agent(calls))
+    monkeypatch.setattr(main, 'refresher', make_refresher(hot_symbols=1))
+    monkeypatch.setattr(main.refresher, 'indexes', [])
+    for symbol in ['TCS', 'TCS', 'INFY']:
+        main.refresher.record_request(symbol)
+
+    asyncio.run(main.refresher.refresh_once())
+    assert calls == Counter({'quote': 1, 'history': 1, 'news': 1})
+
+    result = asyncio.run(main.analyze_stock('tcs'))
+    assert result['analysis'] == 'Stub analysis' and 'as_of' in result
+    assert calls == Counter({'quote': 1, 'history': 1, 'news': 1, 'llm': 1})
+    assert list(main.refresher.stats()['hot_symbols']) == ['TCS']
+
+
+def test_lifespan_runs_and_stops_refresher(monkeypatch):
+    async def run():
+        async with main.lifespan(main.app):
+            await asyncio.sleep(0.05)
+            assert main.refresher.stats()['running']
+        return main.refresher.stats()
+
+    monkeypatch.setattr(main, 'refresher', make_refresher(market_hours_interval=0.01))
+    monkeypatch.setattr(main.refresher, 'indexes', [])
+    monkeypatch.setattr(main, 'MARKET_REFRESH_ENABLED', True)
+
+    stats = asyncio.run(run())
+    assert stats['cycles'] >= 2 and not stats['running']
+
+
+def test_analyze_batch_streams_each_symbol_as_it_finishes(monkeypatch):
+    delays = {'TCS': 0.4, 'INFY': 0.0, 'WIPRO': 0.2}
+    active = [0, 0]  # current, peak
+
+    class SlowWebAgent(AsyncStubWebAgent):
+        async def search(self, query):
+            active[0] += 1
+            active[1] = max(active)
+            await asyncio.sleep(delays[query.split()[0]])
+            active[0] -= 1
+            return await super().search(query)
+
+    def fetcher(symbol, period, interval):
+        return pd.DataFrame() if symbol == 'NOPE.NS' else make_history(70)
+
+    calls = Counter()
+    agent = AsyncFinancialAnalysisAgent(SlowWebAgent(calls), AsyncIndianStockAgent(StubStockAgent(calls)))
+    agent.groq_client = AsyncStubGroqClient(calls)
+    monkeypatch.setattr(main, 'financial_agent', agent)
+    monkeypatch.setattr(history_cache, 'history_cache', HistoryCache(fetcher=fetcher))
+    monkeypatch.setattr(symbols, 'symbol_index', SymbolIndex())
+
+    async def fetch():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            return await client.get('/analyze/batch',
+                                    params={'symbols': 'tcs,INFY,bad/sym,NOPE,wipro,TCS', 'concurrency': 2})
+
+    response = asyncio.run(fetch())
+    results = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.headers['content-type'].startswith('application/x-ndjson')
+    by_symbol = {r['symbol']: r for r in results}
+    assert results[0] == {'symbol': 'BAD/SYM', 'error': 'Invalid symbol: BAD/SYM'}
+    assert by_symbol['NOPE']['error'].startswith('Unknown symbol: NOPE')
+    assert [r['symbol'] for r in results if 'analysis' in r] == ['INFY', 'WIPRO', 'TCS']
+    assert len(results) == 5
+    assert active[1] == 2
+    assert calls['llm'] == 3
+
+
+def write_symbols(tmp_path, rows: str) -> str:
+    path = tmp_path / 'EQUITY_L.csv'
+    path.write_text('SYMBOL,NAME OF COMPANY, SERIES\n' + rows)
+    return str(path)
+
+
+def test_symbol_index_rejects_unknown_tickers_without_network(tmp_path):
+    path = write_symbols(tmp_path, 'RELIANCE,Reliance Industries Limited,EQ\n'
+                                   'HDFCBANK,HDFC Bank Limited,EQ\n'
+                                   'GOLDBEES,Nippon India ETF Gold BeES,ETF\n')
+    index = SymbolIndex(paths=[path], complete=True, probe=lambda s: pytest.fail('probed'))
+
+    assert index.validate('reliance.ns') == {'symbol': 'RELIANCE', 'valid': True}
+    typo = index.validate('RELIANC')
+    assert not typo['valid'] and typo['suggestions'] == ['RELIANCE']
+    assert typo['error'] == 'Unknown symbol: RELIANC. Did you mean RELIANCE?'
+    assert index.validate('HDFC BANK')['error'].startswith('Invalid symbol')
+    assert not index.validate('GOLDBEES')['valid']
+    assert index.stats()['negative'] == 2
+
+
+def test_symbol_index_probes_unlisted_tickers_once(tmp_path):
+    now = [0.0]
+    probes = Counter()
+
+    def probe(symbol):
+        probes[symbol] += 1
+        return symbol == 'IRFC'
+
+    index = SymbolIndex(paths=[write_symbols(tmp_path, 'TCS,Tata Consultancy Services Limited,EQ\n')],
+                        complete=False, probe=probe, negative_ttl=60, clock=lambda: now[0])
+
+    for _ in range(3):
+        assert index.validate('IRFC')['valid']
+        assert not index.validate('NOTREAL')['valid']
+    assert probes == Counter({'IRFC': 1, 'NOTREAL': 1})
+
+    # The negative entry expires, so a newly listed ticker is picked up
+    now[0] = 61
+    index.validate('NOTREAL')
+    assert probes['NOTREAL'] == 2
+
+
+def test_symbol_index_does_not_cache_probe_errors(tmp_path):
+    probes = Counter()
+
+    def probe(symbol):
+        probes[symbol] += 1
+        raise ConnectionError('Yahoo is down')
+
+    index = SymbolIndex(paths=[write_symbols(tmp_path, 'TCS,Tata Consultancy Services Limited,EQ\n')],
+                        complete=False, probe=probe)
+
+    # An outage lets the ticker through and is asked about again, rather than remembered as unknown
+    assert index.validate('IRFC') == {'symbol': 'IRFC', 'valid': True}
+    assert index.validate('IRFC')['valid']
+    assert probes['IRFC'] == 2
+    assert index.stats()['negative'] == 0 and index.stats()['learned'] == 0
+
+
+def test_default_symbol_index_loads_the_bundled_equity_list():
+    index = SymbolIndex(probe=lambda s: pytest.fail('probed'))
+
+    assert index.complete and index.stats()['symbols'] > 1000
+    assert index.validate('SUZLON')['valid']
+    assert not index.validate('NOTREAL')['valid']
+
+
+def test_symbol_index_picks_up_an_equity_list_downloaded_later(monkeypatch, tmp_path):
+    now = [0.0]
+    path = str(tmp_path / 'EQUITY_L.csv')
+    monkeypatch.setattr(symbols, 'NSE_SYMBOLS_CSV', path)
+    index = SymbolIndex(probe=lambda s: False, clock=lambda: now[0])
+    assert not index.complete and path not in index.paths
+
+    write_symbols(tmp_path, 'SUZLON,Suzlon Energy Limited,EQ\n')
+    now[0] = symbols.RELOAD_CHECK_INTERVAL
+    index.probe = lambda s: pytest.fail('probed')
+
+    assert index.validate('SUZLON')['valid']
+    assert not index.validate('NOTREAL')['valid']
+    assert index.complete and path in index.paths
+
+
+def test_symbol_index_bounds_learned_tickers(monkeypatch, tmp_path):
+    monkeypatch.setattr(symbols, 'MAX_LEARNED_ENTRIES', 2)
+    index = SymbolIndex(paths=[write_symbols(tmp_path, 'TCS,Tata Consultancy Services Limited,EQ\n')],
+                        complete=False, probe=lambda s: True)
+
+    for symbol in ('AAA', 'BBB', 'CCC'):
+        assert index.validate(symbol)['valid']
+
+    assert index.stats()['learned'] == 2
+    assert not index.is_known('AAA') and index.is_known('CCC')
+
+
+def test_unknown_symbol_is_rejected_before_upstream_calls(monkeypatch, tmp_path):
+    calls = Counter()
+    monkeypatch.setattr(main, 'financial_agent', make_async_stub_financial_agent(calls))
+    monkeypatch.setattr(symbols, 'symbol_index', SymbolIndex(
+        paths=[write_symbols(tmp_path, 'INFY,Infosys Limited,EQ\n')], complete=True))
+
+    result = asyncio.run(main.analyze_stock('INFI'))
+
+    assert result == {'error': 'Unknown symbol: INFI. Did you mean INFY?', 'suggestions': ['INFY']}
+    assert calls == Counter()
+
+
+def test_fast_quote_uses_intraday_bars_and_cached_fundamentals():
+    now = [0.0]
+    calls = Counter()
+    index = pd.date_range('2024-04-05 09:15', periods=6, freq='5min')
+    intraday = pd.DataFrame({
+        'Open': [100, 101, 102, 103, 104, 105], 'High': [101, 103, 104, 110, 106, 106],
+        'Low': [99, 100, 95, 102, 103, 104], 'Close': [101, 102, 103, 104, 105, 105.5],
+        'Volume': [10, 20, 30, 40, 50, 60]
+    }, index=index)
+
+    def history(symbol, period, interval):
+        calls[f"history_{interval}"] += 1
+        return intraday if interval == '5m' else make_history(1)
+
+    def fast_info(symbol):
+        calls['fast_info'] += 1
+        return {'year_high': 108.0, 'year_low': 80.0, 'shares': 1000, 'market_cap': 1.0}
+
+    def fundamentals(symbol):
+        calls['info'] += 1
+        if calls['info'] > 1:
+            raise ConnectionError('quoteSummary failed')
+        return {'trailing_pe': 20.0, 'trailing_eps': 5.0}
+
+    provider = FastQuoteProvider(history=history,
+                                 levels=TTLCache(fast_info, ttl=60, clock=lambda: now[0]),
+                                 fundamentals=TTLCache(fundamentals, ttl=600, clock=lambda: now[0]))
+    agent = IndianStockAgent(quote_provider=provider)
+
+    quote = agent.get_stock_info('TCS')
+    for _ in range(3):
+        agent.get_stock_info('TCS')
+
+    assert {key: quote[key] for key in quote if key != 'last_updated'} == {
+        'symbol': 'TCS.NS', 'current_price': 105.5, 'day_high': 110.0, 'day_low': 95.0,
+        'volume': 210, 'market_cap': 105500, 'pe_ratio': 21.1,
+        '52_week_high': 110.0, '52_week_low': 80.0
+    }
+    assert calls == Counter({'history_5m': 4, 'fast_info': 1, 'info': 1})
+
+    # Levels refresh on their own TTL; a failing fundamentals refresh keeps the last value
+    now[0] = 700
+    assert agent.get_stock_info('TCS')['pe_ratio'] == 21.1
+    assert calls['fast_info'] == 2 and calls['info'] == 2
+
+    intraday = intraday.iloc[:0]
+    assert agent.get_stock_info('TCS')['current_price'] == 100.0
+    assert calls['history_1d'] == 1
+
+
+def test_fast_quote_does_not_wait_for_a_slow_first_fundamentals_scrape():
+    scraped = threading.Event()
+    release = threading.Event()
+
+    def fundamentals(symbol):
+        release.wait(5)
+        scraped.set()
+        return {'trailing_pe': 20.0, 'trailing_eps': 5.0}
+
+    cache = TTLCache(fundamentals, ttl=600)
+    provider = FastQuoteProvider(history=lambda symbol, period, interval: make_history(1),
+                                 levels=TTLCache(lambda symbol: {}, ttl=60), fundamentals=cache,
+                                 fundamentals_wait=0.05)
+
+    started = time.perf_counter()
+    assert provider.quote('TCS.NS')['pe_ratio'] == 'N/A'
+    assert time.perf_counter() - started < 1
+
+    # The scrape finishes in the background and the next quote has P/E
+    release.set()
+    assert scraped.wait(5)
+    for _ in range(100):
+        if cache.stats()['entries']:
+            break
+        time.sleep(0.01)
+    assert provider.quote('TCS.NS')['pe_ratio'] == round(make_history(1)['Close'].iloc[-1] / 5.0, 2)
+
+
+def test_ttl_cache_drops_per_key_locks_once_fetches_finish():
+    release = threading.Event()
+
+    def fetcher(key):
+        release.wait(5)
+        return {'key': key}
+
+    cache = TTLCache(fetcher, ttl=60)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(cache.get, key) for key in ('A', 'A', 'B', 'C')]
+        time.sleep(0.05)
+        assert cache.stats()['in_flight'] == 3
+        release.set()
+        assert [f.result() for f in futures] == [{'key': 'A'}, {'key': 'A'}, {'key': 'B'}, {'key': 'C'}]
+
+    for key in map(str, range(50)):
+        cache.get(key)
+    assert cache.stats()['in_flight'] == 0 and cache.stats()['misses'] == 53
+
+
+class RecordingSource(MarketDataProvider):
+    """Stands in for Yahoo while fixtures are recorded."""
+
+    def history(self, symbol, period, interval):
+        return slice_period(make_history(70).tz_localize('Asia/Kolkata'), period)
+
+    def fast_info(self, symbol):
+        return {'year_high': 200.0, 'year_low': 90.0, 'shares': 1000, 'market_cap': 1.0}
+
+    def fundamentals(self, symbol):
+        return {'trailing_pe': 20.0, 'trailing_eps': 8.5}
+
+    def info(self, symbol):
+        return {'dayHigh': 170.0, 'trailingPE': 20.0}
+
+
+def test_replay_provider_serves_recorded_fixtures_to_the_agents(monkeypatch, tmp_path):
+    record(['TCS.NS'], root=str(tmp_path), source=RecordingSource(), windows={'1d': '1y'})
+    sleeps = []
+    replay = ReplayProvider(root=str(tmp_path), latency=0.05, sleep=sleeps.append)
+    monkeypatch.setattr(market_data, 'provider', replay)
+    monkeypatch.setattr(history_cache, 'history_cache', HistoryCache())
+
+    assert_same_bars(replay.history('TCS.NS', '1mo', '1d'), RecordingSource().history('TCS.NS', '1mo', '1d'))
+    agent = IndianStockAgent(quote_provider=FastQuoteProvider())
+    quote = agent.get_stock_info('TCS')
+    assert quote['current_price'] == 170.0 and quote['pe_ratio'] == 20.0 and quote['52_week_high'] == 200.0
+    expected_sma20 = round(make_history(70)['Close'].iloc[-20:].mean(), 2)
+    assert agent.analyze_technical_indicators('TCS')['sma20'] == expected_sma20
+    assert agent.get_stock_info('WIPRO') == {'error': 'No current data available'}
+    assert sleeps == [0.05] * replay.calls and replay.stats()['misses'] >= 1
+
+
+def test_replay_failures_are_repeatable_for_a_seed(tmp_path):
+    record(['INFY.NS'], root=str(tmp_path), source=RecordingSource(), windows={'1d': '1y'})
+
+    def outcomes(seed):
+        replay = ReplayProvider(root=str(tmp_path), failure_rate=0.3, seed=seed)
+        results = []
+        for _ in range(50):
+            try:
+                replay.history('INFY.NS', '1mo', '1d')
+                results.append(True)
+            except ReplayFailure:
+                results.append(False)
+        return results
+
+    assert outcomes(7) == outcomes(7)
+    assert outcomes(7) != outcomes(8)
+    assert 5 < outcomes(7).count(False) < 25
+
+
+def test_analysis_failures_are_logged_not_printed(monkeypatch, capsys, caplog):
+    async def gather_data(symbol):
+        raise ConnectionError('Yahoo is down')
+
+    monkeypatch.setattr(main, 'financial_agent', SimpleNamespace(gather_data=gather_data))
+    monkeypatch.setattr(main, 'refresher', make_refresher())
+
+    with caplog.at_level('DEBUG', logger='main'):
+        result = asyncio.run(main.run_analysis('TCS'))
+
+    assert result == {'error': 'Failed to analyze stock: Yahoo is down'}
+    assert [record.levelname for record in caplog.records] == ['DEBUG', 'ERROR']
+    assert caplog.records[-1].exc_info is not None
+    assert capsys.readouterr().out == ''
+
+
+def test_upstream_fallbacks_are_logged_not_printed(tmp_path, capsys, caplog):
+    def down(key):
+        raise ConnectionError('Yahoo is down')
+
+    index = SymbolIndex(paths=[write_symbols(tmp_path, 'TCS,Tata Consultancy Services Limited,EQ\n')],
+                        complete=False, probe=down)
+
+    with caplog.at_level('WARNING'):
+        assert TTLCache(down, ttl=60).get('TCS.NS') is None
+        assert index.validate('IRFC')['valid']
+
+    assert [(record.name, record.getMessage()) for record in caplog.records] == [
+        ('quotes', 'Error fetching TCS.NS: Yahoo is down'),
+        ('symbols', 'Error probing IRFC: Yahoo is down')
+    ]
+    assert capsys.readouterr().out == ''
+
+
+def test_debug_header_returns_stage_timings_and_metrics_expose_them(monkeypatch):
+    class StubQuotes(QuoteProvider):
+        def quote(self, nse_symbol):
+            return {'symbol': nse_symbol, 'current_price': 100.0}
+
+    page = '<div class="result"><h2>Headline</h2><a class="result__snippet">Snippet</a></div>'
+    search = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, text=page)))
+    agent = AsyncFinancialAnalysisAgent(AsyncWebSearchAgent(client=search, breaker=CircuitBreaker('search')),
+                                        AsyncIndianStockAgent(IndianStockAgent(quote_provider=StubQuotes())))
+    agent.groq_client = AsyncStubGroqClient(Counter())
+    monkeypatch.setattr(main, 'financial_agent', agent)
+    monkeypatch.setattr(main, 'analysis_flights', SingleFlight())
+    monkeypatch.setattr(main, 'refresher', make_refresher())
+    monkeypatch.setattr(history_cache, 'history_cache', HistoryCache(fetcher=CountingFetcher()))
+
+    async def fetch():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            plain = await client.get('/analyze/TCS')
+            debug = await client.get('/analyze/INFY', headers={'X-Debug-Timing': '1'})
+            return plain, debug, await client.get('/metrics')
+
+    plain, debug, metrics = asyncio.run(fetch())
+
+    assert 'server-timing' not in plain.headers
+    assert debug.json()['news_data'] == [{'title': 'Headline', 'snippet': 'Snippet'}]
+    stages = [entry.split(';')[0] for entry in debug.headers['server-timing'].split(', ')]
+    assert set(stages) == {'quote', 'history', 'indicators', 'news_search', 'news_parse', 'llm_queue', 'llm',
+                           'serialize', 'total'}
+    assert stages[-1] == 'total'
+
+    assert metrics.headers['content-type'].startswith('text/plain')
+    assert '# TYPE analysis_stage_seconds histogram' in metrics.text
+    assert 'analysis_stage_seconds_bucket{stage="llm",le="+Inf"}' in metrics.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/analyze/{symbol}",status="200"}' in metrics.text
+    assert 'backend_stat{name="singleflight_analyze_started"} 2.0' in metrics.text
+
+
+def test_backend_imports_without_groq_key_or_heavy_clients():
+    env = {key: value for key, value in os.environ.items() if key != 'GROQ_API_KEY'}
+    script = ("import sys, main; "
+              "print(sorted(m for m in ('autogen', 'yfinance', 'groq', 'bs4') if m in sys.modules))")
+    result = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == '[]'
+
+
+def test_analysis_degrades_to_market_data_without_groq_key(monkeypatch):
+    calls = Counter()
+    monkeypatch.setattr(stock_agents, 'GROQ_API_KEY', None)
+    agent = AsyncFinancialAnalysisAgent(AsyncStubWebAgent(calls), AsyncIndianStockAgent(StubStockAgent(calls)))
+    monkeypatch.setattr(main, 'financial_agent', agent)
+    monkeypatch.setattr(main, 'analysis_flights', SingleFlight())
+
+    async def collect():
+        return [event async for event in agent.stream_analysis('INFY')]
+
+    result = asyncio.run(main.analyze_stock('TCS'))
+    events = asyncio.run(collect())
+
+    assert result['analysis'] == stock_agents.AI_UNAVAILABLE_MESSAGE
+    assert result['stock_data']['symbol'] == 'TCS.NS'
+    assert events[-1] == ('analysis', stock_agents.AI_UNAVAILABLE_MESSAGE)
+    assert main.health_check()['ai_analysis'] == 'unavailable'
+
+
+def test_trending_answers_304_until_snapshot_changes(monkeypatch):
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(history_cache, 'history_cache', HistoryCache(fetcher=CountingFetcher(days=10)))
+    monkeypatch.setattr(main, 'trending_flights', SingleFlight())
+    monkeypatch.setattr(main, 'refresher', make_refresher(clock=lambda: now[0]))
+
+    async def fetch():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            first = await client.get('/trending')
+            etag = first.headers['etag']
+            now[0] += 10
+            unchanged = await client.get('/trending', headers={'If-None-Match': etag})
+            await main.refresher.refresh_once()
+            changed = await client.get('/trending', headers={'If-None-Match': etag})
+            return first, unchanged, changed
+
+    first, unchanged, changed = asyncio.run(fetch())
+
+    assert first.status_code == 200 and first.json()['top_movers']
+    assert unchanged.status_code == 304 and unchanged.content == b'' and unchanged.headers['etag'] == first.headers['etag']
+    assert changed.status_code == 200 and changed.headers['etag'] != first.headers['etag']
+
+
+def test_large_responses_are_compressed_and_streams_are_not(monkeypatch):
+    class VerboseGroqClient(AsyncStubGroqClient):
+        async def _create(self, **kwargs):
+            if kwargs.get('stream'):
+                return await super()._create(**kwargs)
+            message = SimpleNamespace(content='Detailed analysis. ' * 200)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    calls = Counter()
+    agent = make_async_stub_financial_agent(calls)
+    agent.groq_client = VerboseGroqClient(calls)
+    monkeypatch.setattr(main, 'financial_agent', agent)
+    monkeypatch.setattr(main, 'analysis_flights', SingleFlight())
+    monkeypatch.setattr(main, 'refresher', make_refresher())
+
+    async def fetch():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test',
+                                     headers={'Accept-Encoding': 'gzip'}) as client:
+            return (await client.get('/analyze/TCS'), await client.get('/health'),
+                    await client.get('/analyze/TCS/stream'))
+
+    analysis, health, stream = asyncio.run(fetch())
+
+    assert analysis.headers['content-encoding'] == 'gzip'
+    assert int(analysis.headers['content-length']) < len(analysis.content) / 4
+    assert analysis.json()['analysis'].startswith('Detailed analysis.')
+    assert analysis.json()['news_data'] == [{'title': 'Headline', 'snippet': 'Snippet'}]
+    assert 'content-encoding' not in health.headers
+    assert 'content-encoding' not in stream.headers
+    assert parse_sse(stream.text)[-1] == ('done', None)
+
+
+def test_prompt_is_compact_and_fits_the_token_budget():
+    stock = {'symbol': 'TCS.NS', 'current_price': 3500.5, 'day_low': 'N/A', 'pe_ratio': None,
+             'last_updated': '2024-01-01 10:00:00'}
+    technical = {'error': 'Insufficient data points. Got 20, need at least 50'}
+    news = [{'title': f"Headline {i}", 'snippet': 'word ' * 200} for i in range(8)]
+    news.insert(1, {'title': 'headline 0 ', 'snippet': 'Repeated story'})
+
+    messages = build_analysis_messages('TCS', stock, technical, news, budget=10 ** 6)
+    prompt = messages[1]['content']
+
+    assert 'Quote: {"current_price":3500.5}' in prompt
+    assert 'N/A' not in prompt and 'last_updated' not in prompt and 'Insufficient' not in prompt
+    assert 'Unavailable: technical indicators.' in prompt
+    assert prompt.count('- Headline') == 8 and 'Repeated story' not in prompt
+    assert max(len(line) for line in prompt.splitlines()) < 300
+    assert prompt.count('target price and stop loss') == 1
+
+    budget = count_message_tokens(messages) - 50
+    trimmed = build_analysis_messages('TCS', stock, technical, news, budget=budget)
+    assert count_message_tokens(trimmed) <= budget
+    assert 0 < trimmed[1]['content'].count('- Headline') < 8
+    assert estimate_tokens('RSI 55.2') == 5
+
+
+def test_llm_token_usage_is_recorded_per_call(monkeypatch, caplog):
+    class ReportingGroqClient(AsyncStubGroqClient):
+        async def _create(self, **kwargs):
+            completion = await super()._create(**kwargs)
+            completion.usage = SimpleNamespace(prompt_tokens=321, completion_tokens=45)
+            return completion
+
+    agent = make_async_stub_financial_agent(Counter())
+    agent.groq_client = ReportingGroqClient(Counter())
+    before = tracing.llm_tokens.count('prompt')
+
+    with caplog.at_level('INFO', logger='prompts'):
+        result = asyncio.run(agent.analyze_stock('TCS'))
+
+    assert result['analysis'] == 'Stub analysis'
+    assert tracing.llm_tokens.count('prompt') == before + 1
+    usage = [record.getMessage() for record in caplog.records if record.name == 'prompts']
+    assert len(usage) == 1 and usage[0].startswith('LLM TCS: 321 prompt + 45 completion tokens (reported)')
+
+
+class StubGroqServer:
+    """Local Groq chat completions endpoint allowing `limit` requests per `window` seconds, else 429."""
+
+    def __init__(self, limit, window, retry_after='0.2'):
+        self.accepted = []
+        self.rejected = 0
+        lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                now = time.monotonic()
+                with lock:
+                    allowed = sum(1 for at in server.accepted if now - at < window) < limit
+                    if allowed:
+                        server.accepted.append(now)
+                    else:
+                        server.rejected += 1
+                if allowed:
+                    status, headers, body = 200, {}, {
+                        'id': 'stub', 'object': 'chat.completion', 'created': 0, 'model': request['model'],
+                        'choices': [{'index': 0, 'finish_reason': 'stop',
+                                     'message': {'role': 'assistant', 'content': 'Stub analysis'}}],
+                        'usage': {'prompt_tokens': 100, 'completion_tokens': 2, 'total_tokens': 102}
+                    }
+                else:
+                    status, headers, body = 429, {'retry-after': retry_after}, {
+                        'error': {'message': 'Rate limit reached', 'type': 'requests', 'code': 'rate_limit_exceeded'}
+                    }
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def test_llm_dispatcher_paces_calls_and_retries_429s_from_groq():
+    from groq import AsyncGroq
+
+    def run_burst(dispatcher, server):
+        agent = make_async_stub_financial_agent(Counter())
+        agent.groq_client = AsyncGroq(api_key='test-key', base_url=server.url, max_retries=0)
+        agent.llm_dispatcher = dispatcher
+        data = {'stock_data': {'current_price': 100.0}, 'technical_data': {}, 'news_data': []}
+
+        async def burst():
+            return await asyncio.gather(*(agent.analyze_stock(f"SYM{i}", data) for i in range(6)))
+
+        try:
+            return asyncio.run(burst())
+        finally:
+            server.close()
+
+    # Paced to the server's limit: no 429s at all
+    server = StubGroqServer(limit=3, window=0.45)
+    paced = LLMDispatcher(requests_per_minute=300, tokens_per_minute=10 ** 6, max_concurrency=4, burst=1)
+    results = run_burst(paced, server)
+    assert [result['analysis'] for result in results] == ['Stub analysis'] * 6
+    assert server.rejected == 0 and paced.stats()['rate_limited'] == 0
+
+    # Limits set too high: the 429s are retried after Retry-After instead of failing the analyses
+    server = StubGroqServer(limit=3, window=0.45)
+    eager = LLMDispatcher(requests_per_minute=10 ** 6, tokens_per_minute=10 ** 6, max_concurrency=6, max_retries=5)
+    results = run_burst(eager, server)
+    stats = eager.stats()
+    assert [result['analysis'] for result in results] == ['Stub analysis'] * 6
+    assert server.rejected >= 3 and stats['rate_limited'] == server.rejected == stats['retries']
+    assert stats['in_flight'] == 0 and stats['dispatched'] == 6 + stats['retries']
+
+
+class RateLimitedError(Exception):
+    status_code = 429
+    response = SimpleNamespace(headers={'retry-after': '0'})
+
+
+def test_llm_dispatcher_charges_tokens_once_and_refunds_failures():
+    dispatcher = LLMDispatcher(requests_per_minute=10 ** 6, tokens_per_minute=1000, clock=lambda: 0.0)
+    attempts = []
+
+    async def rate_limited_once():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RateLimitedError()
+        return 'done'
+
+    async def failing():
+        raise ConnectionError('Groq is down')
+
+    async def run():
+        assert await dispatcher.call(rate_limited_once, 100) == 'done'
+        with pytest.raises(ConnectionError):
+            await dispatcher.call(failing, 100)
+
+    asyncio.run(run())
+
+    # The 429 and the failed call are refunded; only the successful attempt holds its reservation
+    assert len(attempts) == 2 and dispatcher.stats()['retries'] == 1
+    assert dispatcher.tokens.level == 900
+    dispatcher.settle(100, 40)
+    assert dispatcher.tokens.level == 960
+
+
+def test_llm_dispatcher_sends_nothing_until_retry_after_has_passed():
+    dispatcher = LLMDispatcher(requests_per_minute=10 ** 6, tokens_per_minute=10 ** 6, max_concurrency=1)
+    sent = []
+
+    class RetryAfterError(RateLimitedError):
+        response = SimpleNamespace(headers={'retry-after': '0.3'})
+
+    async def create(name):
+        sent.append((name, time.monotonic()))
+        await asyncio.sleep(0.01)
+        if len(sent) == 1:
+            raise RetryAfterError()
+        return name
+
+    async def run():
+        return await asyncio.gather(dispatcher.call(lambda: create('first'), 10),
+                                    dispatcher.call(lambda: create('second'), 10))
+
+    assert asyncio.run(run()) == ['first', 'second']
+
+    # The queued call is held back along with the retry, instead of taking the freed slot
+    assert [name for name, _ in sent] == ['first', 'first', 'second']
+    assert min(at for _, at in sent[1:]) - sent[0][1] >= 0.25
+    assert dispatcher.stats()['rate_limited'] == 1
+
+
+def test_sync_analysis_goes_through_the_dispatcher_and_settles_failures():
+    calls = Counter()
+    agent = make_stub_financial_agent(calls)
+    agent.llm_dispatcher = LLMDispatcher(requests_per_minute=10 ** 6, tokens_per_minute=10 ** 5, clock=lambda: 0.0)
+
+    assert agent.analyze_stock('TCS')['analysis'] == 'Stub analysis'
+    stats = agent.llm_dispatcher.stats()
+    assert calls['llm'] == 1 and stats['dispatched'] == 1 and stats['in_flight'] == 0
+    used = 10 ** 5 - agent.llm_dispatcher.tokens.level
+    assert 0 < used < COMPLETION_TOKEN_RESERVE
+
+    # A completion that cannot be read hands its whole reservation back
+    agent.groq_client.chat.completions.create = lambda **kwargs: SimpleNamespace(choices=[])
+    assert 'error' in agent.analyze_stock('INFY')
+    assert agent.llm_dispatcher.tokens.level == 10 ** 5 - used
+
+
+def test_llm_dispatcher_is_shared_safely_by_threads_and_an_event_loop():
+    dispatcher = LLMDispatcher(requests_per_minute=10 ** 6, tokens_per_minute=10 ** 6, max_concurrency=4)
+    lock = threading.Lock()
+    active = Counter()
+
+    def create():
+        with lock:
+            active['now'] += 1
+            active['peak'] = max(active['peak'], active['now'])
+        time.sleep(0.001)
+        with lock:
+            active['now'] -= 1
+        return 'done'
+
+    async def create_async():
+        return await asyncio.to_thread(create)
+
+    async def run_async():
+        return await asyncio.gather(*(dispatcher.call(create_async, 10) for _ in range(16)))
+
+    with ThreadPoolExecutor(max_workers=9) as pool:
+        # Eight threads of blocking callers, plus async callers on an event loop of their own
+        sync = [pool.submit(lambda: [dispatcher.call_sync(create, 10) for _ in range(16)]) for _ in range(8)]
+        on_loop = pool.submit(asyncio.run, run_async())
+        results = [f.result(timeout=30) for f in sync] + [on_loop.result(timeout=30)]
+
+    assert results == [['done'] * 16] * 9
+    stats = dispatcher.stats()
+    assert stats['dispatched'] == 144 and stats['in_flight'] == 0
+    assert sum(stats['queued'].values()) == 0 and 1 < active['peak'] <= 4
+
+
+def test_llm_dispatcher_orders_by_priority_and_bounds_its_queue():
+    dispatcher = LLMDispatcher(requests_per_minute=10 ** 6, tokens_per_minute=6000, max_concurrency=1, max_queue=2)
+    order = []
+
+    async def call(name, priority, tokens=10):
+        try:
+            return await dispatcher.call(lambda: record(name), tokens, priority)
+        except LLMQueueFull:
+            return f"{name} rejected"
+
+    async def record(name):
+        order.append(name)
+        await asyncio.sleep(0.01)
+        return name
+
+    async def run():
+        first = asyncio.ensure_future(call('first', INTERACTIVE))
+        await asyncio.sleep(0)
+        queued = [asyncio.ensure_future(call('batch', BATCH)),
+                  asyncio.ensure_future(call('second batch', BATCH))]
+        await asyncio.sleep(0)
+        # The queue is full: an interactive call displaces the newest batch one, another batch call is turned away
+        queued += [asyncio.ensure_future(call('interactive', INTERACTIVE)),
+                   asyncio.ensure_future(call('late batch', BATCH))]
+        results = await asyncio.gather(first, *queued)
+
+        # The first call used the whole minute's tokens, so the next waits for 20 to refill (0.2s)
+        start = time.monotonic()
+        await call('drain', INTERACTIVE, tokens=6000)
+        await call('after refill', INTERACTIVE, tokens=20)
+        return results, time.monotonic() - start
+
+    results, refill_wait = asyncio.run(run())
+
+    assert results == ['first', 'batch', 'second batch rejected', 'interactive', 'late batch rejected']
+    assert order[:3] == ['first', 'interactive', 'batch']
+    assert 0.15 < refill_wait < 1.0
+    stats = dispatcher.stats()
+    assert stats['rejected'] == 2 and stats['max_queue_depth'] == 2 and stats['waited'] >= 2
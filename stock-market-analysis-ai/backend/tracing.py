@@ -0,0 +1,157 @@
+"""
+Per-stage timing spans and Prometheus metrics.
+
+`span(stage)` times a block of work and records it in the `analysis_stage_seconds`
+histogram. The HTTP middleware starts a Trace for every request; spans opened
+while it is active are also added to it, so one request's stage breakdown can be
+returned with the response. The trace lives in a context variable, which tasks and
+asyncio.to_thread copy, so stages run in worker threads are attributed as well.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Upper bounds in seconds, from a cache hit to a slow LLM completion
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_text(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, rendered in the Prometheus text format."""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[position] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def count(self, *label_values: str) -> int:
+        with self._lock:
+            series = self._series.get(label_values)
+            return series[-2] if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            names = self.labels + ('le',)
+            for bound, count in zip(self.buckets, values):
+                lines.append(f"{self.name}_bucket{_label_text(names, label_values + (repr(bound),))} {count}")
+            lines.append(f"{self.name}_bucket{_label_text(names, label_values + ('+Inf',))} {values[-2]}")
+            labels = _label_text(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {values[-1]:.6f}")
+            lines.append(f"{self.name}_count{labels} {values[-2]}")
+        return lines
+
+
+stage_seconds = Histogram('analysis_stage_seconds', 'Time spent in each stage of serving a request.', ('stage',))
+request_seconds = Histogram('http_request_duration_seconds', 'HTTP request latency by route.',
+                            ('method', 'route', 'status'))
+llm_tokens = Histogram('llm_tokens', 'Prompt and completion tokens per Groq call.', ('kind',),
+                       (64, 128, 256, 512, 1024, 2048, 4096, 8192))
+llm_queue_seconds = Histogram('llm_queue_wait_seconds', 'Time Groq calls wait in the dispatcher queue, by priority.',
+                              ('priority',))
+
+
+class Trace:
+    """Spans recorded for one request: (stage, start offset, duration) in seconds."""
+    __slots__ = ('started', 'spans', '_lock')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: List[Tuple[str, float, float]] = []
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, start: float, duration: float) -> None:
+        with self._lock:
+            self.spans.append((stage, start - self.started, duration))
+
+    def totals(self) -> Dict[str, float]:
+        """Seconds per stage, summed over repeated spans, in order of first appearance."""
+        totals: Dict[str, float] = {}
+        with self._lock:
+            for stage, _, duration in self.spans:
+                totals[stage] = totals.get(stage, 0.0) + duration
+        return totals
+
+    def server_timing(self, total: Optional[float] = None) -> str:
+        """The breakdown as a Server-Timing header value (durations in ms)."""
+        entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.totals().items()]
+        if total is not None:
+            entries.append(f"total;dur={total * 1000:.1f}")
+        return ', '.join(entries)
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar('trace', default=None)
+
+
+@contextmanager
+def trace() -> Iterator[Trace]:
+    """Collect the spans opened in this context (and tasks or threads started from it)."""
+    current = Trace()
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        stage_seconds.observe(duration, stage)
+        current = _current_trace.get()
+        if current is not None:
+            current.add(stage, start, duration)
+
+
+def _stat_lines(prefix: str, stats: Dict, lines: List[str]) -> None:
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            _stat_lines(name, value, lines)
+        elif isinstance(value, (bool, int, float)):
+            lines.append(f"backend_stat{{name=\"{_escape(name)}\"}} {float(value)}")
+
+
+def render_metrics(stats: Optional[Dict] = None) -> str:
+    """Histograms plus every numeric counter in `stats` (e.g. the /cache/stats payload)."""
+    lines = (stage_seconds.render() + request_seconds.render() + llm_tokens.render()
+             + llm_queue_seconds.render())
+    if stats:
+        lines += ['# HELP backend_stat Cache and limiter counters, as reported by /cache/stats.',
+                  '# TYPE backend_stat gauge']
+        for component, values in stats.items():
+            if isinstance(values, dict):
+                _stat_lines(component, values, lines)
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,64 @@
+import os
+import re
+from functools import lru_cache
+from typing import Optional
+
+import pandas as pd
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Bundled NIFTY 50 / NIFTY Next 50 constituents, the source of NIFTY50 and NIFTY100 membership
+UNIVERSE_CSV = os.path.join(DATA_DIR, 'nifty_universe.csv')
+# Optional NSE index list (e.g. ind_nifty500list.csv) merged in as a wider level;
+# NIFTY500 is only available from such a list
+EXTRA_UNIVERSE_CSV = os.getenv('NIFTY_UNIVERSE_CSV')
+
+# Each index contains every symbol of the indices before it
+INDEX_LEVELS = ['NIFTY50', 'NIFTY100', 'NIFTY500']
+
+
+def _index_of_list(path: str) -> str:
+    """Index named by an NSE list file such as ind_nifty100list.csv, else the widest level"""
+    match = re.search(r'nifty(\d+)list', os.path.basename(path).lower())
+    name = f"NIFTY{match.group(1)}" if match else None
+    return name if name in INDEX_LEVELS else INDEX_LEVELS[-1]
+
+
+def _read_list(path: str) -> pd.DataFrame:
+    frame = pd.read_csv(path)
+    frame.columns = [column.strip().lower() for column in frame.columns]
+    sector_column = 'sector' if 'sector' in frame.columns else 'industry'
+    frame = frame.rename(columns={sector_column: 'sector'})
+    frame['symbol'] = frame['symbol'].str.strip().str.upper()
+    frame['sector'] = frame['sector'].fillna('Unknown').str.strip()
+    if 'index' not in frame.columns:
+        # NSE index lists have no membership column; the file name says which index it is
+        frame['index'] = _index_of_list(path)
+    frame['index'] = frame['index'].str.strip().str.upper()
+    return frame[['symbol', 'sector', 'index']]
+
+
+@lru_cache(maxsize=None)
+def _read_universe(path: str, extra: Optional[str] = None) -> pd.DataFrame:
+    frames = [_read_list(path)] + ([_read_list(extra)] if extra else [])
+    frame = pd.concat(frames, ignore_index=True)
+    # A symbol listed by both files belongs to the narrower index, and keeps the bundled sector
+    frame['level'] = frame['index'].map({name: level for level, name in enumerate(INDEX_LEVELS)})
+    frame = frame.sort_values('level', kind='stable').drop_duplicates('symbol')
+    return frame.sort_index().drop(columns='level').reset_index(drop=True)
+
+
+def load_universe(index: str = 'NIFTY50', path: str = UNIVERSE_CSV,
+                  extra: Optional[str] = EXTRA_UNIVERSE_CSV) -> pd.Series:
+    """Return a symbol -> sector Series for the requested index."""
+    index = index.upper()
+    if index not in INDEX_LEVELS:
+        raise ValueError(f"Unknown index {index}. Expected one of {', '.join(INDEX_LEVELS)}")
+    frame = _read_universe(path, extra)
+    if not frame['index'].eq(index).any():
+        available = [level for level in INDEX_LEVELS if frame['index'].eq(level).any()]
+        raise ValueError(f"No {index} constituents; set NIFTY_UNIVERSE_CSV to NSE's index list. "
+                         f"Available: {', '.join(available)}")
+    levels = INDEX_LEVELS[:INDEX_LEVELS.index(index) + 1]
+    members = frame[frame['index'].isin(levels)]
+    return pd.Series(members['sector'].values, index=members['symbol'].values, name='sector')
@@ -1,10 +1,2 @@
-import yfinance as yf
-
-def verify_stock_data(symbol: str) -> bool:
-    try:
-        nse_symbol = f"{symbol}.NS"
-        stock = yf.Ticker(nse_symbol)
-        hist = stock.history(period='1mo')
-        return not hist.empty
-    except:
-        return False
\ No newline at end of file
+# Kept for older imports; symbol checks now live in the local symbol index
+from symbols import verify_stock_data
@@ -1,16 +1,26 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+import json
 import os
+import time
 import pandas as pd
 
 # Backend URL Configuration
 BACKEND_URL = os.getenv('BACKEND_URL', 'https://stock-analysis-agent.onrender.com')
 
+# Seconds a backend response is reused across reruns before it is revalidated or refetched
+TRENDING_TTL = int(os.getenv('TRENDING_CACHE_TTL', '60'))
+ANALYSIS_TTL = int(os.getenv('ANALYSIS_CACHE_TTL', '300'))
+
 # Initialize session state if not exists
 if 'current_page' not in st.session_state:
     st.session_state.current_page = "🔥 Trending Stocks"
 if 'symbol_to_analyze' not in st.session_state:
     st.session_state.symbol_to_analyze = ""
+if 'analyses' not in st.session_state:
+    # symbol -> (time, streamed events), so reruns and page switches do not re-run the analysis
+    st.session_state.analyses = {}
 
 # Title of the App
 st.title("📊 Indian Stock Market Analysis Tool")
@@ -20,6 +30,102 @@ def analyze_stock_callback(symbol):
     st.session_state.symbol_to_analyze = symbol
     st.session_state.current_page = "📈 Stock Analysis"
 
+
+class BackendError(Exception):
+    def __init__(self, status_code, content):
+        super().__init__(f"Backend returned status {status_code}")
+        self.status_code = status_code
+        self.content = content
+
+
+@st.cache_resource
+def backend_session():
+    """One pooled session for every rerun and user, so connections to the backend are reused."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=16)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+@st.cache_resource
+def validated_responses():
+    """URL -> (ETag, body) of the last good response, for conditional requests."""
+    return {}
+
+
+def get_json(path, params=None):
+    """GET a backend JSON endpoint, sending If-None-Match so an unchanged body comes back as a 304."""
+    url = f"{BACKEND_URL}{path}"
+    key = requests.Request('GET', url, params=params).prepare().url
+    known = validated_responses().get(key)
+    headers = {'If-None-Match': known[0]} if known else {}
+    response = backend_session().get(url, params=params, headers=headers)
+    if response.status_code == 304 and known:
+        return known[1]
+    if response.status_code != 200:
+        raise BackendError(response.status_code, response.content)
+    body = response.json()
+    if response.headers.get('ETag'):
+        validated_responses()[key] = (response.headers['ETag'], body)
+    return body
+
+
+@st.cache_data(ttl=TRENDING_TTL, show_spinner=False)
+def load_trending():
+    return get_json("/trending")
+
+
+def stream_analysis(symbol):
+    """Yield (event, payload) pairs from the backend's Server-Sent Events stream."""
+    with backend_session().get(f"{BACKEND_URL}/analyze/{symbol}/stream", stream=True) as response:
+        if response.status_code != 200:
+            raise BackendError(response.status_code, response.content)
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                yield event, json.loads(line[len("data: "):])
+
+
+def render_section(placeholder, data, missing_message):
+    """Render a dict of values in two columns inside a placeholder."""
+    with placeholder.container():
+        if not isinstance(data, dict) or not data:
+            st.error(missing_message)
+        elif 'error' in data:
+            st.error(data['error'])
+        else:
+            col1, col2 = st.columns(2)
+            keys = list(data.keys())
+            mid = len(keys) // 2
+            
+            with col1:
+                for key in keys[:mid]:
+                    st.write(f"**{key.replace('_', ' ').capitalize()}:** {data[key]}")
+            with col2:
+                for key in keys[mid:]:
+                    st.write(f"**{key.replace('_', ' ').capitalize()}:** {data[key]}")
+
+
+def cached_analysis(symbol):
+    """Events of this session's last complete analysis of `symbol`, while younger than ANALYSIS_TTL."""
+    entry = st.session_state.analyses.get(symbol)
+    if entry is None or time.time() - entry[0] > ANALYSIS_TTL:
+        return None
+    return entry[1]
+
+
+def render_news(placeholder, news_data):
+    with placeholder.container():
+        if not news_data:
+            st.info("No recent news found")
+        else:
+            for news in news_data:
+                with st.expander(news['title'] if news['title'] else "Untitled"):
+                    st.write(news['snippet'])
+
 # Sidebar for navigation
 page = st.sidebar.selectbox(
     "Choose a Page",
@@ -35,11 +141,14 @@ if page == "🔥 Trending Stocks":
     st.header("Trending Stocks in Indian Market")
     
     try:
-        # Fetch trending stocks data from backend
-        response = requests.get(f"{BACKEND_URL}/trending")
+        # Fetch trending stocks data from backend, reusing it across reruns for TRENDING_TTL
+        trending_data = load_trending()
         
-        if response.status_code == 200:
-            trending_data = response.json()
+        if 'error' not in trending_data:
+            if 'as_of' in trending_data:
+                # Age from as_of, since a revalidated snapshot keeps the age it was first served with
+                age = time.time() - pd.Timestamp(trending_data['as_of']).timestamp()
+                st.caption(f"Data as of {trending_data['as_of']} ({age:.0f}s ago)")
             
             # Display Top Movers
             st.subheader("📈 Top Movers (Last 5 Days)")
@@ -101,8 +210,10 @@ if page == "🔥 Trending Stocks":
                     st.write(f"{sector}: {performance}%")
             
         else:
-            st.error("Failed to fetch trending stocks data.")
+            st.error(f"Failed to fetch trending stocks data: {trending_data['error']}")
             
+    except BackendError as e:
+        st.error(f"Failed to fetch trending stocks data. Status code: {e.status_code}")
     except Exception as e:
         st.error(f"Error fetching trending stocks: {str(e)}")
 
@@ -120,80 +231,49 @@ else:  # Stock Analysis page
     # Only show analysis if we have a symbol
     if symbol:  # Check if symbol exists and is not empty
         try:
-            with st.spinner(f'Analyzing {symbol}...'):
-                response = requests.get(f"{BACKEND_URL}/analyze/{symbol}")
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    
-                    # Create tabs for different sections
-                    tabs = st.tabs(["Stock Data", "Technical Analysis", "News", "AI Analysis"])
-                    
-                    # Stock Data Tab
-                    with tabs[0]:
-                        st.subheader("📈 Stock Data")
-                        if 'error' in data.get('stock_data', {}):
-                            st.error(data['stock_data']['error'])
-                        else:
-                            col1, col2 = st.columns(2)
-                            stock_data = data['stock_data']
-                            keys = list(stock_data.keys())
-                            mid = len(keys) // 2
-                            
-                            with col1:
-                                for key in keys[:mid]:
-                                    st.write(f"**{key.replace('_', ' ').capitalize()}:** {stock_data[key]}")
-                            with col2:
-                                for key in keys[mid:]:
-                                    st.write(f"**{key.replace('_', ' ').capitalize()}:** {stock_data[key]}")
-                    
-                    # Technical Analysis Tab
-                    with tabs[1]:
-                        st.subheader("📊 Technical Indicators")
-                        if 'technical_data' not in data:
-                            st.error("Technical analysis data not available")
-                        elif 'error' in data['technical_data']:
-                            st.error(data['technical_data']['error'])
-                        else:
-                            col1, col2 = st.columns(2)
-                            tech_data = data['technical_data']
-                            keys = list(tech_data.keys())
-                            mid = len(keys) // 2
-                            
-                            with col1:
-                                for key in keys[:mid]:
-                                    st.write(f"**{key.replace('_', ' ').capitalize()}:** {tech_data[key]}")
-                            with col2:
-                                for key in keys[mid:]:
-                                    st.write(f"**{key.replace('_', ' ').capitalize()}:** {tech_data[key]}")
-                    
-                    # News Tab
-                    with tabs[2]:
-                        st.subheader("📰 Recent News")
-                        if 'news_data' not in data:
-                            st.error("News data not available")
-                        elif not data['news_data']:
-                            st.info("No recent news found")
-                        else:
-                            for news in data['news_data']:
-                                with st.expander(news['title'] if news['title'] else "Untitled"):
-                                    st.write(news['snippet'])
-                    
-                    # AI Analysis Tab
-                    with tabs[3]:
-                        st.subheader("🤖 AI Analysis")
-                        if 'analysis' not in data:
-                            st.error("AI analysis not available")
-                        elif isinstance(data['analysis'], str):
-                            st.write(data['analysis'])
-                        else:
-                            st.error("Invalid AI analysis format")
-                
-                else:
-                    st.error(f"Failed to fetch data from the backend. Status code: {response.status_code}")
-                    if response.content:
-                        st.error(f"Error details: {response.content}")
+            # Create tabs for different sections, filled in as the backend streams them
+            tabs = st.tabs(["Stock Data", "Technical Analysis", "News", "AI Analysis"])
+            placeholders = {}
+            for tab, (event, title) in zip(tabs, [
+                ('stock_data', "📈 Stock Data"),
+                ('technical_data', "📊 Technical Indicators"),
+                ('news_data', "📰 Recent News"),
+                ('analysis', "🤖 AI Analysis")
+            ]):
+                with tab:
+                    st.subheader(title)
+                    placeholders[event] = st.empty()
+                    placeholders[event].info(f"Analyzing {symbol}...")
+
+            # Replay a recent analysis of this symbol instead of asking the backend again
+            symbol = symbol.strip().upper()
+            cached = cached_analysis(symbol)
+            events = cached if cached is not None else stream_analysis(symbol)
+            received = []
+            analysis_text = ""
+            for event, payload in events:
+                received.append((event, payload))
+                if event == 'stock_data':
+                    render_section(placeholders['stock_data'], payload, "Stock data not available")
+                elif event == 'technical_data':
+                    render_section(placeholders['technical_data'], payload, "Technical analysis data not available")
+                elif event == 'news_data':
+                    render_news(placeholders['news_data'], payload)
+                elif event == 'analysis':
+                    analysis_text += payload
+                    placeholders['analysis'].markdown(analysis_text)
+                elif event == 'error':
+                    placeholders['analysis'].error(payload)
+                elif event == 'done' and not analysis_text:
+                    placeholders['analysis'].error("AI analysis not available")
+            complete = received and received[-1][0] == 'done' and all(event != 'error' for event, _ in received)
+            if cached is None and complete:
+                st.session_state.analyses[symbol] = (time.time(), received)
                 
+        except BackendError as e:
+            st.error(f"Failed to fetch data from the backend. Status code: {e.status_code}")
+            if e.content:
+                st.error(f"Error details: {e.content}")
         except requests.exceptions.ConnectionError:
             st.error("Failed to connect to the backend. Please ensure the backend is running.")
         except requests.exceptions.RequestException as e:
@@ -204,10 +284,11 @@ else:  # Stock Analysis page
     else:
         st.info("Enter a stock symbol above and press Enter to analyze")
 
-    # Add analyze button after the text input
+    # Add analyze button after the text input; it runs a fresh analysis instead of the cached one
     if st.button("Analyze Stock"):
         if symbol:
-            st.experimental_rerun()
+            st.session_state.analyses.pop(symbol.strip().upper(), None)
+            st.rerun()
         else:
             st.warning("Please enter a valid stock symbol.")
 